@@ -3,15 +3,24 @@ Vision AI - Chat Interface
 Clean minimal UI - ready for redesign.
 """
 import streamlit as st
-from PIL import Image
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import time
 import base64
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, List, Any
 
+from backend.assets import DecodeBusy, ImageAsset, load_asset
 from backend.chain import VisionChain
-from langchain_core.chat_history import InMemoryChatMessageHistory
-from langchain_core.messages import HumanMessage, AIMessage
+from backend.events import TokenEvent, ErrorEvent
+from backend.history import ChatHistory
+from backend.sessions import session_manager
+from backend.tracing import span
+from backend.utils import ImageRejected
+from frontend.profiling import start_rerun, finish_rerun, profile_section, render_profile_panel
+from frontend.question_set import create_panels, render_question_set_form, render_question_set_results
+from frontend.region import render_region_controls
+from frontend.search import apply_open_hit, get_search_index
+from frontend.transcript import render_transcript
 from frontend.ui_components import render_sidebar, render_welcome_screen
 from frontend.base_config import get_base_css
 
@@ -40,65 +49,90 @@ def initialize_session_state():
     if "active_conversation_id" not in st.session_state:
         st.session_state.active_conversation_id = None
     
-    if "chat_memory" not in st.session_state:
-        st.session_state.chat_memory = InMemoryChatMessageHistory()
-    
     if "vision_chain" not in st.session_state:
-        st.session_state.vision_chain = VisionChain(st.session_state.chat_memory)
+        st.session_state.vision_chain = VisionChain(ChatHistory())
+
+    if "last_uploaded_file_id" not in st.session_state:
+        st.session_state.last_uploaded_file_id = None
+
+
+def attach_session():
+    """
+    Register this browser session with the session manager and mark a rerun.
+    If the session was evicted while idle, rebind memory to the restored history.
+    """
+    handle = st.session_state.get("session_handle")
+    if handle is None:
+        ctx = get_script_run_ctx()
+        session_id = ctx.session_id if ctx is not None else "local"
+        handle = session_manager.register(session_id, st.session_state.conversations)
+        # Eviction must also drop the session's other references to its histories and images
+        handle.on_evict(st.session_state.vision_chain.release)
+        handle.on_evict(get_search_index().clear)
+        st.session_state.session_handle = handle
+    
+    if session_manager.begin(handle):
+        conversation_id = st.session_state.active_conversation_id
+        if conversation_id in st.session_state.conversations:
+            switch_conversation(conversation_id)
+        else:
+            st.session_state.active_conversation_id = None
+            bind_memory(ChatHistory())
 
-    if "last_uploaded_image_name" not in st.session_state:
-        st.session_state.last_uploaded_image_name = None
 
+def detach_session():
+    """Mark the end of this session's rerun."""
+    handle = st.session_state.get("session_handle")
+    if handle is not None:
+        session_manager.end(handle)
 
-def create_conversation(image: Image.Image, image_name: str) -> str:
-    """Create a new conversation."""
+
+def create_conversation(asset: ImageAsset, image_name: str) -> str:
+    """
+    Create a new conversation.
+    Near-duplicate uploads share one asset (image, thumbnail, encoded payload).
+    """
     conversation_id = f"conv_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     
     st.session_state.conversations[conversation_id] = {
         "title": image_name,
-        "image": image,
+        "asset": asset,
         "image_name": image_name,
-        "messages": [],
+        "history": ChatHistory(),
         "created_at": datetime.now().isoformat()
     }
     
     return conversation_id
 
 
+def bind_memory(memory: ChatHistory):
+    """Point the vision chain (the session's chat memory) at a history object."""
+    st.session_state.vision_chain.memory = memory
+
+
 def switch_conversation(conversation_id: str):
-    """Switch to a different conversation and rebuild LangChain memory."""
+    """
+    Switch to a different conversation.
+    The conversation's history becomes the chain memory directly (no copy).
+    """
     if conversation_id not in st.session_state.conversations:
         return
     
     st.session_state.active_conversation_id = conversation_id
-    st.session_state.chat_memory.clear()
-    
-    conversation = st.session_state.conversations[conversation_id]
-    for msg in conversation["messages"]:
-        if isinstance(msg, HumanMessage):
-            st.session_state.chat_memory.add_user_message(msg.content)
-        elif isinstance(msg, AIMessage):
-            st.session_state.chat_memory.add_ai_message(msg.content)
+    bind_memory(st.session_state.conversations[conversation_id]["history"])
 
 
-def add_message_to_conversation(role: str, content: str):
+def update_conversation_title(content: str):
     """
-    Add message to active conversation (UI storage only).
-    IMPORTANT: Does NOT touch LangChain memory.
+    Title the active conversation after its first user message.
+    Messages themselves are stored by the chain in the conversation history.
     """
     if not st.session_state.active_conversation_id:
         return
     
-    if role == "human":
-        message = HumanMessage(content=content)
-    else:
-        message = AIMessage(content=content)
-    
     conversation = st.session_state.conversations[st.session_state.active_conversation_id]
-    conversation["messages"].append(message)
     
-    # Update title with first user message
-    if role == "human" and len(conversation["messages"]) == 1:
+    if len(conversation["history"]) == 0:
         title_text = content[:27] + ("..." if len(content) > 27 else "")
         conversation["title"] = f"🔍 {title_text}"
 
@@ -110,17 +144,8 @@ def get_active_conversation() -> Dict[str, Any]:
     return st.session_state.conversations.get(st.session_state.active_conversation_id)
 
 
-def main():
-    """Main chat application logic."""
-    initialize_session_state()
-    
-    # Handle conversation switching from sidebar
-    if "switch_to_conversation" in st.session_state:
-        conv_id = st.session_state.switch_to_conversation
-        switch_conversation(conv_id)
-        del st.session_state.switch_to_conversation
-    
-    # Branded Header with Banner Background
+def render_header():
+    """Render the branded header with banner background."""
     st.markdown("""
         <div style="
             background: linear-gradient(135deg, #9a1b74 0%, #ff6ec7 100%);
@@ -162,95 +187,237 @@ def main():
             </div>
         </div>
     """.format(banner_base64=get_banner_base64()), unsafe_allow_html=True)
+
+
+def sampling_params(model_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Sampling parameters for the vision chain from the sidebar settings."""
+    return {
+        "temperature": model_config.get("temperature", 0.7),
+        "max_tokens": model_config.get("max_tokens", 1024),
+        "top_p": model_config.get("top_p", 0.9),
+        "top_k": model_config.get("top_k", 40),
+        "presence_penalty": model_config.get("presence_penalty", 0.0),
+        "stop": model_config.get("stop")
+    }
+
+
+def stream_response(message_placeholder, chunks, full_response: str = "") -> str:
+    """
+    Write streamed chunks into a placeholder with a typing cursor.
+    
+    Args:
+        message_placeholder: st.empty() inside the assistant message
+        chunks: Text chunks from the vision chain
+        full_response: Text already shown (when continuing an answer)
+        
+    Returns:
+        The complete text
+    """
+    chunk_buffer = ""
+    
+    for chunk in chunks:
+        chunk_buffer += chunk
+        
+        if len(chunk_buffer) >= 3:
+            full_response += chunk_buffer
+            message_placeholder.markdown(full_response + "▌")
+            chunk_buffer = ""
+            time.sleep(0.02)
+    
+    if chunk_buffer:
+        full_response += chunk_buffer
+    
+    message_placeholder.markdown(full_response)
+    return full_response
+
+
+def show_stream_failure(message_placeholder, error: Exception):
+    """Show the interrupted turn (via rerun) or, if nothing was kept, the error."""
+    if st.session_state.vision_chain.pending_turn is not None:
+        st.rerun()
+    message_placeholder.error(f"Error: {str(error)}")
+
+
+def handle_chat_turn(active_conv: Dict[str, Any], user_query: str, model_config: Dict[str, Any]):
+    """Show the user's question, stream the answer and rerun."""
+    # Title new conversations (the chain stores the message itself)
+    update_conversation_title(user_query)
+    
+    with st.chat_message("user", avatar="👤"):
+        st.markdown(user_query)
+    
+    # Get AI response
+    with st.chat_message("assistant", avatar="🤖"):
+        message_placeholder = st.empty()
+        
+        try:
+            # Root span: links this click to chain, encoder and upstream HTTP spans
+            with span("chat.turn", conversation_id=st.session_state.active_conversation_id):
+                response = st.session_state.vision_chain.stream(
+                    image=active_conv["asset"],
+                    user_query=user_query,
+                    roi=active_conv.get("roi"),
+                    **sampling_params(model_config)
+                )
+                stream_response(message_placeholder, response)
+            st.rerun()
+        
+        except Exception as e:
+            show_stream_failure(message_placeholder, e)
+
+
+def handle_continue(active_conv: Dict[str, Any], model_config: Dict[str, Any]):
+    """Resume the conversation's interrupted answer and rerun."""
+    pending = st.session_state.vision_chain.pending_turn
+    if pending is None:
+        return
+    
+    # Without server-side resume the answer is generated again from the start
+    shown = pending.partial if st.session_state.vision_chain.resumes_partial else ""
+    
+    with st.chat_message("assistant", avatar="🤖"):
+        message_placeholder = st.empty()
+        message_placeholder.markdown(shown + "▌")
+        
+        try:
+            with span("chat.continue", conversation_id=st.session_state.active_conversation_id):
+                response = st.session_state.vision_chain.continue_stream(
+                    image=active_conv["asset"],
+                    roi=active_conv.get("roi"),
+                    **sampling_params(model_config)
+                )
+                stream_response(message_placeholder, response, shown)
+            st.rerun()
+        
+        except Exception as e:
+            show_stream_failure(message_placeholder, e)
+
+
+def handle_question_set(active_conv: Dict[str, Any], questions: List[str], model_config: Dict[str, Any]):
+    """
+    Answer independent questions concurrently, one panel each, and rerun.
+    Answers are kept on the conversation, not in its chat history.
+    """
+    placeholders = create_panels(questions)
+    answers = [""] * len(questions)
+    errors = [None] * len(questions)
+    
+    with span("chat.question_set", conversation_id=st.session_state.active_conversation_id):
+        events = st.session_state.vision_chain.fan_out_events(
+            image=active_conv["asset"],
+            questions=questions,
+            roi=active_conv.get("roi"),
+            **sampling_params(model_config)
+        )
+        for index, event in events:
+            if isinstance(event, TokenEvent):
+                answers[index] += event.text
+                placeholders[index].markdown(answers[index] + "▌")
+            elif isinstance(event, ErrorEvent) and event.fatal:
+                errors[index] = event.message
+    
+    active_conv["question_set"] = [
+        {"question": question, "answer": answer, "error": error}
+        for question, answer, error in zip(questions, answers, errors)
+    ]
+    st.rerun()
+
+
+def main():
+    """Main chat application logic."""
+    with profile_section("session_init"):
+        initialize_session_state()
+        attach_session()
+    
+    # A search hit clicked on the last run opens once the conversations are restored
+    apply_open_hit()
+    
+    # Handle conversation switching from sidebar
+    if "switch_to_conversation" in st.session_state:
+        conv_id = st.session_state.switch_to_conversation
+        switch_conversation(conv_id)
+        del st.session_state.switch_to_conversation
+    
+    # Branded Header with Banner Background
+    with profile_section("header"):
+        render_header()
     
     # Render sidebar and get model config + uploaded file
-    model_config = render_sidebar()
+    with profile_section("sidebar"):
+        model_config = render_sidebar()
     uploaded_file = model_config.pop("uploaded_file", None)
     
     # Handle image upload
     if uploaded_file is not None:
-        image = Image.open(uploaded_file)
-        
-        # Only create new conversation if different image
-        if st.session_state.last_uploaded_image_name != uploaded_file.name:
-            conversation_id = create_conversation(image, uploaded_file.name)
-            switch_conversation(conversation_id)
-            
-            st.session_state.last_uploaded_image_name = uploaded_file.name
-            st.success(f"New conversation: {uploaded_file.name}")
+        # Only ingest each upload once (file_id changes per upload, even for the same name)
+        if st.session_state.last_uploaded_file_id != uploaded_file.file_id:
+            st.session_state.last_uploaded_file_id = uploaded_file.file_id
+            try:
+                with profile_section("upload"), st.spinner("Processing image..."):
+                    asset = load_asset(uploaded_file.getvalue())
+            except ImageRejected as e:
+                st.error(f"Could not use {uploaded_file.name}: {e}")
+            except DecodeBusy as e:
+                # Not the upload's fault: let the next rerun try it again
+                st.session_state.last_uploaded_file_id = None
+                st.warning(f"Server is busy ({e}); {uploaded_file.name} will be processed on your next action.")
+            else:
+                conversation_id = create_conversation(asset, uploaded_file.name)
+                switch_conversation(conversation_id)
+                st.success(f"New conversation: {uploaded_file.name}")
 
     
     # Main chat area
     active_conv = get_active_conversation()
     
     if active_conv:
-        # Display image in collapsible section
-        with st.expander("🖼️ View Image", expanded=False):
-            st.image(active_conv["image"], width=200)
+        # Display image in collapsible section, with the region questions are about
+        with profile_section("image"), st.expander("🖼️ View Image", expanded=False):
+            st.image(active_conv["asset"].thumbnail, width=200)
+            render_region_controls(st.session_state.active_conversation_id, active_conv)
         
         st.divider()
         
-        # Display messages
-        for message in active_conv["messages"]:
-            if message.type == "human":
-                with st.chat_message("user", avatar="👤"):
-                    st.markdown(message.content)
-            elif message.type == "ai":
-                with st.chat_message("assistant", avatar="🤖"):
-                    st.markdown(message.content)
+        # Display messages (a "Continue" click reruns with continue_turn set)
+        resuming = st.session_state.pop("continue_turn", None) == st.session_state.active_conversation_id
+        with profile_section("transcript"):
+            render_transcript(
+                st.session_state.active_conversation_id,
+                active_conv["history"],
+                resuming=resuming,
+                can_resume=st.session_state.vision_chain.resumes_partial
+            )
+        
+        # Question set mode: independent questions answered side by side
+        if active_conv.get("question_set"):
+            render_question_set_results(active_conv["question_set"])
+        questions = None
+        if st.toggle("🔀 Question set mode", key="question_set_mode", help="Ask several independent questions at once"):
+            questions = render_question_set_form()
         
         # Chat input
         user_query = st.chat_input("Ask about the image...")
         
-        if user_query:
-            # Add user message
-            add_message_to_conversation("human", user_query)
-            
-            with st.chat_message("user", avatar="👤"):
-                st.markdown(user_query)
-            
-            # Get AI response
-            with st.chat_message("assistant", avatar="🤖"):
-                message_placeholder = st.empty()
-                
-                try:
-                    response = st.session_state.vision_chain.stream(
-                        image=active_conv["image"],
-                        user_query=user_query,
-                        temperature=model_config.get("temperature", 0.7),
-                        max_tokens=model_config.get("max_tokens", 1024),
-                        top_p=model_config.get("top_p", 0.9),
-                        top_k=model_config.get("top_k", 40),
-                        presence_penalty=model_config.get("presence_penalty", 0.0)
-                    )
-                    
-                    full_response = ""
-                    chunk_buffer = ""
-                    
-                    for chunk in response:
-                        chunk_buffer += chunk
-                        
-                        if len(chunk_buffer) >= 3:
-                            full_response += chunk_buffer
-                            message_placeholder.markdown(full_response + "▌")
-                            chunk_buffer = ""
-                            time.sleep(0.02)
-                    
-                    if chunk_buffer:
-                        full_response += chunk_buffer
-                    
-                    message_placeholder.markdown(full_response)
-                    
-                    add_message_to_conversation("ai", full_response)
-                    st.rerun()
-                
-                except Exception as e:
-                    message_placeholder.error(f"Error: {str(e)}")
+        if resuming:
+            with profile_section("chat_turn"):
+                handle_continue(active_conv, model_config)
+        elif questions:
+            with profile_section("question_set"):
+                handle_question_set(active_conv, questions, model_config)
+        elif user_query:
+            with profile_section("chat_turn"):
+                handle_chat_turn(active_conv, user_query, model_config)
     else:
         # Show welcome screen when no conversation is active
         render_welcome_screen()
-
+    
+    render_profile_panel()
 
 
 if __name__ == "__main__":
-    main()
+    start_rerun()
+    try:
+        main()
+    finally:
+        detach_session()
+        finish_rerun()
@@ -0,0 +1,426 @@
+"""
+Conversation export/import in a compact binary archive.
+
+Layout:
+    header   magic, index offset, index length
+    blobs    encoded image bytes, each aligned to BLOB_ALIGNMENT
+    logs     per conversation: length-prefixed message records
+    index    JSON describing conversations and where their data lives, plus
+             per-conversation state kept outside the message log (finish
+             reasons, an interrupted turn, the last question set)
+
+Archives are read through mmap: opening one parses only the header and
+index, images stay as views into the file until displayed and message logs
+are decoded when a conversation is first used.
+
+Archives from outside the process (user uploads) are untrusted: their
+images get keys of their own (never a stored key), entries, offsets and
+MIME types are checked, and malformed conversations are skipped.
+"""
+import json
+import mmap
+import struct
+import uuid
+from typing import Dict, List, Any, BinaryIO, Iterator, Optional, Tuple, Union
+
+from backend.assets import ImageAsset, asset_cache
+from backend.history import ChatHistory, ChatRecord, PendingTurn
+from backend.request_body import ImageBlockStream
+
+ARCHIVE_MAGIC = b"VAIARCH1"
+ARCHIVE_VERSION = 1
+HEADER = struct.Struct("<8sQQ")    # magic, index offset, index length
+RECORD = struct.Struct("<IB")      # content length, message type
+BLOB_ALIGNMENT = 4096
+
+# Image types accepted in archives (the types this app encodes)
+ARCHIVE_MIME_TYPES = {"image/png", "image/jpeg", "image/webp", "image/gif"}
+
+# Conversation entry fields that must be strings
+ENTRY_FIELDS = ("id", "title", "image_name", "created_at", "image_key")
+
+MESSAGE_TYPES = {"human": 0, "ai": 1, "system": 2}
+MESSAGE_TYPE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+
+
+class ArchiveError(ValueError):
+    """Raised for unreadable or incompatible archives."""
+
+
+def _pad(f: BinaryIO, alignment: int = BLOB_ALIGNMENT):
+    """Write zero bytes up to the next alignment boundary."""
+    remainder = f.tell() % alignment
+    if remainder:
+        f.write(b"\0" * (alignment - remainder))
+
+
+def _write_blob(f: BinaryIO, start: int, block: ImageBlockStream) -> Dict[str, Any]:
+    """Write an encoded image aligned; returns its index entry."""
+    _pad(f)
+    offset = f.tell()
+    for chunk in block.iter_raw():
+        f.write(chunk)
+    return {
+        "offset": offset - start,
+        "length": f.tell() - offset,
+        "mime": block.mime,
+    }
+
+
+def write_archive(conversations: Dict[str, Dict[str, Any]], f: BinaryIO):
+    """
+    Write conversations to a binary archive.
+
+    Images shared by several conversations (same asset) are stored once;
+    the further keyframes of multi-frame assets are stored as extra blobs.
+
+    Args:
+        conversations: Session conversations keyed by id
+        f: Seekable binary file opened for writing
+    """
+    start = f.tell()
+    f.write(HEADER.pack(ARCHIVE_MAGIC, 0, 0))
+
+    images: Dict[str, Dict[str, Any]] = {}
+    entries: List[Dict[str, Any]] = []
+    for conversation_id, conversation in conversations.items():
+        asset = conversation["asset"]
+        if asset.key not in images:
+            images[asset.key] = _write_blob(f, start, asset.block())
+            if asset.frames:
+                images[asset.key]["frames"] = [_write_blob(f, start, frame) for frame in asset.frames[1:]]
+
+        log_offset = f.tell()
+        records = conversation["history"].records
+        for record in records:
+            content = record.content.encode("utf-8")
+            f.write(RECORD.pack(len(content), MESSAGE_TYPES.get(record.type, 0)))
+            f.write(content)
+
+        history = conversation["history"]
+        pending = getattr(history, "pending", None)
+        entries.append({
+            "id": conversation_id,
+            "title": conversation["title"],
+            "image_name": conversation["image_name"],
+            "created_at": conversation["created_at"],
+            "image_key": asset.key,
+            "messages": {
+                "offset": log_offset - start,
+                "length": f.tell() - log_offset,
+                "count": len(records),
+            },
+            # Sparse: record position -> finish reason, for answers that have one
+            "finish_reasons": {
+                str(position): record.finish_reason
+                for position, record in enumerate(records) if record.finish_reason
+            },
+            "pending": None if pending is None else {
+                "user_text": pending.user_text,
+                "partial": pending.partial,
+                "error": pending.error,
+            },
+            "question_set": conversation.get("question_set"),
+        })
+
+    index = json.dumps({
+        "version": ARCHIVE_VERSION,
+        "images": images,
+        "conversations": entries,
+    }).encode("utf-8")
+    index_offset = f.tell()
+    f.write(index)
+    end = f.tell()
+
+    f.seek(start)
+    f.write(HEADER.pack(ARCHIVE_MAGIC, index_offset - start, len(index)))
+    f.seek(end)
+
+
+class ConversationArchive:
+    """
+    Read-only view of an archive.
+
+    Only the index is parsed up front; message logs are decoded when a
+    conversation's history is first used and images are handed out as
+    zero-copy views. The buffer stays alive for as long as any of those
+    views or histories does.
+    """
+
+    def __init__(self, buffer: Union[bytes, mmap.mmap], trusted: bool = False):
+        """
+        Initialize from an in-memory or memory-mapped buffer.
+
+        Args:
+            buffer: Whole archive contents
+            trusted: Written by this process (session spill files); only
+                then are assets shared through the process-wide asset cache
+                under their stored keys
+        """
+        self._buffer = buffer
+        self.trusted = trusted
+        self._view = memoryview(buffer)
+        # Untrusted archives: stored image key -> asset private to this import
+        self._assets: Dict[str, ImageAsset] = {}
+        # Conversation entries skipped as malformed by to_conversations
+        self.skipped = 0
+
+        if len(self._view) < HEADER.size:
+            raise ArchiveError("Archive is truncated")
+        magic, index_offset, index_length = HEADER.unpack_from(self._view, 0)
+        if magic != ARCHIVE_MAGIC:
+            raise ArchiveError("Not a conversation archive")
+        try:
+            index = json.loads(bytes(self._view[index_offset:index_offset + index_length]))
+        except ValueError as e:
+            raise ArchiveError(f"Archive index is corrupt: {e}")
+        if not isinstance(index, dict):
+            raise ArchiveError("Archive index is corrupt")
+        if index.get("version") != ARCHIVE_VERSION:
+            raise ArchiveError(f"Unsupported archive version {index.get('version')}")
+
+        self.images: Dict[str, Dict[str, Any]] = index.get("images")
+        self.entries: List[Dict[str, Any]] = index.get("conversations")
+        if not isinstance(self.images, dict) or not isinstance(self.entries, list):
+            raise ArchiveError("Archive index is incomplete")
+
+    @classmethod
+    def open(cls, path: str, trusted: bool = False) -> "ConversationArchive":
+        """
+        Memory-map an archive file.
+
+        Args:
+            path: Archive file path
+            trusted: See __init__
+
+        Returns:
+            Archive backed by the mapping (pages load on access; the file
+            itself is closed, the mapping does not need it)
+        """
+        with open(path, "rb") as f:
+            try:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ArchiveError("Archive is empty")
+        return cls(buffer, trusted=trusted)
+
+    def _slice(self, offset: int, length: int) -> memoryview:
+        """View of a stored range, checked against the buffer."""
+        if not isinstance(offset, int) or not isinstance(length, int) \
+                or offset < 0 or length < 0 or offset + length > len(self._view):
+            raise ArchiveError("Archive references data outside the file")
+        return self._view[offset:offset + length]
+
+    def _blob(self, blob: Any) -> Tuple[memoryview, str]:
+        """Bytes and MIME type of a stored blob, checked."""
+        if not isinstance(blob, dict) or blob.get("mime") not in ARCHIVE_MIME_TYPES:
+            raise ArchiveError("Archive has an image of an unsupported type")
+        return self._slice(blob.get("offset"), blob.get("length")), blob["mime"]
+
+    def image_bytes(self, image_key: str) -> memoryview:
+        """Encoded bytes of an image as a view into the archive."""
+        return self._blob(self.images.get(image_key))[0]
+
+    def frame_bytes(self, image_key: str) -> List[Tuple[memoryview, str]]:
+        """(encoded bytes, MIME type) of a multi-frame image's further keyframes."""
+        frames = self.images[image_key].get("frames", [])
+        if not isinstance(frames, list):
+            raise ArchiveError("Archive has a malformed keyframe list")
+        return [self._blob(frame) for frame in frames]
+
+    def iter_records(self, entry: Dict[str, Any]) -> Iterator[ChatRecord]:
+        """
+        Decode a conversation's message log.
+
+        Args:
+            entry: Conversation entry from `entries`
+
+        Yields:
+            ChatRecord per stored message
+
+        Raises:
+            ArchiveError: If the log is truncated or not valid UTF-8
+        """
+        log = self._slice(entry["messages"]["offset"], entry["messages"]["length"])
+        finish_reasons = entry.get("finish_reasons") or {}
+        position = 0
+        index = 0
+        while position < len(log):
+            if position + RECORD.size > len(log):
+                raise ArchiveError("Message log is truncated")
+            length, message_type = RECORD.unpack_from(log, position)
+            position += RECORD.size
+            if position + length > len(log):
+                raise ArchiveError("Message record runs past the end of its log")
+            try:
+                content = str(log[position:position + length], "utf-8")
+            except UnicodeDecodeError as e:
+                raise ArchiveError(f"Message record is corrupt: {e}")
+            position += length
+            finish_reason = finish_reasons.get(str(index))
+            yield ChatRecord(
+                MESSAGE_TYPE_NAMES.get(message_type, "human"),
+                content,
+                str(finish_reason) if finish_reason else None
+            )
+            index += 1
+
+    def _load_records(self, entry: Dict[str, Any]) -> List[ChatRecord]:
+        """
+        Records of a log, for a lazily loaded history.
+
+        Decoding happens on first use, long after the import succeeded, so a
+        corrupt record ends the history there instead of raising.
+        """
+        records = []
+        try:
+            for record in self.iter_records(entry):
+                records.append(record)
+        except ArchiveError:
+            pass
+        return records
+
+    def load_asset(self, image_key: str) -> ImageAsset:
+        """
+        Get the asset for an archived image without decoding it.
+
+        Trusted archives reuse an in-process asset with the same key. Assets
+        of untrusted archives get a key of their own and stay out of the
+        shared asset cache, so an archive can never place content under
+        another image's key (and nothing is read to compute one).
+
+        Raises:
+            ArchiveError: If the image entry is malformed
+        """
+        if not self.trusted:
+            asset = self._assets.get(image_key)
+            if asset is None:
+                raw, mime = self._blob(self.images.get(image_key))
+                asset = ImageAsset.from_encoded(f"import-{uuid.uuid4().hex[:16]}", raw, mime, self.frame_bytes(image_key))
+                self._assets[image_key] = asset
+            return asset
+
+        asset = asset_cache.get(image_key)
+        if asset is None:
+            raw, mime = self._blob(self.images.get(image_key))
+            asset = ImageAsset.from_encoded(image_key, raw, mime, self.frame_bytes(image_key))
+            asset_cache.put(asset)
+        return asset
+
+    def _check_entry(self, entry: Any):
+        """
+        Check a conversation entry's fields and ranges without reading its data.
+
+        Raises:
+            ArchiveError: If the entry is malformed
+        """
+        if not isinstance(entry, dict) or not all(isinstance(entry.get(field), str) for field in ENTRY_FIELDS):
+            raise ArchiveError("Conversation entry has missing or mistyped fields")
+        messages = entry.get("messages")
+        if not isinstance(messages, dict):
+            raise ArchiveError("Conversation entry has no message log")
+        self._slice(messages.get("offset"), messages.get("length"))
+        if not isinstance(entry.get("finish_reasons") or {}, dict):
+            raise ArchiveError("Conversation entry has malformed finish reasons")
+
+    def to_conversations(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Rebuild session conversations from the archive.
+
+        Malformed conversation entries are skipped (counted in `skipped`);
+        histories are decoded on first use.
+
+        Returns:
+            Conversations keyed by id, in the same shape app.py creates them
+        """
+        conversations = {}
+        self.skipped = 0
+        for entry in self.entries:
+            try:
+                self._check_entry(entry)
+                conversation = {
+                    "title": entry["title"],
+                    "asset": self.load_asset(entry["image_key"]),
+                    "image_name": entry["image_name"],
+                    "history": self._history(entry),
+                    "created_at": entry["created_at"],
+                }
+                if entry.get("question_set"):
+                    conversation["question_set"] = [
+                        {
+                            "question": str(item["question"]),
+                            "answer": str(item["answer"]),
+                            "error": str(item["error"]) if item["error"] else None,
+                        }
+                        for item in entry["question_set"]
+                    ]
+            except (ArchiveError, KeyError, TypeError, AttributeError):
+                self.skipped += 1
+                continue
+            conversations[entry["id"]] = conversation
+        return conversations
+
+    def _history(self, entry: Dict[str, Any]) -> ChatHistory:
+        """A conversation's (lazily decoded) history, with its pending turn if it had one."""
+        history = ChatHistory(loader=lambda: self._load_records(entry))
+        pending = entry.get("pending")
+        if pending:
+            history.pending = PendingTurn(str(pending["user_text"]), str(pending["partial"]), str(pending["error"]))
+        return history
+
+
+def merge_conversations(
+    conversations: Dict[str, Dict[str, Any]],
+    restored: Dict[str, Dict[str, Any]]
+) -> Dict[str, str]:
+    """
+    Add restored conversations without replacing existing ones.
+
+    Restored conversations whose id is already taken get a new id, so the
+    active conversation (and the history the chain is bound to) is never
+    swapped out.
+
+    Args:
+        conversations: Session conversations (updated in place)
+        restored: Conversations from an archive
+
+    Returns:
+        Archive id -> id used in the session
+    """
+    ids = {}
+    for conversation_id, conversation in restored.items():
+        new_id = conversation_id
+        suffix = 1
+        while new_id in conversations:
+            suffix += 1
+            new_id = f"{conversation_id}_{suffix}"
+        conversations[new_id] = conversation
+        ids[conversation_id] = new_id
+    return ids
+
+
+def export_conversations(conversations: Dict[str, Dict[str, Any]], path: str):
+    """
+    Export conversations to an archive file.
+
+    Args:
+        conversations: Session conversations keyed by id
+        path: Destination file path
+    """
+    with open(path, "wb") as f:
+        write_archive(conversations, f)
+
+
+def import_conversations(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Import conversations from an archive file (lazily, via mmap).
+
+    The mapping stays open for as long as the restored assets and histories are alive.
+
+    Args:
+        path: Archive file path
+
+    Returns:
+        Conversations keyed by id
+    """
+    return ConversationArchive.open(path).to_conversations()
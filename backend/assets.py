@@ -0,0 +1,442 @@
+"""
+Shared image assets: decoded image, thumbnail and encoded API payload.
+Assets are cached process-wide so repeated uploads reuse the same payload.
+Animations and videos become assets whose payload is a set of keyframes.
+"""
+import concurrent.futures
+import contextvars
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+from PIL import Image
+
+from backend.frames import decode_keyframes, encode_keyframes
+from backend.image_index import MIN_HASH_CONFIDENCE, dhash_with_confidence, get_image_index, same_image
+from backend.request_body import ImageBlockStream
+from backend.roi import RegionOfInterest, encode_region
+from backend.utils import ImageRejected, decode_image, encode_image_for_api
+
+# Longest side of the thumbnail shown in the chat view
+THUMBNAIL_SIZE = 400
+
+# Number of assets kept in the process-wide cache, and the bytes they may hold (0 = no byte bound)
+ASSET_CACHE_SIZE = 256
+ASSET_CACHE_BYTES = int(float(os.getenv("VISION_ASSET_CACHE_MB", "256")) * 2**20)
+
+# Encoded regions of interest kept per asset
+REGION_CACHE_SIZE = 4
+
+# Uploads decoded at once (process-wide) and how long one decode may take
+DECODE_WORKERS = int(os.getenv("VISION_DECODE_WORKERS", "2"))
+DECODE_TIMEOUT = float(os.getenv("VISION_DECODE_TIMEOUT", "15"))
+
+# Uploads that may wait for a decode worker, and how long each may wait, before the pool reports busy
+DECODE_QUEUE = int(os.getenv("VISION_DECODE_QUEUE", "8"))
+DECODE_QUEUE_TIMEOUT = float(os.getenv("VISION_DECODE_QUEUE_TIMEOUT", "30"))
+
+
+class DecodeBusy(RuntimeError):
+    """Raised when the decode pool is saturated; the upload may be fine, retry later."""
+
+
+class ImageAsset:
+    """
+    One uploaded image and everything derived from it.
+
+    The API image block is encoded on first use and then shared by every
+    conversation (and session) that refers to this asset. Assets restored
+    from an archive start with only their encoded bytes and decode the
+    image (and thumbnail) when first displayed.
+
+    Multi-frame assets carry one encoded block per keyframe; the image
+    (and thumbnail) is the first keyframe.
+    """
+
+    __slots__ = ("key", "_image", "_thumbnail", "_block", "frames", "_regions", "_loader", "_lock")
+
+    def __init__(
+        self,
+        key: str,
+        image: Optional[Image.Image] = None,
+        block: Optional[ImageBlockStream] = None,
+        loader: Optional[Callable[[], Image.Image]] = None,
+        frames: Sequence[ImageBlockStream] = ()
+    ):
+        """
+        Initialize the asset.
+
+        Args:
+            key: Content fingerprint of the upload
+            image: Decoded PIL image
+            block: Already-encoded API image block
+            loader: Decodes the image on demand when `image` is not given
+            frames: Encoded keyframes of a multi-frame upload (the first one
+                is also the asset's block)
+        """
+        if image is None and loader is None:
+            raise ValueError("ImageAsset needs an image or a loader")
+        self.key = key
+        self._image = image
+        self._thumbnail: Optional[Image.Image] = None
+        self.frames: Tuple[ImageBlockStream, ...] = tuple(frames)
+        self._block = block if block is not None or not self.frames else self.frames[0]
+        self._regions: "OrderedDict[str, List[ImageBlockStream]]" = OrderedDict()
+        self._loader = loader
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_encoded(
+        cls,
+        key: str,
+        raw,
+        mime: str,
+        extra_frames: Sequence[Tuple[bytes, str]] = ()
+    ) -> "ImageAsset":
+        """
+        Build an asset from encoded image bytes without decoding them.
+
+        Args:
+            key: Asset key
+            raw: Encoded image bytes (bytes or memoryview, e.g. into an mmap)
+            mime: MIME type of the encoded bytes
+            extra_frames: (bytes, MIME type) of further keyframes, for
+                multi-frame assets
+
+        Returns:
+            Asset whose API blocks stream the encoded bytes directly
+        """
+        block = ImageBlockStream(raw, mime)
+        frames = [block] + [ImageBlockStream(frame, frame_mime) for frame, frame_mime in extra_frames]
+        return cls(
+            key,
+            block=block,
+            loader=lambda: decode_image(raw),
+            frames=frames if extra_frames else ()
+        )
+
+    @property
+    def frame_count(self) -> int:
+        """Images sent per turn (keyframes, or 1 for a still image)."""
+        return max(1, len(self.frames))
+
+    @property
+    def image(self) -> Image.Image:
+        """Decoded image (decoded on first access for lazy assets)."""
+        with self._lock:
+            if self._image is None:
+                self._image = self._loader()
+            return self._image
+
+    @property
+    def thumbnail(self) -> Image.Image:
+        """Small copy for display (built on first access)."""
+        with self._lock:
+            if self._thumbnail is None:
+                thumbnail = self.image.copy()
+                thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+                self._thumbnail = thumbnail
+            return self._thumbnail
+
+    def block(self) -> ImageBlockStream:
+        """Get the API image block, encoding it once."""
+        with self._lock:
+            if self._block is None:
+                raw, mime = encode_image_for_api(self.image)
+                self._block = ImageBlockStream(raw, mime)
+            return self._block
+
+    def region_blocks(self, roi: Optional[RegionOfInterest]) -> List[ImageBlockStream]:
+        """
+        Get the API image blocks for a region of the image, encoding them once.
+
+        Args:
+            roi: Region of interest, or None for the whole image
+
+        Returns:
+            Overview thumbnail block (if requested) and the cropped region's
+            block; just the whole-image block when there is nothing to crop.
+            Multi-frame assets always return all keyframes (not cropped).
+        """
+        if self.frames:
+            return list(self.frames)
+        if roi is None or not roi.active:
+            return [self.block()]
+        with self._lock:
+            blocks = self._regions.get(roi.key)
+            if blocks is None:
+                encoded = encode_region(self.image, roi)
+                blocks = [self.block()] if encoded is None else [
+                    ImageBlockStream(raw, mime) for raw, mime in encoded
+                ]
+                self._regions[roi.key] = blocks
+                while len(self._regions) > REGION_CACHE_SIZE:
+                    self._regions.popitem(last=False)
+            else:
+                self._regions.move_to_end(roi.key)
+            return blocks
+
+    def memory_usage(self) -> Tuple[int, int]:
+        """
+        Approximate heap bytes held by the asset.
+
+        Returns:
+            (derived bytes: decoded image and thumbnail,
+             encoded bytes: API payloads held in memory, not mmap-backed)
+        """
+        derived = sum(
+            image.width * image.height * len(image.getbands())
+            for image in (self._image, self._thumbnail) if image is not None
+        )
+        blocks = {id(block): block for blocks in list(self._regions.values()) for block in blocks}
+        blocks.update((id(block), block) for block in self.frames)
+        if self._block is not None:
+            blocks[id(self._block)] = self._block
+        encoded = sum(
+            len(block.raw) for block in blocks.values() if isinstance(block.raw, (bytes, bytearray))
+        )
+        return derived, encoded
+
+    def release_derived(self) -> int:
+        """
+        Drop the decoded image and thumbnail; they are rebuilt from the encoded
+        API payload on next access (at the payload's resolution).
+
+        Only assets that are already encoded can be released.
+
+        Returns:
+            Bytes freed (approximate)
+        """
+        with self._lock:
+            if self._block is None or self._block.raw is None:
+                return 0
+            freed, _ = self.memory_usage()
+            if freed:
+                raw = self._block.raw
+                self._image = None
+                self._thumbnail = None
+                self._loader = lambda: decode_image(raw)
+            return freed
+
+
+class AssetCache:
+    """
+    Thread-safe LRU of ImageAsset by key, bounded by entry count and bytes.
+
+    Asset sizes change as payloads are encoded lazily, so bytes are measured
+    when entries are added rather than tracked incrementally.
+    """
+
+    def __init__(self, max_size: int = ASSET_CACHE_SIZE, max_bytes: int = ASSET_CACHE_BYTES):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._assets: "OrderedDict[str, ImageAsset]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[ImageAsset]:
+        """Get an asset and mark it recently used."""
+        with self._lock:
+            asset = self._assets.get(key)
+            if asset is not None:
+                self._assets.move_to_end(key)
+            return asset
+
+    def assets(self) -> List[ImageAsset]:
+        """Cached assets, least recently used first."""
+        with self._lock:
+            return list(self._assets.values())
+
+    def put(self, asset: ImageAsset, key: Optional[str] = None):
+        """
+        Add an asset, evicting least recently used ones while over either bound.
+
+        The asset just added is always kept.
+
+        Args:
+            asset: Asset to cache
+            key: Cache key (default asset.key; other keys alias near-duplicates)
+        """
+        key = key or asset.key
+        with self._lock:
+            self._assets[key] = asset
+            self._assets.move_to_end(key)
+            while len(self._assets) > self.max_size:
+                self._assets.popitem(last=False)
+            if self.max_bytes:
+                self._trim_bytes()
+
+    def _trim_bytes(self):
+        """Evict least recently used entries until within max_bytes (lock held)."""
+        # Aliased assets count once: entries per asset, and each asset's size
+        entries: Dict[int, int] = {}
+        sizes: Dict[int, int] = {}
+        for asset in self._assets.values():
+            entries[id(asset)] = entries.get(id(asset), 0) + 1
+            if id(asset) not in sizes:
+                sizes[id(asset)] = sum(asset.memory_usage())
+        total = sum(sizes.values())
+        while len(self._assets) > 1 and total > self.max_bytes:
+            _, asset = self._assets.popitem(last=False)
+            entries[id(asset)] -= 1
+            if not entries[id(asset)]:
+                total -= sizes[id(asset)]
+
+    def prune(self, keep: Set[str]) -> int:
+        """
+        Drop every entry whose asset is not in `keep`.
+
+        Args:
+            keep: Keys of assets still in use (e.g. by live sessions)
+
+        Returns:
+            Entries dropped
+        """
+        with self._lock:
+            dropped = [key for key, asset in self._assets.items() if asset.key not in keep]
+            for key in dropped:
+                del self._assets[key]
+            return len(dropped)
+
+
+# Process-wide cache shared by all sessions
+asset_cache = AssetCache()
+
+
+def fingerprint(data: bytes) -> str:
+    """
+    Content fingerprint of uploaded bytes.
+
+    Args:
+        data: Raw upload bytes
+
+    Returns:
+        16-character hex digest (also the key stored in the image index)
+    """
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+# Bounded pool that decodes uploads off the Streamlit script threads
+_decode_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(1, DECODE_WORKERS),
+    thread_name_prefix="image-decode"
+)
+
+# Decodes running or queued; a slot is held until its decode really ends
+_decode_slots = threading.BoundedSemaphore(max(1, DECODE_WORKERS) + max(0, DECODE_QUEUE))
+
+
+def _decode_upload(data: bytes) -> Tuple[Image.Image, Optional[int], List[Tuple[bytes, str]]]:
+    """
+    Decode an upload (decode pool).
+
+    Returns:
+        (image, perceptual hash, encoded keyframes). The hash is None when
+        it is too noise-driven to match on (low-detail images). Keyframes
+        are empty for still images, otherwise the image is the first keyframe
+    """
+    keyframes = decode_keyframes(data)
+    if keyframes is None:
+        image = decode_image(data)
+        image_hash, confidence = dhash_with_confidence(image)
+        return image, image_hash if confidence >= MIN_HASH_CONFIDENCE else None, []
+    return keyframes[0], None, encode_keyframes(keyframes)
+
+
+def _run_decode(data: bytes, started: threading.Event):
+    """Decode on a pool worker, signalling when work starts and releasing the slot at the end."""
+    started.set()
+    try:
+        return _decode_upload(data)
+    finally:
+        _decode_slots.release()
+
+
+def _find_duplicate(image: Image.Image, image_hash: int) -> Optional[ImageAsset]:
+    """
+    Find a cached asset showing the same image.
+
+    Every index entry within the hash distance is a candidate (the index is
+    shared by all workers, so the closest entry may not be cached in this
+    one); the first cached candidate that passes the pixel comparison wins.
+    """
+    for key, _ in get_image_index().candidates(image_hash):
+        asset = asset_cache.get(key)
+        if asset is not None and not asset.frames and same_image(image, asset.image):
+            return asset
+    return None
+
+
+def load_asset(
+    data: bytes,
+    timeout: Optional[float] = DECODE_TIMEOUT,
+    queue_timeout: Optional[float] = DECODE_QUEUE_TIMEOUT
+) -> ImageAsset:
+    """
+    Get the asset for uploaded image bytes, reusing an existing one if possible.
+
+    Exact re-uploads hit the asset cache by fingerprint and are not decoded
+    again; re-saved or resized copies are found through the perceptual-hash
+    index, confirmed by a pixel comparison, and reuse the original's decoded
+    image, thumbnail and encoded payload. Low-detail images (mostly uniform,
+    like text pages) are never matched by hash. New images are decoded on a small shared pool, within the
+    limits of decode_image. Animations and videos are reduced to their
+    keyframes (see backend.frames) and only matched by exact fingerprint.
+
+    The timeout covers the decode itself, not time spent waiting for a
+    worker. A decode that runs past it cannot be interrupted: it finishes in
+    the background (bounded by the pixel and frame limits) and keeps its
+    pool slot until then, so repeated slow uploads end up as DecodeBusy
+    rather than piling up.
+
+    Args:
+        data: Raw upload bytes
+        timeout: Seconds the decode may run (None = no limit)
+        queue_timeout: Seconds to wait for a free worker (None = no limit)
+
+    Returns:
+        New or shared ImageAsset
+
+    Raises:
+        ImageRejected: If the upload is too large, not an image, or too slow to decode
+        DecodeBusy: If too many uploads are already being decoded
+    """
+    key = fingerprint(data)
+    asset = asset_cache.get(key)
+    if asset is not None:
+        return asset
+
+    if not _decode_slots.acquire(blocking=False):
+        raise DecodeBusy("Too many uploads are being processed")
+    started = threading.Event()
+    try:
+        future = _decode_pool.submit(contextvars.copy_context().run, _run_decode, data, started)
+    except BaseException:
+        _decode_slots.release()
+        raise
+    # cancel() fails once the decode has started; then it is timed like any other
+    if not started.wait(queue_timeout) and future.cancel():
+        _decode_slots.release()
+        raise DecodeBusy("No decode worker became free in time")
+    try:
+        image, image_hash, keyframes = future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        raise ImageRejected("Image took too long to decode")
+
+    if keyframes:
+        asset = ImageAsset(key, image, frames=[ImageBlockStream(raw, mime) for raw, mime in keyframes])
+        asset_cache.put(asset)
+        return asset
+
+    if image_hash is not None:
+        asset = _find_duplicate(image, image_hash)
+        if asset is not None:
+            # Exact re-uploads of this copy now skip decoding too
+            asset_cache.put(asset, key)
+            return asset
+
+    asset = ImageAsset(key, image)
+    asset_cache.put(asset)
+    if image_hash is not None:
+        get_image_index().add(image_hash, key)
+    return asset
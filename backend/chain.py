@@ -2,14 +2,42 @@
 LangChain-based vision chain for image conversations.
 Uses LangChain memory for conversation history management.
 """
-from typing import Iterator, Dict, Any
+import contextvars
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Dict, Any, List, Optional, Sequence, Tuple, Union
 from PIL import Image
-from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
 
+from backend.assets import ImageAsset
+from backend.events import StreamEvent, TokenEvent, FinishEvent, ErrorEvent, iter_text
+from backend.image_index import answer_cache
 from backend.qubrid_client import QubridVisionLLM
-from backend.prompt import get_system_prompt
-from backend.utils import prepare_image_for_api
+from backend.prompt import FRAMES_NOTE, REGION_CONTEXT_NOTE, get_system_prompt
+from backend.roi import RegionOfInterest, encode_region
+from backend.stopping import STOP_REASON_LABELS, StopConditions
+from backend.tracing import span
+from backend.utils import encode_image_for_api
+from backend.history import ChatHistory, PendingTurn, format_text_message
+from backend.request_body import (
+    ImageBlockStream,
+    MessageFragment,
+    MessagePiece,
+    encode_json,
+    encode_user_message,
+)
+
+# Questions up to this length (with no prior turns) may use the "fast" route tier
+SIMPLE_QUERY_CHARS = 80
+
+# Questions of a fan-out answered at the same time
+FANOUT_CONCURRENCY = int(os.getenv("VISION_FANOUT_CONCURRENCY", "4"))
+
+# Per-question end marker on the fan-out queue
+_FANOUT_DONE = object()
 
 
 class VisionChain:
@@ -18,26 +46,118 @@ class VisionChain:
     
     Responsibilities:
     - Initialize and manage LangChain memory
-    - Convert PIL images to base64
+    - Convert PIL images to base64 (or only their region of interest)
     - Format messages for Qubrid API
     - Stream responses from Qubrid
-    - Automatically update memory with messages
+    - Update memory one whole turn at a time; interrupted turns are kept
+      as a pending turn that can be continued
     """
     
-    def __init__(self, memory: InMemoryChatMessageHistory):
+    def __init__(self, memory: Union[ChatHistory, BaseChatMessageHistory]):
         """
         Initialize the vision chain.
         
         Args:
-            memory: LangChain InMemoryChatMessageHistory instance
+            memory: ChatHistory (fast path) or any LangChain chat history
         """
         self.qubrid_client = QubridVisionLLM()
         self.memory = memory
         self.system_prompt = get_system_prompt()
+        self._system_message = format_text_message("system", self.system_prompt)
+        self._system_encoded = encode_json(self._system_message)
+        
+        # Single-entry cache for the active image: (image, image block)
+        self._image_cache = None
+        
+        # Single-entry cache for a region of a PIL image: (image, region key, blocks)
+        self._region_cache = None
+        self._region_note = encode_json({"type": "text", "text": REGION_CONTEXT_NOTE})
+    
+    def _encode_image(self, image: Union[Image.Image, ImageAsset]) -> ImageBlockStream:
+        """
+        Encode an image once and reuse it for every turn about that image.
+        Only the compressed bytes are kept; base64 is produced while sending.
+        
+        Args:
+            image: PIL Image object, or an ImageAsset (shared, pre-encoded)
+            
+        Returns:
+            Image block that streams its base64 data
+        """
+        if isinstance(image, ImageAsset):
+            return image.block()
+        if self._image_cache is None or self._image_cache[0] is not image:
+            raw, mime = encode_image_for_api(image)
+            self._image_cache = (image, ImageBlockStream(raw, mime))
+        return self._image_cache[1]
+    
+    def _region_blocks(
+        self,
+        image: Union[Image.Image, ImageAsset],
+        roi: Optional[RegionOfInterest] = None
+    ) -> List[ImageBlockStream]:
+        """
+        Encode the part of an image a turn is about, once per region.
+        
+        Args:
+            image: PIL Image object or ImageAsset
+            roi: Region of interest (None = whole image)
+            
+        Returns:
+            The whole-image block, or an optional overview thumbnail block
+            followed by the cropped region's block (all keyframes for
+            multi-frame assets)
+        """
+        if isinstance(image, ImageAsset):
+            return image.region_blocks(roi)
+        if roi is None or not roi.active:
+            return [self._encode_image(image)]
+        cache = self._region_cache
+        if cache is None or cache[0] is not image or cache[1] != roi.key:
+            encoded = encode_region(image, roi)
+            blocks = [self._encode_image(image)] if encoded is None else [
+                ImageBlockStream(raw, mime) for raw, mime in encoded
+            ]
+            self._region_cache = cache = (image, roi.key, blocks)
+        return cache[2]
+    
+    @staticmethod
+    def _image_note(image: Union[Image.Image, ImageAsset], blocks: Sequence[ImageBlockStream]) -> Optional[str]:
+        """Text explaining how several images of one turn relate (None for one image)."""
+        if len(blocks) < 2:
+            return None
+        if isinstance(image, ImageAsset) and image.frames:
+            return FRAMES_NOTE.format(count=len(blocks))
+        return REGION_CONTEXT_NOTE
+    
+    def _image_pieces(
+        self,
+        image: Union[Image.Image, ImageAsset],
+        roi: Optional[RegionOfInterest] = None
+    ) -> List[MessagePiece]:
+        """Encoded content blocks for the image part of a user message."""
+        blocks = self._region_blocks(image, roi)
+        pieces: List[MessagePiece] = list(blocks)
+        note = self._image_note(image, blocks)
+        if note == REGION_CONTEXT_NOTE:
+            pieces.append(self._region_note)
+        elif note is not None:
+            pieces.append(encode_json({"type": "text", "text": note}))
+        return pieces
+    
+    @staticmethod
+    def _answer_key(image: Union[Image.Image, ImageAsset], roi: Optional[RegionOfInterest] = None) -> Optional[str]:
+        """Answer cache key for an image (and region), or None if it cannot be cached."""
+        if not isinstance(image, ImageAsset):
+            return None
+        if roi is None or not roi.active or image.frames:
+            return image.key
+        return f"{image.key}#{roi.key}"
     
     def _format_message_for_api(self, message) -> Dict[str, Any]:
         """
         Convert LangChain message to Qubrid API format.
+        Only used for non-ChatHistory memories (LangChain adapter path).
         
         Args:
             message: LangChain message (SystemMessage, HumanMessage, AIMessage)
@@ -55,109 +175,465 @@ class VisionChain:
             role = "user"
         
         # Format content as array for Qubrid API
-        return {
-            "role": role,
-            "content": [
-                {
-                    "type": "text",
-                    "text": message.content
-                }
-            ]
-        }
+        return format_text_message(role, message.content)
     
-    def _build_messages(self, image: Image.Image, user_query: str) -> list:
+    def _build_encoded_messages(
+        self,
+        image: Union[Image.Image, ImageAsset],
+        user_query: str,
+        roi: Optional[RegionOfInterest] = None
+    ) -> List[MessageFragment]:
         """
-        Build complete message array for API request.
+        Build the message array as pre-encoded JSON fragments.
+        
+        This is the only request builder: the system prompt, past turns and
+        image blocks come from caches, so only the new question is encoded.
         
         Args:
-            image: PIL Image object
+            image: PIL Image object or ImageAsset
             user_query: Current user question
+            roi: Region of interest (None = whole image)
             
         Returns:
-            List of messages in Qubrid API format
-        """
-        messages = []
-        
-        # 1. Add system prompt
-        messages.append({
-            "role": "system",
-            "content": [
-                {
-                    "type": "text",
-                    "text": self.system_prompt
-                }
-            ]
-        })
-        
-        # 2. Add conversation history from LangChain memory
-        chat_history = self.memory.messages
-        for msg in chat_history:
-            messages.append(self._format_message_for_api(msg))
-        
-        # 3. Add current user query with image
-        image_data = prepare_image_for_api(image)
-        messages.append({
-            "role": "user",
-            "content": [
-                {
-                    "type": "image_url",
-                    "image_url": {"url": image_data}
-                },
-                {
-                    "type": "text",
-                    "text": user_query
-                }
-            ]
-        })
+            List of message fragments for RequestBody
+        """
+        messages: List[MessageFragment] = [self._system_encoded]
+        
+        if isinstance(self.memory, ChatHistory):
+            messages += self.memory.encoded_messages()
+        else:
+            messages += [self._format_message_for_api(msg) for msg in self.memory.messages]
+        
+        text_block = encode_json({"type": "text", "text": user_query})
+        messages.append(encode_user_message(self._image_pieces(image, roi) + [text_block]))
         
         return messages
     
+    def _has_history(self) -> bool:
+        """Whether memory holds any earlier turns."""
+        if isinstance(self.memory, ChatHistory):
+            return len(self.memory) > 0
+        return bool(self.memory.messages)
+    
+    def _route_tier(self, user_query: str) -> str:
+        """
+        Pick the routing tier for a question.
+        Short opening questions go to the "fast" tier when one is configured.
+        """
+        if not self._has_history() and len(user_query) <= SIMPLE_QUERY_CHARS:
+            return "fast"
+        return "default"
+    
     def stream(
         self,
-        image: Image.Image,
+        image: Union[Image.Image, ImageAsset],
         user_query: str,
         temperature: float = 0.7,
         max_tokens: int = 1024,
         top_p: float = 0.9,
         top_k: int = 40,
-        presence_penalty: float = 0.0
+        presence_penalty: float = 0.0,
+        stop: Optional[StopConditions] = None,
+        roi: Optional[RegionOfInterest] = None
     ) -> Iterator[str]:
         """
         Stream response from vision model and update memory.
         
         Args:
-            image: PIL Image object
+            image: PIL Image object or ImageAsset
             user_query: User's question about the image
             temperature: Sampling temperature
             max_tokens: Maximum tokens to generate
             top_p: Nucleus sampling threshold
             top_k: Top-k sampling limit
             presence_penalty: Penalty for token presence
+            stop: Client-side stop conditions (see backend.stopping)
+            roi: Region of interest; only that part of the image is sent
+                (see backend.roi)
             
         Yields:
             Response tokens as they arrive
         """
+        yield from iter_text(self.stream_events(
+            image=image,
+            user_query=user_query,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            top_k=top_k,
+            presence_penalty=presence_penalty,
+            stop=stop,
+            roi=roi
+        ))
+    
+    def stream_events(
+        self,
+        image: Union[Image.Image, ImageAsset],
+        user_query: str,
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        presence_penalty: float = 0.0,
+        stop: Optional[StopConditions] = None,
+        roi: Optional[RegionOfInterest] = None
+    ) -> Iterator[StreamEvent]:
+        """
+        Stream typed events from vision model and update memory.
+        
+        Same arguments as stream(). Yields token, usage, finish, error and
+        timing events (see backend.events). The question and answer are added
+        to memory together once the stream completes; if it fails or is
+        abandoned, memory is left unchanged and the question with its partial
+        answer becomes the pending turn (see continue_events).
+        
+        Asking a new question while a turn is pending first commits that turn
+        with its partial answer, so the history matches what the user saw.
+        
+        Opening questions about an ImageAsset are answered from the answer
+        cache when it is enabled (finish reason "cached"); answers about a
+        region are cached per region.
+        
+        Yields:
+            StreamEvent instances in arrival order
+        """
+        self.commit_pending()
+        
+        cache_key = None
+        if answer_cache is not None and not self._has_history():
+            cache_key = self._answer_key(image, roi)
+        if cache_key is not None:
+            cached = answer_cache.get(cache_key, user_query)
+            if cached is not None:
+                self._commit(user_query, cached, "cached")
+                yield TokenEvent(cached)
+                yield FinishEvent("cached")
+                return
+        
         # Build messages with history
-        messages = self._build_messages(image, user_query)
+        with span("chain.build_messages") as build_span:
+            messages = self._build_encoded_messages(image, user_query, roi)
+            build_span.set("messages", len(messages))
         
-        # Add user message to memory
-        self.memory.add_user_message(user_query)
+        result = yield from self._run_turn(
+            messages,
+            user_query,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            top_k=top_k,
+            presence_penalty=presence_penalty,
+            stop=stop
+        )
+        # Only complete answers are reused (not ones cut short by a stop condition)
+        if result is not None and cache_key is not None and result[1] not in STOP_REASON_LABELS:
+            answer_cache.put(cache_key, user_query, result[0])
+    
+    def continue_stream(
+        self,
+        image: Union[Image.Image, ImageAsset],
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        presence_penalty: float = 0.0,
+        stop: Optional[StopConditions] = None,
+        roi: Optional[RegionOfInterest] = None
+    ) -> Iterator[str]:
+        """
+        Resume the pending turn, yielding only the newly generated text.
+        
+        Same arguments as stream() minus the question; see continue_events.
+        """
+        yield from iter_text(self.continue_events(
+            image=image,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            top_k=top_k,
+            presence_penalty=presence_penalty,
+            stop=stop,
+            roi=roi
+        ))
+    
+    def continue_events(
+        self,
+        image: Union[Image.Image, ImageAsset],
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        presence_penalty: float = 0.0,
+        stop: Optional[StopConditions] = None,
+        roi: Optional[RegionOfInterest] = None
+    ) -> Iterator[StreamEvent]:
+        """
+        Resume the pending turn from its partial answer.
+        
+        When the client supports it (see resumes_partial), the partial answer
+        is sent back as a trailing assistant message that the model extends,
+        so text already received is not generated (or paid for) again.
+        Otherwise, and for turns with no partial answer, the question is
+        retried and the partial answer replaced. On success the question and
+        the complete answer are committed.
         
-        # Stream response
-        full_response = ""
-        for chunk in self.qubrid_client.stream(
-            messages=messages,
+        Yields:
+            StreamEvent instances for the continuation only (the whole
+            answer when retried)
+            
+        Raises:
+            ValueError: If there is no pending turn
+        """
+        pending = self.pending_turn
+        if pending is None:
+            raise ValueError("No interrupted turn to continue")
+        
+        prefix = pending.partial if self.resumes_partial else ""
+        with span("chain.build_messages", resumed=bool(prefix)) as build_span:
+            messages = self._build_encoded_messages(image, pending.user_text, roi)
+            if prefix:
+                messages.append(encode_json(format_text_message("assistant", prefix)))
+            build_span.set("messages", len(messages))
+        
+        yield from self._run_turn(
+            messages,
+            pending.user_text,
+            prefix=prefix,
             temperature=temperature,
             max_tokens=max_tokens,
             top_p=top_p,
             top_k=top_k,
-            presence_penalty=presence_penalty
-        ):
-            full_response += chunk
-            yield chunk
+            presence_penalty=presence_penalty,
+            stop=stop
+        )
+    
+    def _run_turn(
+        self,
+        messages: List[MessageFragment],
+        user_query: str,
+        prefix: str = "",
+        **params
+    ) -> Iterator[StreamEvent]:
+        """
+        Stream one request and commit or park the turn.
+        
+        Args:
+            messages: Request messages
+            user_query: Question being answered
+            prefix: Answer text already received (when continuing)
+            **params: Sampling parameters for the client
+            
+        Yields:
+            Client stream events
+            
+        Returns:
+            (answer, finish reason), or None if the turn was left pending
+        """
+        parts = [prefix]
+        parked = False
+        finish_reason = None
+        try:
+            for event in self.qubrid_client.stream_events(
+                messages=messages,
+                tier=self._route_tier(user_query),
+                continue_final=bool(prefix),
+                **params
+            ):
+                if isinstance(event, TokenEvent):
+                    parts.append(event.text)
+                elif isinstance(event, FinishEvent):
+                    finish_reason = event.reason
+                elif isinstance(event, ErrorEvent) and event.fatal:
+                    # Parked before yielding: text consumers raise on this event
+                    self._set_pending(PendingTurn(user_query, "".join(parts), event.message))
+                    parked = True
+                    yield event
+                    return None
+                yield event
+        except GeneratorExit:
+            # Consumer stopped reading (e.g. the page was rerun mid-answer)
+            if not parked:
+                self._set_pending(PendingTurn(user_query, "".join(parts), "Interrupted"))
+            raise
+        except Exception as e:
+            self._set_pending(PendingTurn(user_query, "".join(parts), str(e)))
+            raise
+        
+        full_response = "".join(parts)
+        self._commit(user_query, full_response, finish_reason)
+        return full_response, finish_reason
+    
+    def release(self):
+        """Detach from the current memory and drop cached image blocks (e.g. on session eviction)."""
+        self.memory = ChatHistory()
+        self._image_cache = None
+        self._region_cache = None
+    
+    @property
+    def resumes_partial(self) -> bool:
+        """Whether continue_events extends a partial answer rather than retrying it."""
+        return self.qubrid_client.resume_partial
+    
+    @property
+    def pending_turn(self) -> Optional[PendingTurn]:
+        """Interrupted turn of the current memory, if any (ChatHistory only)."""
+        return self.memory.pending if isinstance(self.memory, ChatHistory) else None
+    
+    def _set_pending(self, turn: Optional[PendingTurn]):
+        """Park an interrupted turn (other memories just drop it)."""
+        if isinstance(self.memory, ChatHistory):
+            self.memory.pending = turn
+    
+    def _commit(self, user_query: str, answer: str, finish_reason: Optional[str] = None):
+        """Add a question and its answer to memory together."""
+        if isinstance(self.memory, ChatHistory):
+            self.memory.add_turn(user_query, answer, finish_reason)
+        else:
+            self.memory.add_messages([HumanMessage(content=user_query), AIMessage(content=answer)])
+    
+    def commit_pending(self):
+        """Keep the pending turn in history with its partial answer (if it has one)."""
+        pending = self.pending_turn
+        if pending is None:
+            return
+        if pending.partial:
+            self._commit(pending.user_text, pending.partial)
+        else:
+            self._set_pending(None)
+    
+    def discard_pending(self):
+        """Drop the pending turn."""
+        self._set_pending(None)
+    
+    def fan_out_events(
+        self,
+        image: Union[Image.Image, ImageAsset],
+        questions: Sequence[str],
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        presence_penalty: float = 0.0,
+        stop: Optional[StopConditions] = None,
+        roi: Optional[RegionOfInterest] = None,
+        max_concurrency: Optional[int] = None
+    ) -> Iterator[Tuple[int, StreamEvent]]:
+        """
+        Answer several independent questions about one image concurrently.
+        
+        Every request carries only the system prompt, the image and its own
+        question - no conversation history, and nothing is added to memory.
+        The image blocks (whole image or region) are base64-encoded once and
+        shared by all requests.
+        Answers to opening questions are served from and stored in the answer
+        cache when it is enabled.
         
-        # Add assistant response to memory
-        self.memory.add_ai_message(full_response)
+        Args:
+            image: PIL Image object or ImageAsset
+            questions: Questions to answer
+            max_concurrency: Requests in flight at once (default FANOUT_CONCURRENCY)
+            (other arguments as in stream())
+            
+        Yields:
+            (question index, event) pairs in arrival order; a question whose
+            request fails yields a fatal ErrorEvent
+        """
+        params = {
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+            "top_k": top_k,
+            "presence_penalty": presence_penalty,
+            "stop": stop,
+        }
+        image_key = self._answer_key(image, roi)
+        with span("chain.build_messages", fan_out=len(questions)):
+            image_pieces = [
+                b"".join(piece.iter_chunks()) if isinstance(piece, ImageBlockStream) else piece
+                for piece in self._image_pieces(image, roi)
+            ]
+        
+        out: "queue.Queue" = queue.Queue()
+        cancelled = threading.Event()
+        remaining = len(questions)
+        executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency or FANOUT_CONCURRENCY))
+        
+        with span("chain.fan_out", questions=len(questions)):
+            try:
+                for index, question in enumerate(questions):
+                    # Each worker runs in a copy of this context so its spans nest under the fan-out
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        self._answer_independent,
+                        index, question, image_pieces, image_key, params, out, cancelled
+                    )
+                
+                while remaining:
+                    index, event = out.get()
+                    if event is _FANOUT_DONE:
+                        remaining -= 1
+                        continue
+                    yield index, event
+            finally:
+                cancelled.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _answer_independent(
+        self,
+        index: int,
+        question: str,
+        image_pieces: List[bytes],
+        image_key: Optional[str],
+        params: Dict[str, Any],
+        out: "queue.Queue",
+        cancelled: threading.Event
+    ):
+        """
+        Stream one fan-out question into the queue (worker thread).
+        
+        Puts (index, event) pairs, always ending with (index, _FANOUT_DONE).
+        """
+        try:
+            if cancelled.is_set():
+                return
+            
+            cached = answer_cache.get(image_key, question) if answer_cache is not None and image_key else None
+            if cached is not None:
+                out.put((index, TokenEvent(cached)))
+                out.put((index, FinishEvent("cached")))
+                return
+            
+            text_block = encode_json({"type": "text", "text": question})
+            messages = [self._system_encoded, encode_user_message(image_pieces + [text_block])]
+            events = self.qubrid_client.stream_events(
+                messages=messages,
+                tier="fast" if len(question) <= SIMPLE_QUERY_CHARS else "default",
+                **params
+            )
+            
+            parts = []
+            complete = True
+            try:
+                for event in events:
+                    if cancelled.is_set():
+                        return
+                    if isinstance(event, TokenEvent):
+                        parts.append(event.text)
+                    elif isinstance(event, FinishEvent) and event.reason in STOP_REASON_LABELS:
+                        complete = False
+                    elif isinstance(event, ErrorEvent) and event.fatal:
+                        complete = False
+                    out.put((index, event))
+            finally:
+                # Closing the generator cancels its HTTP attempts
+                events.close()
+            
+            if complete and answer_cache is not None and image_key:
+                answer_cache.put(image_key, question, "".join(parts))
+        except Exception as e:
+            out.put((index, ErrorEvent(str(e), fatal=True)))
+        finally:
+            out.put((index, _FANOUT_DONE))
     
     def clear_memory(self):
         """Clear conversation history."""
@@ -0,0 +1,72 @@
+"""
+Typed streaming events emitted by the Qubrid client and vision chain.
+"""
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Union
+
+
+@dataclass(frozen=True)
+class TokenEvent:
+    """Content delta from the model."""
+    text: str
+
+
+@dataclass(frozen=True)
+class UsageEvent:
+    """Token usage reported by the API (usually on the last chunk)."""
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+
+
+@dataclass(frozen=True)
+class FinishEvent:
+    """Why generation ended ("stop", "length", ...)."""
+    reason: str
+
+
+@dataclass(frozen=True)
+class ErrorEvent:
+    """
+    Problem in the stream.
+
+    Non-fatal errors (malformed chunks) are reported and skipped;
+    fatal errors (connection lost, API error) end the stream.
+    """
+    message: str
+    fatal: bool = False
+    raw: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class TimingEvent:
+    """Timing mark in seconds since the request started."""
+    name: str
+    elapsed: float
+
+
+StreamEvent = Union[TokenEvent, UsageEvent, FinishEvent, ErrorEvent, TimingEvent]
+
+
+class StreamError(RuntimeError):
+    """Raised by the plain text iterators when a stream fails midway."""
+
+
+def iter_text(events: Iterable[StreamEvent]) -> Iterator[str]:
+    """
+    Reduce an event stream to plain content strings.
+
+    Args:
+        events: Stream events
+
+    Yields:
+        Content chunks
+
+    Raises:
+        StreamError: On a fatal error event
+    """
+    for event in events:
+        if isinstance(event, TokenEvent):
+            yield event.text
+        elif isinstance(event, ErrorEvent) and event.fatal:
+            raise StreamError(event.message)
@@ -0,0 +1,277 @@
+"""
+Multi-frame input: animated GIF / APNG / WebP and (optionally) short videos.
+
+Frames are sampled evenly on a fixed budget, near-identical frames are
+dropped with a vectorized frame-difference metric, and the surviving
+keyframes are encoded in parallel. Only keyframes are sent upstream.
+
+Video needs the optional PyAV package (`pip install av`); without it video
+uploads are rejected and the uploader does not offer video types.
+"""
+import concurrent.futures
+import contextvars
+import importlib.util
+import os
+import warnings
+from io import BytesIO
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from backend.tracing import span
+from backend.utils import MAX_IMAGE_PIXELS, MAX_UPLOAD_BYTES, ImageRejected, encode_image_for_api
+
+# Uploader file types
+IMAGE_TYPES = ["png", "apng", "jpg", "jpeg", "gif", "webp"]
+VIDEO_TYPES = ["mp4", "mov", "webm"]
+
+# Keyframes sent per upload, and candidate frames sampled per keyframe before deduplication
+MAX_KEYFRAMES = int(os.getenv("VISION_MAX_KEYFRAMES", "8"))
+SAMPLES_PER_KEYFRAME = 4
+
+# Frames considered at most (later frames of long inputs are not decoded)
+MAX_SCANNED_FRAMES = int(os.getenv("VISION_MAX_SCANNED_FRAMES", "600"))
+
+# Pixels decoded per upload at most, across frames. Animations and videos decode
+# every frame up to the last one sampled, so large inputs scan fewer frames.
+MAX_DECODED_PIXELS = int(os.getenv("VISION_MAX_DECODED_PIXELS", str(4 * MAX_IMAGE_PIXELS)))
+
+# Mean gray-level difference (fraction of full scale) below which two frames are duplicates
+DEDUP_THRESHOLD = float(os.getenv("VISION_FRAME_DEDUP_THRESHOLD", "0.03"))
+
+# Side of the gray copy frames are compared on
+DEDUP_SIZE = 32
+
+# Longest side of each keyframe (several are sent per turn, so smaller than stills)
+FRAME_MAX_SIDE = 1024
+
+# Keyframes encoded at once (process-wide)
+FRAME_ENCODE_WORKERS = int(os.getenv("VISION_FRAME_ENCODE_WORKERS", "4"))
+
+# Matroska/WebM signature
+EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+
+# ISO base media major brands of video files (HEIC/AVIF stills share the "ftyp" box)
+VIDEO_BRANDS = {
+    b"isom", b"iso2", b"iso4", b"iso5", b"iso6", b"mp41", b"mp42", b"avc1", b"M4V ",
+    b"qt  ", b"3gp4", b"3gp5", b"3gp6", b"3g2a", b"mmp4", b"dash", b"MSNV", b"f4v ",
+}
+
+_encode_pool = concurrent.futures.ThreadPoolExecutor(
+    max_workers=max(1, FRAME_ENCODE_WORKERS),
+    thread_name_prefix="frame-encode"
+)
+
+
+def video_supported() -> bool:
+    """Whether the optional video decoder (PyAV) is installed."""
+    return importlib.util.find_spec("av") is not None
+
+
+def upload_types() -> List[str]:
+    """File types the uploader accepts."""
+    return IMAGE_TYPES + (VIDEO_TYPES if video_supported() else [])
+
+
+def is_video(data: bytes) -> bool:
+    """Whether bytes look like an MP4/MOV (by major brand) or Matroska/WebM container."""
+    if data[:4] == EBML_MAGIC:
+        return True
+    return data[4:8] == b"ftyp" and data[8:12] in VIDEO_BRANDS
+
+
+def scan_limit(frame_count: int, width: int, height: int) -> int:
+    """
+    Frames that may be decoded from the start of an input of this size.
+
+    Args:
+        frame_count: Frames available
+        width: Frame width
+        height: Frame height
+
+    Returns:
+        Frames within MAX_SCANNED_FRAMES and the MAX_DECODED_PIXELS budget (at least 1)
+    """
+    return max(1, min(frame_count, MAX_SCANNED_FRAMES, MAX_DECODED_PIXELS // max(1, width * height)))
+
+
+def sample_indices(frame_count: int, samples: int) -> List[int]:
+    """
+    Evenly spaced frame indices, always including the first and last frame.
+
+    Args:
+        frame_count: Frames available
+        samples: Frames wanted
+
+    Returns:
+        Sorted unique indices
+    """
+    if frame_count <= 0:
+        return []
+    return np.unique(np.linspace(0, frame_count - 1, min(samples, frame_count)).round().astype(int)).tolist()
+
+
+def _to_frame(image: Image.Image) -> Image.Image:
+    """Copy one decoded frame as RGB(A), downscaled to FRAME_MAX_SIDE."""
+    transparent = "transparency" in image.info or image.mode in ("RGBA", "LA", "PA")
+    frame = image.convert("RGBA" if transparent else "RGB")
+    if frame is image:
+        frame = image.copy()
+    frame.thumbnail((FRAME_MAX_SIDE, FRAME_MAX_SIDE), Image.Resampling.BILINEAR)
+    return frame
+
+
+def select_keyframes(
+    frames: Sequence[Image.Image],
+    budget: int = MAX_KEYFRAMES,
+    threshold: float = DEDUP_THRESHOLD
+) -> List[int]:
+    """
+    Pick distinct frames.
+
+    All frames are reduced to small gray arrays and compared pairwise in one
+    broadcast (mean absolute difference). A frame is kept when it differs
+    from every frame kept before it, so loops that return to an earlier
+    scene are not sent twice. If more than `budget` remain, an evenly
+    spaced subset is kept.
+
+    Args:
+        frames: Candidate frames in playback order
+        budget: Most keyframes returned
+        threshold: Duplicate threshold as a fraction of full scale
+
+    Returns:
+        Indices into `frames` of the keyframes, in order
+    """
+    if not frames:
+        return []
+    gray = np.stack([
+        np.asarray(frame.convert("L").resize((DEDUP_SIZE, DEDUP_SIZE), Image.Resampling.BILINEAR), dtype=np.float32)
+        for frame in frames
+    ]).reshape(len(frames), -1)
+    distance = np.abs(gray[:, None, :] - gray[None, :, :]).mean(axis=2) / 255.0
+
+    kept = [0]
+    for index in range(1, len(frames)):
+        if distance[index, kept].min() > threshold:
+            kept.append(index)
+    if len(kept) > budget:
+        kept = [kept[i] for i in sample_indices(len(kept), budget)]
+    return kept
+
+
+def _read_animation(data: bytes, samples: int) -> Optional[List[Image.Image]]:
+    """Sampled frames of an animated image, or None for a still image."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            image = Image.open(BytesIO(data))
+            if not getattr(image, "is_animated", False):
+                return None
+            width, height = image.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise ImageRejected(
+                    f"Animation is {width}x{height}; at most {MAX_IMAGE_PIXELS / 1e6:.0f} megapixels are accepted"
+                )
+            frames = []
+            for index in sample_indices(scan_limit(image.n_frames, width, height), samples):
+                image.seek(index)
+                frames.append(_to_frame(image))
+            return frames
+    except ImageRejected:
+        raise
+    except (OSError, SyntaxError, ValueError, EOFError, Image.DecompressionBombError) as e:
+        raise ImageRejected(f"Could not decode animation: {e}")
+
+
+def _read_video(data: bytes, samples: int) -> List[Image.Image]:
+    """Sampled frames of a video (needs PyAV)."""
+    try:
+        import av
+    except ImportError:
+        raise ImageRejected("Video input needs the optional PyAV package (pip install av)")
+
+    try:
+        with av.open(BytesIO(data)) as container:
+            if not container.streams.video:
+                raise ImageRejected("File has no video stream")
+            stream = container.streams.video[0]
+            width, height = stream.codec_context.width, stream.codec_context.height
+            if width * height > MAX_IMAGE_PIXELS:
+                raise ImageRejected(f"Video is {width}x{height}; too large to decode")
+
+            frame_count = stream.frames
+            if not frame_count and stream.duration and stream.average_rate:
+                frame_count = int(stream.duration * stream.time_base * stream.average_rate)
+            wanted = set(sample_indices(scan_limit(frame_count or MAX_SCANNED_FRAMES, width, height), samples))
+            last = max(wanted)
+
+            frames = []
+            for index, frame in enumerate(container.decode(stream)):
+                if index in wanted:
+                    frames.append(_to_frame(frame.to_image()))
+                if index >= last:
+                    break
+    except ImageRejected:
+        raise
+    except (av.error.FFmpegError, ValueError) as e:
+        raise ImageRejected(f"Could not decode video: {e}")
+    if not frames:
+        raise ImageRejected("Video has no decodable frames")
+    return frames
+
+
+def decode_keyframes(
+    data: bytes,
+    budget: int = MAX_KEYFRAMES,
+    max_bytes: int = MAX_UPLOAD_BYTES
+) -> Optional[List[Image.Image]]:
+    """
+    Decode the keyframes of a multi-frame upload.
+
+    Args:
+        data: Uploaded bytes
+        budget: Most keyframes returned
+        max_bytes: Largest accepted upload
+
+    Returns:
+        Keyframes in playback order, or None for single-frame images
+        (decode those with decode_image)
+
+    Raises:
+        ImageRejected: If the upload is too large or cannot be decoded
+    """
+    if len(data) > max_bytes:
+        raise ImageRejected(f"File is larger than {max_bytes / 2**20:.0f} MB")
+
+    video = is_video(data)
+    with span("frames.decode", bytes=len(data), video=video) as decode_span:
+        samples = SAMPLES_PER_KEYFRAME * budget
+        frames = _read_video(data, samples) if video else _read_animation(data, samples)
+        if frames is None:
+            return None
+        decode_span.set("sampled", len(frames))
+
+    with span("frames.dedup", frames=len(frames)) as dedup_span:
+        keyframes = [frames[i] for i in select_keyframes(frames, budget)]
+        dedup_span.set("keyframes", len(keyframes))
+    return keyframes
+
+
+def encode_keyframes(frames: Sequence[Image.Image]) -> List[Tuple[bytes, str]]:
+    """
+    Encode keyframes for the API in parallel (PIL encoders release the GIL).
+
+    Args:
+        frames: Keyframes
+
+    Returns:
+        (encoded bytes, MIME type) per frame, in order
+    """
+    with span("frames.encode", frames=len(frames)):
+        futures = [
+            _encode_pool.submit(contextvars.copy_context().run, encode_image_for_api, frame)
+            for frame in frames
+        ]
+        return [future.result() for future in futures]
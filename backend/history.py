@@ -0,0 +1,262 @@
+"""
+Compact chat history store for the vision chain.
+Keeps each message's API form alongside its text so request building never re-serializes old turns.
+"""
+import itertools
+import sys
+import threading
+from typing import Callable, Dict, List, Any, Iterable, Optional, Sequence
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+
+from backend.request_body import encode_json
+
+
+# LangChain message type -> Qubrid API role
+API_ROLES = {
+    "system": "system",
+    "human": "user",
+    "ai": "assistant",
+}
+
+# Process-wide record ids (used as render-cache keys by the UI)
+_record_ids = itertools.count(1)
+
+# Serializes first loads of lazy histories
+_load_lock = threading.Lock()
+
+
+def format_text_message(role: str, text: str) -> Dict[str, Any]:
+    """
+    Build a text-only message dict in Qubrid API format.
+
+    Args:
+        role: API role ("system", "user" or "assistant")
+        text: Message text
+
+    Returns:
+        Message dict with content as a single text block
+    """
+    return {
+        "role": role,
+        "content": [
+            {
+                "type": "text",
+                "text": text
+            }
+        ]
+    }
+
+
+class ChatRecord:
+    """
+    Single immutable history entry.
+
+    Exposes `type` and `content` like a LangChain message so UI code can
+    render records directly, and caches the API dict built at creation
+    plus its JSON encoding on first use. `id` is unique within the process;
+    `finish_reason` records why an answer ended, when known.
+    """
+
+    __slots__ = ("id", "type", "content", "finish_reason", "api", "_encoded")
+
+    def __init__(self, type: str, content: str, finish_reason: Optional[str] = None):
+        self.id = next(_record_ids)
+        self.type = type
+        self.content = content
+        self.finish_reason = finish_reason
+        self.api = format_text_message(API_ROLES.get(type, "user"), content)
+        self._encoded = None
+
+    @property
+    def encoded(self) -> bytes:
+        """JSON-encoded API message (computed once)."""
+        if self._encoded is None:
+            self._encoded = encode_json(self.api)
+        return self._encoded
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate heap bytes of the text and its cached encoding."""
+        return sys.getsizeof(self.content) + (len(self._encoded) if self._encoded is not None else 0)
+
+    def to_langchain(self) -> BaseMessage:
+        """Convert record to the equivalent LangChain message."""
+        if self.type == "ai":
+            return AIMessage(content=self.content)
+        if self.type == "system":
+            return SystemMessage(content=self.content)
+        return HumanMessage(content=self.content)
+
+    def __repr__(self) -> str:
+        return f"ChatRecord(type={self.type!r}, content={self.content[:40]!r})"
+
+
+class PendingTurn:
+    """
+    A turn whose answer did not complete.
+
+    Kept beside the history (not in it) until it is continued to
+    completion, committed with its partial answer, or discarded.
+    """
+
+    __slots__ = ("user_text", "partial", "error")
+
+    def __init__(self, user_text: str, partial: str, error: str):
+        self.user_text = user_text
+        self.partial = partial
+        self.error = error
+
+    def __repr__(self) -> str:
+        return f"PendingTurn(user_text={self.user_text[:40]!r}, partial={len(self.partial)} chars)"
+
+
+class ChatHistory(BaseChatMessageHistory):
+    """
+    Lightweight replacement for InMemoryChatMessageHistory.
+
+    Records and their API dicts are stored in parallel lists, so building a
+    request is a single list copy. The LangChain `messages` property is kept
+    as an adapter and builds message objects only when asked.
+
+    A history built with a loader (e.g. from an archive) reads its records
+    on first use; until then it holds no messages in memory.
+    """
+
+    def __init__(
+        self,
+        records: Iterable[ChatRecord] = (),
+        loader: Optional[Callable[[], Iterable[ChatRecord]]] = None
+    ):
+        """
+        Initialize the history.
+
+        Args:
+            records: Optional existing records to start from (shared, not copied)
+            loader: Returns the records when they are first needed (instead of `records`)
+        """
+        self.pending: Optional[PendingTurn] = None
+        if loader is not None:
+            # _records/_api stay unset until __getattr__ loads them
+            self._loader = loader
+            return
+        self._records: List[ChatRecord] = []
+        self._api: List[Dict[str, Any]] = []
+        for record in records:
+            self.append(record)
+
+    def __getattr__(self, name: str):
+        # Only reached for attributes that are not set: the lists of an unloaded history
+        if name not in ("_records", "_api") or "_loader" not in self.__dict__:
+            raise AttributeError(name)
+        with _load_lock:
+            if "_loader" in self.__dict__:
+                records, api = [], []
+                for record in self.__dict__["_loader"]():
+                    records.append(record)
+                    api.append(record.api)
+                self._records, self._api = records, api
+                del self._loader
+        return self.__dict__[name]
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the records are in memory (always, unless built with a loader)."""
+        return "_loader" not in self.__dict__
+
+    @classmethod
+    def from_messages(cls, messages: Sequence[BaseMessage]) -> "ChatHistory":
+        """
+        Build a history from LangChain messages.
+
+        Args:
+            messages: LangChain messages (e.g. InMemoryChatMessageHistory.messages)
+
+        Returns:
+            New ChatHistory with one record per message
+        """
+        return cls(ChatRecord(msg.type, msg.content) for msg in messages)
+
+    @property
+    def records(self) -> List[ChatRecord]:
+        """Stored records in conversation order (do not mutate)."""
+        return self._records
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """LangChain view of the history (built on access)."""
+        return [record.to_langchain() for record in self._records]
+
+    def api_messages(self) -> List[Dict[str, Any]]:
+        """
+        Get cached API dicts for all stored messages.
+
+        Returns:
+            New list referencing the cached message dicts
+        """
+        return list(self._api)
+
+    def encoded_messages(self) -> List[bytes]:
+        """
+        Get JSON-encoded API messages for all stored messages.
+
+        Returns:
+            List of cached encoded messages
+        """
+        return [record.encoded for record in self._records]
+
+    def append(self, record: ChatRecord):
+        """Append an existing record."""
+        self._records.append(record)
+        self._api.append(record.api)
+
+    def add_user_message(self, message) -> None:
+        """Add a user message (string or HumanMessage)."""
+        content = message if isinstance(message, str) else message.content
+        self.append(ChatRecord("human", content))
+
+    def add_ai_message(self, message) -> None:
+        """Add an assistant message (string or AIMessage)."""
+        content = message if isinstance(message, str) else message.content
+        self.append(ChatRecord("ai", content))
+
+    def add_turn(self, user_text: str, ai_text: str, finish_reason: Optional[str] = None) -> None:
+        """
+        Add a question and its answer together.
+
+        Both records are built before either is stored, so the history never
+        holds a question without its answer.
+
+        Args:
+            user_text: Question
+            ai_text: Answer
+            finish_reason: Why the answer ended (e.g. "stop", "loop")
+        """
+        user, ai = ChatRecord("human", user_text), ChatRecord("ai", ai_text, finish_reason)
+        self._records += (user, ai)
+        self._api += (user.api, ai.api)
+        self.pending = None
+
+    def add_message(self, message: BaseMessage) -> None:
+        """Add a LangChain message."""
+        self.append(ChatRecord(message.type, message.content))
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Add several LangChain messages."""
+        for message in messages:
+            self.add_message(message)
+
+    def clear(self) -> None:
+        """Remove all messages (and any pending turn)."""
+        self._records.clear()
+        self._api.clear()
+        self.pending = None
+
+    def nbytes(self) -> int:
+        """Approximate heap bytes held by the stored messages (0 until loaded)."""
+        if not self.loaded:
+            return 0
+        return sum(record.nbytes for record in self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
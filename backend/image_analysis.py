@@ -0,0 +1,96 @@
+"""
+Fast image analysis for choosing encode parameters.
+Works on a small downsampled copy so it costs a few milliseconds per image.
+"""
+from dataclasses import dataclass
+import numpy as np
+from PIL import Image
+
+# Longest side of the copy the features are computed on
+ANALYSIS_SIZE = 256
+
+# Gray-level step (0-255) between neighbours that counts as an edge
+EDGE_THRESHOLD = 40
+
+# Longest side sent upstream per image kind (the model downsamples beyond this anyway)
+MAX_SIDE_TEXT = 2048
+MAX_SIDE_PHOTO = 1536
+
+
+@dataclass(frozen=True)
+class ImageFeatures:
+    """Cheap statistics of an image."""
+    colors: int            # distinct colors after 5-bit-per-channel quantization
+    edge_density: float    # fraction of pixels next to a sharp gray-level step
+    entropy: float         # gray histogram entropy in bits (0-8)
+    alpha_used: bool       # any pixel not fully opaque
+
+
+@dataclass(frozen=True)
+class EncodeParams:
+    """How to encode an image for the API."""
+    kind: str              # "text", "graphic" or "photo"
+    format: str            # "PNG" or "JPEG"
+    quality: int           # JPEG quality (ignored for PNG)
+    max_side: int          # longest side after downscaling
+
+    @property
+    def mime(self) -> str:
+        return "image/png" if self.format == "PNG" else "image/jpeg"
+
+
+def analyze_image(image: Image.Image) -> ImageFeatures:
+    """
+    Compute image features on a downsampled copy.
+
+    Args:
+        image: PIL Image object
+
+    Returns:
+        ImageFeatures for the image
+    """
+    small = image.copy()
+    small.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE), Image.Resampling.NEAREST)
+
+    alpha_used = False
+    if small.mode in ("RGBA", "LA") or (small.mode == "P" and "transparency" in small.info):
+        small = small.convert("RGBA")
+        alpha_used = bool((np.asarray(small)[:, :, 3] < 255).any())
+
+    rgb = np.asarray(small.convert("RGB"), dtype=np.uint16)
+    quantized = ((rgb[:, :, 0] >> 3) << 10) | ((rgb[:, :, 1] >> 3) << 5) | (rgb[:, :, 2] >> 3)
+    colors = int(np.count_nonzero(np.bincount(quantized.ravel(), minlength=1 << 15)))
+
+    gray = (rgb[:, :, 0] * 77 + rgb[:, :, 1] * 150 + rgb[:, :, 2] * 29) >> 8
+    gray = gray.astype(np.int16)
+    edges_x = np.abs(np.diff(gray, axis=1)) > EDGE_THRESHOLD
+    edges_y = np.abs(np.diff(gray, axis=0)) > EDGE_THRESHOLD
+    edge_density = float(edges_x.mean() + edges_y.mean()) / 2 if gray.size > 1 else 0.0
+
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    probabilities = histogram[histogram > 0] / gray.size
+    entropy = float(-(probabilities * np.log2(probabilities)).sum())
+
+    return ImageFeatures(colors, edge_density, entropy, alpha_used)
+
+
+def choose_encode_params(features: ImageFeatures) -> EncodeParams:
+    """
+    Pick format, quality and resolution from image features.
+
+    Screenshots and documents (few colors, hard edges) stay lossless so text
+    remains sharp; photos go to JPEG, which is several times smaller.
+
+    Args:
+        features: Output of analyze_image
+
+    Returns:
+        EncodeParams for the encoder
+    """
+    if features.alpha_used:
+        return EncodeParams("graphic", "PNG", 0, MAX_SIDE_TEXT)
+    if features.colors <= 512 or (features.edge_density > 0.08 and features.entropy < 5.0):
+        return EncodeParams("text", "PNG", 0, MAX_SIDE_TEXT)
+    if features.colors <= 4096 and features.edge_density > 0.05:
+        return EncodeParams("graphic", "JPEG", 92, MAX_SIDE_TEXT)
+    return EncodeParams("photo", "JPEG", 85, MAX_SIDE_PHOTO)
@@ -0,0 +1,318 @@
+"""
+Perceptual-hash index for near-duplicate image detection.
+64-bit dHashes live in a memory-mapped file shared by all workers;
+lookups are a vectorized Hamming-distance scan with NumPy. A hash match
+only nominates candidates: callers confirm them with a pixel comparison
+(same_image) before treating two images as the same.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import numpy as np
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+# Default index file (set VISION_IMAGE_INDEX_PATH="" to keep it in memory)
+DEFAULT_INDEX_PATH = ".cache/image_index.bin"
+
+# Max differing bits (of 64) for two images to count as near-duplicates
+NEAR_DUPLICATE_BITS = 6
+
+# Hashes with fewer confident bits than this are not used for matching: on
+# mostly uniform images (e.g. text pages) the bits are decided by noise
+MIN_HASH_CONFIDENCE = 0.5
+
+# Gray-level step between neighbouring hash cells that decides a bit reliably
+CONFIDENT_STEP = 3
+
+# Pixel confirmation: longest side compared, block size, largest mean block
+# difference (gray levels) and aspect-ratio tolerance for a duplicate
+CONFIRM_SIZE = 512
+CONFIRM_BLOCK = 8
+CONFIRM_MAX_BLOCK_DIFF = 12.0
+CONFIRM_ASPECT_TOLERANCE = 0.02
+
+INDEX_MAGIC = b"VIDX0001"
+HEADER_SIZE = 64
+INITIAL_CAPACITY = 4096
+RECORD_DTYPE = np.dtype([("hash", "<u8"), ("key", "S16")])
+
+# Number of cached answers kept per process
+ANSWER_CACHE_SIZE = 1024
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    Compute a 64-bit difference hash.
+
+    Robust to re-encoding, resizing and small color shifts.
+
+    Args:
+        image: PIL Image object
+
+    Returns:
+        Hash as an unsigned 64-bit integer
+    """
+    return dhash_with_confidence(image)[0]
+
+
+def dhash_with_confidence(image: Image.Image) -> Tuple[int, float]:
+    """
+    Compute the dHash and how much of it reflects real image structure.
+
+    Args:
+        image: PIL Image object
+
+    Returns:
+        (hash, fraction of bits whose neighbouring cells differ by at least
+        CONFIDENT_STEP gray levels)
+    """
+    small = image.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    steps = pixels[:, 1:] - pixels[:, :-1]
+    bits = (steps > 0).ravel()
+    confidence = float((np.abs(steps) >= CONFIDENT_STEP).mean())
+    return int(np.packbits(bits).view(">u8")[0]), confidence
+
+
+def _confirm_array(image: Image.Image) -> np.ndarray:
+    """Gray copy at CONFIRM_SIZE, cropped to whole blocks."""
+    small = image.convert("L")
+    small.thumbnail((CONFIRM_SIZE, CONFIRM_SIZE), Image.Resampling.BILINEAR)
+    pixels = np.asarray(small, dtype=np.float32)
+    height = pixels.shape[0] // CONFIRM_BLOCK * CONFIRM_BLOCK
+    width = pixels.shape[1] // CONFIRM_BLOCK * CONFIRM_BLOCK
+    return pixels[:height, :width]
+
+
+def same_image(a: Image.Image, b: Image.Image) -> bool:
+    """
+    Confirm that two hash-matched images show the same content.
+
+    Both are compared as gray images at the same size. A re-encoded or
+    resized copy differs a little everywhere; a different document with
+    the same layout differs a lot in a few places, so the largest mean
+    difference over small blocks is what is tested.
+
+    Args:
+        a: First image
+        b: Second image
+
+    Returns:
+        True if the images are near-duplicates
+    """
+    if abs(a.width / a.height - b.width / b.height) > CONFIRM_ASPECT_TOLERANCE * (a.width / a.height):
+        return False
+    pixels_a = _confirm_array(a)
+    pixels_b = _confirm_array(b)
+    if pixels_a.shape != pixels_b.shape:
+        b_resized = b.convert("L").resize((pixels_a.shape[1], pixels_a.shape[0]), Image.Resampling.BILINEAR)
+        pixels_b = np.asarray(b_resized, dtype=np.float32)
+    if not pixels_a.size:
+        return False
+    height, width = pixels_a.shape
+    blocks = np.abs(pixels_a - pixels_b).reshape(
+        height // CONFIRM_BLOCK, CONFIRM_BLOCK, width // CONFIRM_BLOCK, CONFIRM_BLOCK
+    ).mean(axis=(1, 3))
+    return float(blocks.max()) <= CONFIRM_MAX_BLOCK_DIFF
+
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class ImageIndex:
+    """
+    Append-only (hash, key) index.
+
+    File layout: 64-byte header (magic, record count) followed by fixed-size
+    records. Appends take an exclusive file lock; readers never lock and
+    remap when another worker has grown the file.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Initialize the index.
+
+        Args:
+            path: Backing file, or None for a private in-memory index
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if path is None:
+            self._records = np.zeros(INITIAL_CAPACITY, dtype=RECORD_DTYPE)
+            self._count = 0
+            return
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "ab+") as f:
+            self._with_file_lock(f, self._init_file)
+        self._map()
+
+    def _with_file_lock(self, f, fn):
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            return fn(f)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _init_file(self, f):
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            f.write(INDEX_MAGIC.ljust(HEADER_SIZE, b"\0"))
+            f.truncate(HEADER_SIZE + INITIAL_CAPACITY * RECORD_DTYPE.itemsize)
+        f.seek(0)
+        if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+            raise ValueError(f"{self.path} is not an image index file")
+
+    def _map(self):
+        """(Re)map the whole file."""
+        self._header = np.memmap(self.path, dtype="<u8", mode="r+", offset=8, shape=(1,))
+        size = os.path.getsize(self.path)
+        self._records = np.memmap(
+            self.path,
+            dtype=RECORD_DTYPE,
+            mode="r+",
+            offset=HEADER_SIZE,
+            shape=((size - HEADER_SIZE) // RECORD_DTYPE.itemsize,)
+        )
+
+    def _current_count(self) -> int:
+        if self.path is None:
+            return self._count
+        count = int(self._header[0])
+        if count > len(self._records):
+            self._map()
+        return count
+
+    def __len__(self) -> int:
+        return self._current_count()
+
+    def add(self, image_hash: int, key: str):
+        """
+        Append an image hash.
+
+        Args:
+            image_hash: 64-bit dHash
+            key: Asset key (first 16 bytes are stored)
+        """
+        with self._lock:
+            if self.path is None:
+                if self._count == len(self._records):
+                    self._records = np.concatenate([self._records, np.zeros_like(self._records)])
+                self._records[self._count] = (image_hash, key.encode()[:16])
+                self._count += 1
+                return
+            with open(self.path, "rb+") as f:
+                self._with_file_lock(f, lambda f: self._append_locked(f, image_hash, key))
+
+    def _append_locked(self, f, image_hash: int, key: str):
+        count = self._current_count()
+        if count == len(self._records):
+            f.truncate(HEADER_SIZE + 2 * len(self._records) * RECORD_DTYPE.itemsize)
+            self._map()
+        self._records[count] = (image_hash, key.encode()[:16])
+        # Publish the record before the count so lock-free readers never see garbage
+        self._header[0] = count + 1
+
+    def candidates(self, image_hash: int, max_distance: int = NEAR_DUPLICATE_BITS) -> List[Tuple[str, int]]:
+        """
+        Find all stored images within a Hamming distance.
+
+        Args:
+            image_hash: 64-bit dHash to look up
+            max_distance: Largest Hamming distance accepted
+
+        Returns:
+            (key, distance) pairs, closest first
+        """
+        count = self._current_count()
+        if count == 0:
+            return []
+        distances = _popcount(self._records["hash"][:count] ^ np.uint64(image_hash))
+        matches = np.flatnonzero(distances <= max_distance)
+        matches = matches[np.argsort(distances[matches], kind="stable")]
+        return [(self._records["key"][i].decode(), int(distances[i])) for i in matches]
+
+    def nearest(self, image_hash: int, max_distance: int = NEAR_DUPLICATE_BITS) -> Optional[Tuple[str, int]]:
+        """
+        Find the closest stored image.
+
+        Args:
+            image_hash: 64-bit dHash to look up
+            max_distance: Largest Hamming distance accepted as a match
+
+        Returns:
+            (key, distance) of the best match, or None
+        """
+        matches = self.candidates(image_hash, max_distance)
+        return matches[0] if matches else None
+
+
+class AnswerCache:
+    """LRU of answers to opening questions, keyed by (asset key, question)."""
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE):
+        self.max_size = max_size
+        self._answers: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(question: str) -> str:
+        return re.sub(r"\s+", " ", question.strip().lower())
+
+    def get(self, asset_key: str, question: str) -> Optional[str]:
+        """Get a cached answer, if any."""
+        key = (asset_key, self._normalize(question))
+        with self._lock:
+            answer = self._answers.get(key)
+            if answer is not None:
+                self._answers.move_to_end(key)
+            return answer
+
+    def put(self, asset_key: str, question: str, answer: str):
+        """Store an answer."""
+        with self._lock:
+            self._answers[(asset_key, self._normalize(question))] = answer
+            while len(self._answers) > self.max_size:
+                self._answers.popitem(last=False)
+
+
+_index: Optional[ImageIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_image_index() -> ImageIndex:
+    """
+    Get the process-wide image index.
+
+    Uses VISION_IMAGE_INDEX_PATH (default .cache/image_index.bin); an empty
+    value keeps the index in memory.
+
+    Returns:
+        Shared ImageIndex
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            path = os.getenv("VISION_IMAGE_INDEX_PATH", DEFAULT_INDEX_PATH)
+            _index = ImageIndex(path or None)
+        return _index
+
+
+# Answers to identical opening questions about the same image (VISION_ANSWER_CACHE=1)
+answer_cache = AnswerCache() if os.getenv("VISION_ANSWER_CACHE", "0") == "1" else None
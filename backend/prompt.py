@@ -21,6 +21,18 @@ questions based strictly on the visual content and the conversation context.
 - Stay focused on the user’s request
 - Ask clarifying questions only when required"""
 
+# Sent ahead of the question when a cropped region comes with an overview
+REGION_CONTEXT_NOTE = (
+    "The first image is a small overview of the whole picture with a red outline "
+    "around the region of interest; the second image is that region in full detail."
+)
+
+# Sent ahead of the question with the keyframes of an animation or video
+FRAMES_NOTE = (
+    "The {count} images are keyframes of one animation or video, in playback order. "
+    "Near-identical frames were left out."
+)
+
 
 def get_system_prompt() -> str:
     """
@@ -4,14 +4,86 @@ Handles streaming communication with Qubrid's multimodal API.
 """
 import os
 import json
+import contextvars
+import queue
+import socket
+import threading
+import time
 import requests
-from typing import Dict, List, Any, Iterator
+from typing import Dict, List, Any, Iterator, Optional
 from dotenv import load_dotenv
 
+from backend.events import (
+    StreamEvent,
+    TokenEvent,
+    UsageEvent,
+    FinishEvent,
+    ErrorEvent,
+    TimingEvent,
+    iter_text,
+)
+from backend.request_body import MessageFragment, RequestBody
+from backend.router import Endpoint, get_router
+from backend.stopping import DEADLINE, StopConditions, StopMonitor
+from backend.tracing import mark, span, trace_headers
+
 # Load environment variables
 load_dotenv()
 
 
+# End-of-stream marker put on the attempt queue
+_DONE = object()
+
+
+def abort_response(response: requests.Response):
+    """
+    Drop a streaming response's connection immediately.
+    
+    Shutting the socket down unblocks a reader in another thread (closing the
+    buffered file would wait for that reader) and tells the server to stop
+    generating. The reading side closes the response afterwards.
+    
+    Args:
+        response: Streaming HTTP response
+    """
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is None:
+        # "Connection: close" responses own the socket via http.client's file object
+        fp = getattr(getattr(response.raw, "_fp", None), "fp", None)
+        sock = getattr(getattr(fp, "raw", None), "_sock", None)
+    if sock is None:
+        response.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class _Failed:
+    """Queue item for a request that failed before streaming started."""
+    
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+class _Attempt:
+    """One request to one endpoint, running in its own thread."""
+    
+    def __init__(self, endpoint: Endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.response = None
+        self.cancelled = False
+        self.buffer = []
+    
+    def cancel(self):
+        """Stop forwarding events and drop the connection."""
+        self.cancelled = True
+        if self.response is not None:
+            abort_response(self.response)
+
+
 class QubridVisionLLM:
     """
     Minimal wrapper for Qubrid's hosted vision model.
@@ -27,43 +99,117 @@ class QubridVisionLLM:
         )
         self.model_name = "Qwen/Qwen3-VL-30B-A3B-Instruct"
         
+        # Send bodies with chunked transfer encoding instead of one joined buffer
+        self.stream_upload = os.getenv("QUBRID_STREAM_UPLOAD", "0") == "1"
+        
+        # Ask for a final usage chunk (OpenAI-style stream_options)
+        self.include_usage = os.getenv("QUBRID_INCLUDE_USAGE", "1") == "1"
+        
+        # Resume interrupted answers with continue_final_message (vLLM-only; off = retry in full)
+        self.resume_partial = os.getenv("QUBRID_RESUME_PARTIAL", "0") == "1"
+        
+        # Client-side stop conditions used when a call passes none
+        self.stop_conditions = StopConditions.from_env()
+        
         if not self.api_key:
             raise ValueError("QUBRID_API_KEY must be set in .env file")
+        
+        # Shared across sessions so latency/error statistics are process-wide
+        self.router = get_router(self.api_key, self.api_base, self.model_name)
     
     def stream(
         self, 
-        messages: List[Dict[str, Any]], 
+        messages: List[MessageFragment], 
         temperature: float = 0.7,
         max_tokens: int = 1024,
         top_p: float = 0.9,
         top_k: int = 40,
-        presence_penalty: float = 0.0
+        presence_penalty: float = 0.0,
+        tier: Optional[str] = None,
+        continue_final: bool = False,
+        stop: Optional[StopConditions] = None
     ) -> Iterator[str]:
         """
         Stream tokens from Qubrid API.
         
         Args:
-            messages: List of message dicts in OpenAI format
+            messages: Messages in OpenAI format, as dicts or pre-encoded
+                JSON fragments (see backend.request_body)
             temperature: Sampling temperature (0.0-2.0)
             max_tokens: Maximum tokens to generate
             top_p: Nucleus sampling threshold
             top_k: Top-k sampling limit
             presence_penalty: Penalty for token presence
+            tier: Preferred routing tier (see backend.router)
+            continue_final: Extend the trailing assistant message instead of
+                starting a new one (used to resume interrupted answers; only
+                servers supporting vLLM's continue_final_message, see
+                resume_partial)
+            stop: Client-side stop conditions (default from the environment)
             
         Yields:
             Content chunks as they arrive from the API
             
         Raises:
             requests.HTTPError: If API request fails
+            StreamError: If the stream fails after it started
         """
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
+        yield from iter_text(self.stream_events(
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            top_k=top_k,
+            presence_penalty=presence_penalty,
+            tier=tier,
+            continue_final=continue_final,
+            stop=stop
+        ))
+    
+    def stream_events(
+        self, 
+        messages: List[MessageFragment], 
+        temperature: float = 0.7,
+        max_tokens: int = 1024,
+        top_p: float = 0.9,
+        top_k: int = 40,
+        presence_penalty: float = 0.0,
+        tier: Optional[str] = None,
+        continue_final: bool = False,
+        stop: Optional[StopConditions] = None
+    ) -> Iterator[StreamEvent]:
+        """
+        Stream typed events from Qubrid API.
+        
+        Same arguments as stream(). Besides content deltas this reports usage,
+        finish reason, malformed chunks and mid-stream failures, plus timing
+        marks: "response" (headers received), "first_token" and "done".
+        
+        The endpoint is chosen by the router. Requests that fail before the
+        first token fail over to the next endpoint, and a slow first token
+        triggers a hedge request to the next endpoint; whichever answers
+        first wins and the other is closed.
+        
+        Stop sequences, loop detection, the deadline and the token budget
+        (see backend.stopping) are applied to the streamed text. When one
+        triggers, the connection is dropped at once and the stream ends with
+        a FinishEvent naming the condition ("stop_sequence", "loop",
+        "deadline", "token_budget"). A deadline that passes before the first
+        token is a fatal error instead.
         
-        payload = {
-            "model": self.model_name,
-            "messages": messages,
+        Args:
+            tier: Preferred routing tier (e.g. "fast" for simple questions)
+            continue_final: Continue the trailing assistant message (vLLM-style
+                continue_final_message) rather than answering afresh
+            stop: Client-side stop conditions (default from the environment)
+        
+        Yields:
+            StreamEvent instances in arrival order
+            
+        Raises:
+            requests.HTTPError: If every endpoint fails before streaming
+        """
+        params = {
             "temperature": temperature,
             "max_tokens": max_tokens,
             "top_p": top_p,
@@ -71,18 +217,241 @@ class QubridVisionLLM:
             "presence_penalty": presence_penalty,
             "stream": True,
         }
+        if self.include_usage:
+            params["stream_options"] = {"include_usage": True}
+        if continue_final:
+            params["continue_final_message"] = True
+            params["add_generation_prompt"] = False
+        conditions = stop or self.stop_conditions
+        if conditions.stop_sequences:
+            # Upstream stops too where supported; the monitor covers the rest
+            params["stop"] = list(conditions.stop_sequences)
         
-        response = requests.post(
-            self.api_base, 
-            headers=headers, 
-            json=payload, 
-            stream=True,
-            timeout=60
-        )
-        response.raise_for_status()
+        started = time.perf_counter()
+        monitor = StopMonitor(conditions, started)
+        candidates = self.router.plan(tier)
+        out: "queue.Queue" = queue.Queue()
+        active: List[_Attempt] = []
+        winner = None
+        
+        def launch():
+            attempt = _Attempt(candidates.pop(0))
+            active.append(attempt)
+            # Each attempt runs in a copy of this context so its spans nest under the request
+            threading.Thread(
+                target=contextvars.copy_context().run,
+                args=(self._run_attempt, attempt, params, messages, out, started),
+                daemon=True
+            ).start()
+            delay = self.router.hedge_after(attempt.endpoint)
+            return time.perf_counter() + delay if delay and candidates else None
+        
+        first_token_at = None
+        with span("llm.request", tier=tier or "default") as request_span:
+            hedge_at = launch()
+            try:
+                while True:
+                    timeout = monitor.remaining()
+                    if winner is None and hedge_at is not None:
+                        until_hedge = hedge_at - time.perf_counter()
+                        timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+                    try:
+                        attempt, event = out.get(timeout=None if timeout is None else max(timeout, 0.0))
+                    except queue.Empty:
+                        if monitor.expired():
+                            # Drop the connections before reporting, so generation stops now
+                            for attempt in active:
+                                attempt.cancel()
+                                if winner is None:
+                                    self.router.record_slow(attempt.endpoint, time.perf_counter() - attempt.started)
+                            request_span.set("finish_reason", DEADLINE)
+                            if winner is None:
+                                yield ErrorEvent("No response before the deadline", fatal=True)
+                            else:
+                                yield FinishEvent(DEADLINE)
+                            break
+                        # First token is late - hedge with the next endpoint
+                        hedge_at = launch() if candidates else None
+                        continue
+                    
+                    if winner is None:
+                        if attempt not in active:
+                            continue
+                        if isinstance(event, _Failed) or (isinstance(event, ErrorEvent) and event.fatal):
+                            # Failed before the first token: safe to fail over
+                            self.router.record_failure(attempt.endpoint)
+                            active.remove(attempt)
+                            attempt.cancel()
+                            if active:
+                                continue
+                            if candidates:
+                                hedge_at = launch()
+                                continue
+                            if isinstance(event, _Failed):
+                                raise event.error
+                            yield event
+                            break
+                        if not isinstance(event, TokenEvent) and event is not _DONE:
+                            attempt.buffer.append(event)
+                            continue
+                    
+                        winner = attempt
+                        for other in active:
+                            if other is not winner:
+                                other.cancel()
+                                # The loser took at least this long (lower-bound sample)
+                                self.router.record_slow(other.endpoint, time.perf_counter() - other.started)
+                        yield from winner.buffer
+                        if isinstance(event, TokenEvent):
+                            first_token_at = time.perf_counter()
+                            first_token = first_token_at - started
+                            # Timed from this attempt's start, so hedge waits are not charged to it
+                            self.router.record_success(winner.endpoint, first_token_at - winner.started)
+                            mark("llm.ttft", request_span, model=winner.endpoint.model)
+                            yield TimingEvent("first_token", first_token)
+                    elif attempt is not winner:
+                        continue
+                    
+                    if isinstance(event, TokenEvent):
+                        text, reason = monitor.feed(event.text)
+                        if text:
+                            yield TokenEvent(text)
+                        if reason is not None:
+                            # Drop the connection before reporting, so generation stops now
+                            winner.cancel()
+                            request_span.set("finish_reason", reason)
+                            yield FinishEvent(reason)
+                            break
+                        continue
+                    
+                    # Release text held back as a possible stop-sequence prefix
+                    held = monitor.flush()
+                    if held:
+                        yield TokenEvent(held)
+                    if event is _DONE:
+                        break
+                    if isinstance(event, FinishEvent):
+                        request_span.set("finish_reason", event.reason)
+                    if isinstance(event, ErrorEvent) and event.fatal:
+                        self.router.record_failure(winner.endpoint)
+                    yield event
+            finally:
+                for attempt in active:
+                    if winner is None and not attempt.cancelled:
+                        # Abandoned before any first token: a lower-bound sample
+                        self.router.record_slow(attempt.endpoint, time.perf_counter() - attempt.started)
+                    attempt.cancel()
+                if first_token_at is not None:
+                    mark("llm.stream_drain", request_span, start=first_token_at)
+        
+        yield TimingEvent("done", time.perf_counter() - started)
+    
+    def _run_attempt(
+        self,
+        attempt: "_Attempt",
+        params: Dict[str, Any],
+        messages: List[MessageFragment],
+        out: "queue.Queue",
+        started: float
+    ):
+        """
+        Send one request and forward its events to the queue (worker thread).
+        
+        Puts (attempt, event) pairs, ending with _DONE, or a single _Failed
+        if the request fails before streaming starts.
+        """
+        endpoint = attempt.endpoint
+        
+        # Body is built from cached fragments instead of re-serializing the payload.
+        # A generator makes requests use chunked transfer encoding, so image base64
+        # is produced while sending and never held in memory as a whole.
+        with span("request.serialize", streamed=self.stream_upload) as serialize_span:
+            body = RequestBody(dict(params, model=endpoint.model), messages)
+            data = body.iter_chunks() if self.stream_upload else body.to_bytes()
+            if not self.stream_upload:
+                serialize_span.set("bytes", len(data))
+        
+        self.router.started(endpoint)
+        try:
+            try:
+                with span("http.connect", url=endpoint.url, model=endpoint.model):
+                    headers = {
+                        "Authorization": f"Bearer {endpoint.api_key}",
+                        "Content-Type": "application/json",
+                        **trace_headers(),
+                    }
+                    response = requests.post(
+                        endpoint.url, 
+                        headers=headers, 
+                        data=data, 
+                        stream=True,
+                        timeout=60
+                    )
+                    response.raise_for_status()
+            except Exception as e:
+                # Re-raised in the consumer if no endpoint succeeds
+                out.put((attempt, _Failed(e)))
+                return
+            
+            attempt.response = response
+            if attempt.cancelled:
+                response.close()
+                return
+            out.put((attempt, TimingEvent("response", time.perf_counter() - started)))
+            try:
+                for event in self._parse_sse(response):
+                    if attempt.cancelled:
+                        return
+                    out.put((attempt, event))
+            except Exception as e:
+                # Closing a cancelled response mid-read surfaces here too
+                if not attempt.cancelled:
+                    out.put((attempt, ErrorEvent(f"Stream interrupted: {e}", fatal=True)))
+            finally:
+                response.close()
+            out.put((attempt, _DONE))
+        finally:
+            self.router.finished(endpoint)
+    
+    def _iter_lines(self, response: requests.Response) -> Iterator[bytes]:
+        """
+        Split a streaming body into lines as soon as bytes arrive.
         
-        # Parse Server-Sent Events (SSE)
-        for line in response.iter_lines():
+        response.iter_lines() reads fixed-size blocks, which on responses
+        without chunked encoding waits for 512 bytes (several events) before
+        yielding anything. read1() returns whatever has arrived, decoded
+        like iter_lines() would (gzip/deflate bodies included).
+        """
+        raw = response.raw
+        if not hasattr(raw, "read1"):
+            yield from response.iter_lines()
+            return
+        pending = b""
+        while True:
+            chunk = raw.read1(65536, decode_content=True)
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if pending:
+            yield pending.rstrip(b"\r")
+    
+    def _parse_sse(self, response: requests.Response) -> Iterator[StreamEvent]:
+        """
+        Parse Server-Sent Events into stream events.
+        
+        Args:
+            response: Streaming HTTP response
+            
+        Yields:
+            Events decoded from each "data:" line until [DONE]. A body that
+            ends without [DONE] or a finish reason ends with a fatal
+            ErrorEvent, since the answer may be cut short.
+        """
+        finished = False
+        for line in self._iter_lines(response):
             if not line:
                 continue
                 
@@ -96,14 +465,42 @@ class QubridVisionLLM:
             
             # Check for stream end signal
             if json_str.strip() == "[DONE]":
-                break
+                return
             
-            # Parse and extract content
             try:
                 chunk = json.loads(json_str)
-                content = chunk["choices"][0]["delta"].get("content", "")
-                if content:
-                    yield content
-            except (json.JSONDecodeError, KeyError, IndexError):
-                # Skip malformed chunks
-                continue
\ No newline at end of file
+            except json.JSONDecodeError:
+                yield ErrorEvent("Malformed chunk", raw=json_str)
+                continue
+            
+            # API errors can arrive inside an already-open stream
+            if "error" in chunk:
+                error = chunk["error"]
+                message = error.get("message", str(error)) if isinstance(error, dict) else str(error)
+                yield ErrorEvent(message, fatal=True, raw=json_str)
+                return
+            
+            usage = chunk.get("usage")
+            if usage:
+                yield UsageEvent(
+                    prompt_tokens=usage.get("prompt_tokens", 0),
+                    completion_tokens=usage.get("completion_tokens", 0),
+                    total_tokens=usage.get("total_tokens", 0)
+                )
+            
+            # Usage-only chunks have no choices
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            
+            choice = choices[0]
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                yield TokenEvent(content)
+            
+            if choice.get("finish_reason"):
+                finished = True
+                yield FinishEvent(choice["finish_reason"])
+        
+        if not finished:
+            yield ErrorEvent("Stream ended before the answer was complete", fatal=True)
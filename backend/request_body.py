@@ -0,0 +1,180 @@
+"""
+Pre-serialized request body assembly for the Qubrid chat API.
+Stable message parts are JSON-encoded once and joined as bytes per request,
+or streamed chunk by chunk for chunked transfer encoding.
+"""
+import base64
+import json
+import os
+from typing import Dict, List, Any, Iterator, Optional, Sequence, Union
+
+# Raw bytes per base64 chunk (multiple of 3, so chunks encode without padding)
+BASE64_CHUNK_SIZE = 48 * 1024
+
+
+class ImageBlockStream:
+    """
+    image_url content block whose base64 data is produced on the fly.
+
+    Holds only the compressed image bytes (or a file path); the base64 text
+    is generated in chunks while the body is being sent.
+    """
+
+    def __init__(
+        self,
+        raw: Optional[bytes] = None,
+        mime: str = "image/png",
+        path: Optional[str] = None,
+        chunk_size: int = BASE64_CHUNK_SIZE
+    ):
+        """
+        Initialize the block.
+
+        Args:
+            raw: Compressed image bytes (PNG/JPEG file contents, any bytes-like)
+            mime: MIME type for the data URI
+            path: Read image bytes from this file instead of `raw`
+            chunk_size: Raw bytes per encoded chunk (rounded down to a multiple of 3)
+        """
+        if (raw is None) == (path is None):
+            raise ValueError("Exactly one of raw or path must be given")
+        self.raw = raw
+        self.path = path
+        self.mime = mime
+        self.chunk_size = max(3, chunk_size - chunk_size % 3)
+        self._prefix = b'{"type":"image_url","image_url":{"url":"data:' + mime.encode("ascii") + b';base64,'
+        self._suffix = b'"}}'
+
+    def _raw_size(self) -> int:
+        if self.raw is not None:
+            return len(self.raw)
+        return os.path.getsize(self.path)
+
+    def iter_raw(self) -> Iterator[bytes]:
+        """Yield the raw (not base64) image bytes in chunks."""
+        if self.raw is not None:
+            view = memoryview(self.raw)
+            for start in range(0, len(view), self.chunk_size):
+                yield view[start:start + self.chunk_size]
+            return
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """
+        Yield the encoded block in chunks.
+
+        Yields:
+            Block prefix, base64 data chunks, block suffix
+        """
+        yield self._prefix
+        for chunk in self.iter_raw():
+            yield base64.b64encode(chunk)
+        yield self._suffix
+
+    def __len__(self) -> int:
+        return len(self._prefix) + 4 * ((self._raw_size() + 2) // 3) + len(self._suffix)
+
+
+# A message piece is encoded bytes or a lazily encoded image block
+MessagePiece = Union[bytes, ImageBlockStream]
+
+# A message is either a dict (encoded on demand), pre-encoded bytes,
+# or a sequence of pieces that concatenate to one encoded message.
+MessageFragment = Union[Dict[str, Any], bytes, Sequence[MessagePiece]]
+
+
+def encode_json(obj: Any) -> bytes:
+    """
+    Encode an object as compact UTF-8 JSON.
+
+    Args:
+        obj: JSON-serializable object
+
+    Returns:
+        Encoded bytes
+    """
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_user_message(blocks: Sequence[MessagePiece]) -> List[MessagePiece]:
+    """
+    Assemble a user message from pre-encoded content blocks.
+
+    Args:
+        blocks: Encoded content blocks (image and text)
+
+    Returns:
+        Pieces forming one encoded message (not joined, to avoid copying images)
+    """
+    pieces = [b'{"role":"user","content":[']
+    for i, block in enumerate(blocks):
+        if i:
+            pieces.append(b",")
+        pieces.append(block)
+    pieces.append(b"]}")
+    return pieces
+
+
+class RequestBody:
+    """
+    JSON request body built from cached fragments.
+
+    Request parameters are encoded per request (they are tiny); messages are
+    passed through as already-encoded bytes wherever the caller has them.
+    """
+
+    def __init__(self, params: Dict[str, Any], messages: Sequence[MessageFragment]):
+        """
+        Initialize the body.
+
+        Args:
+            params: Top-level request fields (model, sampling params, stream)
+            messages: Message fragments in conversation order
+        """
+        self.params = params
+        self.messages = [self._normalize(message) for message in messages]
+
+    @staticmethod
+    def _normalize(message: MessageFragment) -> Sequence[MessagePiece]:
+        """Convert a message fragment to a sequence of pieces."""
+        if isinstance(message, dict):
+            return (encode_json(message),)
+        if isinstance(message, (bytes, bytearray, memoryview)):
+            return (message,)
+        return message
+
+    def iter_chunks(self) -> Iterator[bytes]:
+        """
+        Yield the body as consecutive byte chunks.
+
+        Yields:
+            Body pieces; joined they form the complete JSON document
+        """
+        head = encode_json(self.params)
+        if len(head) > 2:
+            yield head[:-1] + b',"messages":['
+        else:
+            yield b'{"messages":['
+        for i, pieces in enumerate(self.messages):
+            if i:
+                yield b","
+            for piece in pieces:
+                if isinstance(piece, ImageBlockStream):
+                    yield from piece.iter_chunks()
+                else:
+                    yield piece
+        yield b"]}"
+
+    def to_bytes(self) -> bytes:
+        """Join the body into a single bytes object (one copy of the payload)."""
+        return b"".join(self.iter_chunks())
+
+    def __len__(self) -> int:
+        head = len(next(self.iter_chunks()))
+        commas = max(len(self.messages) - 1, 0)
+        return head + commas + 2 + sum(len(piece) for pieces in self.messages for piece in pieces)
@@ -0,0 +1,193 @@
+"""
+Region-of-interest cropping for image turns.
+
+A region is either an explicit box (fractions of the image, so it holds at
+any resolution the asset is decoded at) or found automatically by trimming
+uniform borders, e.g. the margins around a scanned page or screenshot.
+Only the region is encoded and sent, optionally with a small overview
+thumbnail that outlines where the region lies.
+"""
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from backend.image_analysis import EncodeParams
+from backend.tracing import span
+from backend.utils import encode_image_for_api
+
+# Pixel box (left, top, right, bottom), as used by Image.crop
+Box = Tuple[int, int, int, int]
+
+# Longest side of the copy auto-trim works on
+TRIM_ANALYSIS_SIZE = 512
+
+# Gray-level difference (0-255) from the border colour that counts as content
+TRIM_TOLERANCE = int(os.getenv("VISION_ROI_TOLERANCE", "12"))
+
+# Fraction of a row/column that must differ before it counts (ignores specks)
+TRIM_MIN_FILL = 0.005
+
+# Padding kept around an auto-trimmed region, as a fraction of the image side
+TRIM_MARGIN = 0.02
+
+# Regions saving less than this fraction of the area are not worth a crop
+MIN_AREA_SAVING = 0.1
+
+# Overview thumbnail: longest side, JPEG quality and outline colour
+CONTEXT_SIZE = 256
+CONTEXT_PARAMS = EncodeParams("photo", "JPEG", 70, CONTEXT_SIZE)
+CONTEXT_OUTLINE = (255, 0, 0)
+
+
+@dataclass(frozen=True)
+class RegionOfInterest:
+    """Part of the image a turn is about."""
+    box: Optional[Tuple[float, float, float, float]] = None   # (left, top, right, bottom) as 0-1 fractions
+    auto: bool = False      # trim uniform borders (when no box is given)
+    context: bool = False   # also send an overview thumbnail with the region outlined
+
+    @property
+    def active(self) -> bool:
+        """Whether the region can differ from the whole image."""
+        return self.box is not None or self.auto
+
+    @property
+    def key(self) -> str:
+        """Stable identifier for caches (encoded blocks, answers)."""
+        where = "auto" if self.box is None else ",".join(f"{v:.4f}" for v in self.box)
+        return where + ("+context" if self.context else "")
+
+
+def find_content_box(
+    image: Image.Image,
+    tolerance: int = TRIM_TOLERANCE,
+    margin: float = TRIM_MARGIN
+) -> Optional[Box]:
+    """
+    Find the bounding box of everything that differs from the border colour.
+
+    Works on a downsampled gray copy; the background is the median of the
+    outermost pixels, and transparent pixels count as background.
+
+    Args:
+        image: PIL Image object
+        tolerance: Gray-level difference that counts as content
+        margin: Padding around the content, as a fraction of each side
+
+    Returns:
+        Pixel box in `image` coordinates, or None if the image is uniform
+    """
+    small = image.copy()
+    small.thumbnail((TRIM_ANALYSIS_SIZE, TRIM_ANALYSIS_SIZE), Image.Resampling.BILINEAR)
+    gray = np.asarray(small.convert("L"), dtype=np.int16)
+
+    border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+    content = np.abs(gray - int(np.median(border))) > tolerance
+    if "A" in small.getbands():
+        content &= np.asarray(small.getchannel("A")) > 16
+
+    height, width = content.shape
+    rows = np.flatnonzero(content.sum(axis=1) >= max(1, TRIM_MIN_FILL * width))
+    cols = np.flatnonzero(content.sum(axis=0) >= max(1, TRIM_MIN_FILL * height))
+    if rows.size == 0 or cols.size == 0:
+        return None
+
+    scale_x = image.width / width
+    scale_y = image.height / height
+    pad_x = margin * image.width
+    pad_y = margin * image.height
+    return (
+        max(0, int(cols[0] * scale_x - pad_x)),
+        max(0, int(rows[0] * scale_y - pad_y)),
+        min(image.width, int(np.ceil((cols[-1] + 1) * scale_x + pad_x))),
+        min(image.height, int(np.ceil((rows[-1] + 1) * scale_y + pad_y))),
+    )
+
+
+def resolve_box(image: Image.Image, roi: Optional[RegionOfInterest]) -> Optional[Box]:
+    """
+    Turn a region into a pixel box for this image.
+
+    Args:
+        image: PIL Image object
+        roi: Region, or None for the whole image
+
+    Returns:
+        Pixel box, or None when the whole image should be sent (no region,
+        nothing to trim, or a crop that would save too little)
+    """
+    if roi is None or not roi.active:
+        return None
+    if roi.box is not None:
+        left, top, right, bottom = (min(1.0, max(0.0, v)) for v in roi.box)
+        box = (
+            int(left * image.width),
+            int(top * image.height),
+            int(np.ceil(right * image.width)),
+            int(np.ceil(bottom * image.height)),
+        )
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return None
+    else:
+        box = find_content_box(image)
+        if box is None:
+            return None
+
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    if area > (1 - MIN_AREA_SAVING) * image.width * image.height:
+        return None
+    return box
+
+
+def context_thumbnail(image: Image.Image, box: Box, size: int = CONTEXT_SIZE) -> Image.Image:
+    """
+    Small RGB copy of the whole image with the region outlined.
+
+    Args:
+        image: PIL Image object
+        box: Region in `image` pixel coordinates
+        size: Longest side of the thumbnail
+
+    Returns:
+        Thumbnail image
+    """
+    thumbnail = image.convert("RGB") if image.mode != "RGB" else image.copy()
+    thumbnail.thumbnail((size, size), Image.Resampling.BILINEAR)
+    scale_x = thumbnail.width / image.width
+    scale_y = thumbnail.height / image.height
+    ImageDraw.Draw(thumbnail).rectangle(
+        (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x - 1, box[3] * scale_y - 1),
+        outline=CONTEXT_OUTLINE,
+        width=2
+    )
+    return thumbnail
+
+
+def encode_region(image: Image.Image, roi: Optional[RegionOfInterest]) -> Optional[List[Tuple[bytes, str]]]:
+    """
+    Encode the region of an image for the API.
+
+    Args:
+        image: PIL Image object
+        roi: Region to send
+
+    Returns:
+        [(bytes, MIME type)] for the overview thumbnail (when requested)
+        followed by the cropped region, or None to send the whole image
+    """
+    with span("image.roi", region=roi.key if roi is not None else "none") as roi_span:
+        box = resolve_box(image, roi)
+        if box is None:
+            roi_span.set("cropped", False)
+            return None
+        roi_span.set("box", f"{box[0]},{box[1]},{box[2]},{box[3]}")
+
+        encoded = []
+        if roi.context:
+            encoded.append(encode_image_for_api(context_thumbnail(image, box), CONTEXT_PARAMS))
+        encoded.append(encode_image_for_api(image.crop(box)))
+        roi_span.set("bytes", sum(len(raw) for raw, _ in encoded))
+    return encoded
@@ -0,0 +1,226 @@
+"""
+Endpoint/model routing for the Qubrid client.
+Ranks configured endpoints by recent first-token latency, error rate and load.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Any, Optional
+
+# Smoothing factor for latency and error-rate EWMAs
+EWMA_ALPHA = 0.3
+
+# Assumed first-token latency (seconds) for endpoints without samples
+DEFAULT_LATENCY = 1.0
+
+# Endpoints that failed this recently (seconds) are tried last
+FAILURE_COOLDOWN = 30.0
+
+# Hedge bounds (seconds) when QUBRID_HEDGE_MS is not set
+MIN_HEDGE_DELAY = 2.0
+HEDGE_LATENCY_FACTOR = 3.0
+
+
+class Endpoint:
+    """One API endpoint + model pair and its live statistics."""
+
+    def __init__(self, url: str, model: str, api_key: str, tier: str = "default"):
+        """
+        Initialize the endpoint.
+
+        Args:
+            url: Chat completions URL
+            model: Model name sent in the request body
+            api_key: Bearer token for this endpoint
+            tier: Routing tier ("default", or "fast" for cheap/simple requests)
+        """
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.tier = tier
+
+        self.latency = DEFAULT_LATENCY
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.last_failure = 0.0
+        self.samples = 0
+
+    def score(self, now: float) -> float:
+        """Expected cost of sending the next request here (lower is better)."""
+        score = self.latency * (1 + self.in_flight) / max(1.0 - self.error_rate, 0.05)
+        if now - self.last_failure < FAILURE_COOLDOWN:
+            score += 1000.0
+        return score
+
+    def __repr__(self) -> str:
+        return (
+            f"Endpoint(model={self.model!r}, tier={self.tier!r}, "
+            f"latency={self.latency:.2f}, error_rate={self.error_rate:.2f}, in_flight={self.in_flight})"
+        )
+
+
+class ModelRouter:
+    """
+    Chooses endpoints per request and learns from the outcomes.
+
+    Thread-safe; one router is normally shared by all sessions in the process
+    (see get_router) so every session benefits from the same statistics.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[Endpoint],
+        hedge_delay: Optional[float] = None,
+        cross_tier: bool = False
+    ):
+        """
+        Initialize the router.
+
+        Args:
+            endpoints: Configured endpoints (at least one)
+            hedge_delay: Fixed seconds to wait for a first token before hedging;
+                None derives it from the primary endpoint's latency, 0 disables
+            cross_tier: Let failover and hedging use endpoints of other tiers
+        """
+        if not endpoints:
+            raise ValueError("ModelRouter needs at least one endpoint")
+        self.endpoints = endpoints
+        self.hedge_delay = hedge_delay
+        self.cross_tier = cross_tier
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, api_key: str, default_url: str, default_model: str) -> "ModelRouter":
+        """
+        Build a router from environment configuration.
+
+        QUBRID_ROUTES may hold a JSON list of {"url", "model", "tier",
+        "api_key_env"} objects; missing fields fall back to the defaults.
+        QUBRID_HEDGE_MS sets a fixed hedge delay (0 disables hedging).
+        QUBRID_CROSS_TIER=1 lets a request fail over or hedge to another tier.
+
+        Args:
+            api_key: Default API key
+            default_url: Default endpoint URL
+            default_model: Default model name
+
+        Returns:
+            Configured router
+        """
+        routes: List[Dict[str, Any]] = json.loads(os.getenv("QUBRID_ROUTES") or "[]")
+        endpoints = [
+            Endpoint(
+                url=route.get("url", default_url),
+                model=route.get("model", default_model),
+                api_key=os.getenv(route["api_key_env"], api_key) if "api_key_env" in route else api_key,
+                tier=route.get("tier", "default")
+            )
+            for route in routes
+        ]
+        if not endpoints:
+            endpoints = [Endpoint(default_url, default_model, api_key)]
+
+        hedge_ms = os.getenv("QUBRID_HEDGE_MS")
+        hedge_delay = float(hedge_ms) / 1000 if hedge_ms else None
+        return cls(endpoints, hedge_delay, os.getenv("QUBRID_CROSS_TIER", "0") == "1")
+
+    def plan(self, tier: Optional[str] = None) -> List[Endpoint]:
+        """
+        Order endpoints for a request: best score first, within the tier.
+
+        Endpoints of other tiers follow only when cross_tier is set, so a
+        default request is never answered by a "fast" model unless configured.
+
+        Args:
+            tier: Preferred tier; falls back to "default" when none match
+
+        Returns:
+            Candidates in the order they should be tried
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(self.endpoints, key=lambda e: e.score(now))
+        wanted = tier or "default"
+        if not any(e.tier == wanted for e in ranked):
+            wanted = "default"
+        preferred = [e for e in ranked if e.tier == wanted]
+        if not preferred:
+            return ranked
+        return preferred + [e for e in ranked if e.tier != wanted] if self.cross_tier else preferred
+
+    def hedge_after(self, endpoint: Endpoint) -> Optional[float]:
+        """
+        Seconds to wait for the first token before sending a hedge request.
+
+        Returns:
+            Delay in seconds, or None if hedging is disabled
+        """
+        if self.hedge_delay is not None:
+            return self.hedge_delay or None
+        return max(MIN_HEDGE_DELAY, endpoint.latency * HEDGE_LATENCY_FACTOR)
+
+    def started(self, endpoint: Endpoint):
+        """Record a request being sent."""
+        with self._lock:
+            endpoint.in_flight += 1
+
+    def finished(self, endpoint: Endpoint):
+        """Record a request ending (any outcome)."""
+        with self._lock:
+            endpoint.in_flight = max(endpoint.in_flight - 1, 0)
+
+    def record_success(self, endpoint: Endpoint, first_token_latency: float):
+        """Record a first token received after `first_token_latency` seconds."""
+        with self._lock:
+            if endpoint.samples == 0:
+                endpoint.latency = first_token_latency
+            else:
+                endpoint.latency += EWMA_ALPHA * (first_token_latency - endpoint.latency)
+            endpoint.error_rate *= 1 - EWMA_ALPHA
+            endpoint.samples += 1
+
+    def record_slow(self, endpoint: Endpoint, elapsed: float):
+        """
+        Record an attempt abandoned after `elapsed` seconds without a first token.
+
+        The elapsed time is a lower bound on the endpoint's latency, so it only
+        ever raises the estimate (a hedge loser must not look fast).
+        """
+        with self._lock:
+            if elapsed <= endpoint.latency:
+                return
+            if endpoint.samples == 0:
+                endpoint.latency = elapsed
+            else:
+                endpoint.latency += EWMA_ALPHA * (elapsed - endpoint.latency)
+            endpoint.samples += 1
+
+    def record_failure(self, endpoint: Endpoint):
+        """Record a failed request."""
+        with self._lock:
+            endpoint.error_rate += EWMA_ALPHA * (1.0 - endpoint.error_rate)
+            endpoint.last_failure = time.monotonic()
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router(api_key: str, default_url: str, default_model: str) -> ModelRouter:
+    """
+    Get the process-wide router, creating it from the environment once.
+
+    Args:
+        api_key: Default API key
+        default_url: Default endpoint URL
+        default_model: Default model name
+
+    Returns:
+        Shared ModelRouter
+    """
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter.from_env(api_key, default_url, default_model)
+        return _router
@@ -0,0 +1,277 @@
+"""
+Full-text search over a session's conversation history.
+
+An inverted index maps each term to the (sorted) ids of the messages that
+contain it. It is updated incrementally: each sync only tokenizes messages
+added since the last one. Postings are compact integer arrays and queries
+intersect them with NumPy, so searching tens of thousands of messages
+takes milliseconds. Message text is not copied into the index; snippets
+are cut from the few messages that are shown.
+"""
+import os
+import re
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Tuple
+
+import numpy as np
+
+from backend.history import ChatHistory
+
+# Hits returned per query
+SEARCH_LIMIT = int(os.getenv("VISION_SEARCH_LIMIT", "20"))
+
+# Characters of context shown on each side of the first match
+SNIPPET_CONTEXT = 60
+
+# Shortest prefix that is expanded for search-as-you-type
+MIN_PREFIX = 2
+
+# Deleted messages tolerated (beyond this, and more than live ones, the index is rebuilt)
+MAX_DEAD_DOCS = 1000
+
+_TOKEN = re.compile(r"\w+")
+
+# Markdown control characters escaped in snippets
+_MARKDOWN = re.compile(r"([\\`*_\[\]#<>|~$])")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase index terms.
+
+    Args:
+        text: Message or query text
+
+    Returns:
+        Terms in order (single letters dropped, single digits kept)
+    """
+    return [term for term in _TOKEN.findall(text.lower()) if len(term) > 1 or term.isdigit()]
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    """One matching message."""
+    conversation_id: str
+    position: int       # index into the conversation's history records
+    role: str           # record type ("human" or "ai")
+    snippet: str        # markdown, matches in bold
+
+
+class SearchIndex:
+    """
+    Incrementally updated inverted index over one session's conversations.
+
+    Not thread-safe; used from the session's script thread.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def clear(self):
+        """Forget everything indexed (histories are re-indexed by the next sync)."""
+        self._reset()
+
+    def _reset(self):
+        self._postings: Dict[str, array] = {}
+        self._terms: Optional[List[str]] = None   # sorted vocabulary for prefix lookups
+        self._doc_conversation: List[Optional[str]] = []
+        self._doc_position = array("i")
+        self._dead = 0
+        # conversation id -> (history, records indexed, id of the last indexed record, doc ids)
+        self._indexed: Dict[str, Tuple[ChatHistory, int, int, array]] = {}
+
+    def __len__(self) -> int:
+        """Live messages in the index."""
+        return len(self._doc_conversation) - self._dead
+
+    def _drop(self, conversation_id: str):
+        """Tombstone a conversation's messages."""
+        _, _, _, docs = self._indexed.pop(conversation_id)
+        for doc in docs:
+            self._doc_conversation[doc] = None
+        self._dead += len(docs)
+
+    def _add(self, conversation_id: str, history: ChatHistory, start: int) -> int:
+        """Index history records from `start` on; returns how many were added."""
+        records = history.records
+        state = self._indexed.get(conversation_id)
+        docs = state[3] if state is not None else array("i")
+        for position in range(start, len(records)):
+            doc = len(self._doc_conversation)
+            self._doc_conversation.append(conversation_id)
+            self._doc_position.append(position)
+            docs.append(doc)
+            for term in set(tokenize(records[position].content)):
+                postings = self._postings.get(term)
+                if postings is None:
+                    self._postings[term] = postings = array("i")
+                    self._terms = None
+                postings.append(doc)
+        last_id = records[-1].id if records else 0
+        self._indexed[conversation_id] = (history, len(records), last_id, docs)
+        return len(records) - start
+
+    def sync(self, conversations: Dict[str, Dict[str, Any]]) -> int:
+        """
+        Bring the index up to date with the session's conversations.
+
+        New messages are indexed; deleted conversations are dropped; a history
+        that was cleared or replaced (e.g. restored after eviction) is
+        re-indexed.
+
+        Args:
+            conversations: Session conversations keyed by id
+
+        Returns:
+            Messages indexed by this call
+        """
+        if self._dead > MAX_DEAD_DOCS and self._dead > len(self):
+            self._reset()
+
+        for conversation_id in [cid for cid in self._indexed if cid not in conversations]:
+            self._drop(conversation_id)
+
+        added = 0
+        for conversation_id, conversation in list(conversations.items()):
+            history = conversation["history"]
+            records = history.records
+            state = self._indexed.get(conversation_id)
+            if state is not None:
+                indexed_history, count, last_id, _ = state
+                unchanged = (
+                    indexed_history is history
+                    and count <= len(records)
+                    and (count == 0 or records[count - 1].id == last_id)
+                )
+                if unchanged:
+                    if count < len(records):
+                        added += self._add(conversation_id, history, count)
+                    continue
+                self._drop(conversation_id)
+            added += self._add(conversation_id, history, 0)
+        return added
+
+    def _prefix_postings(self, prefix: str) -> List[array]:
+        """Postings of every term starting with `prefix`."""
+        if self._terms is None:
+            self._terms = sorted(self._postings)
+        terms = self._terms
+        start = bisect_left(terms, prefix)
+        matches = []
+        for index in range(start, len(terms)):
+            if not terms[index].startswith(prefix):
+                break
+            matches.append(self._postings[terms[index]])
+        return matches
+
+    def _match(self, query: str) -> Tuple[np.ndarray, List[str], Optional[str]]:
+        """
+        Doc ids containing every query term (the last one as a prefix while
+        it is still being typed).
+
+        Returns:
+            (doc ids ascending, exact terms, prefix term or None)
+        """
+        terms = tokenize(query)
+        prefix = None
+        if terms and not query[-1:].isspace() and len(terms[-1]) >= MIN_PREFIX:
+            prefix = terms.pop()
+        if not terms and prefix is None:
+            return np.empty(0, dtype=np.int32), [], None
+
+        doc_sets = []
+        for term in sorted(set(terms), key=lambda t: len(self._postings.get(t, ()))):
+            postings = self._postings.get(term)
+            if postings is None:
+                return np.empty(0, dtype=np.int32), terms, prefix
+            doc_sets.append(np.frombuffer(postings, dtype=np.int32))
+        if prefix is not None:
+            matches = self._prefix_postings(prefix)
+            if not matches:
+                return np.empty(0, dtype=np.int32), terms, prefix
+            doc_sets.append(np.unique(np.concatenate([np.frombuffer(p, dtype=np.int32) for p in matches])))
+
+        docs = doc_sets[0]
+        for other in doc_sets[1:]:
+            docs = np.intersect1d(docs, other, assume_unique=True)
+            if not docs.size:
+                break
+        return docs, terms, prefix
+
+    def search(
+        self,
+        conversations: Dict[str, Dict[str, Any]],
+        query: str,
+        limit: int = SEARCH_LIMIT
+    ) -> Tuple[List[SearchHit], int]:
+        """
+        Find messages containing all query terms, newest first.
+
+        Args:
+            conversations: Session conversations keyed by id (synced first)
+            query: Search text; the last word matches as a prefix unless
+                followed by a space
+            limit: Most hits returned
+
+        Returns:
+            (hits, total number of matching messages)
+        """
+        self.sync(conversations)
+        docs, terms, prefix = self._match(query)
+
+        hits: List[SearchHit] = []
+        total = 0
+        pattern = _highlight_pattern(terms, prefix)
+        for doc in docs[::-1].tolist():
+            conversation_id = self._doc_conversation[doc]
+            if conversation_id is None:
+                continue
+            total += 1
+            if len(hits) < limit:
+                position = self._doc_position[doc]
+                record = conversations[conversation_id]["history"].records[position]
+                hits.append(SearchHit(conversation_id, position, record.type, make_snippet(record.content, pattern)))
+        return hits, total
+
+
+def _escape(text: str) -> str:
+    """Escape markdown control characters."""
+    return _MARKDOWN.sub(r"\\\1", text)
+
+
+def _highlight_pattern(terms: List[str], prefix: Optional[str]) -> Optional["re.Pattern"]:
+    """Regex matching the query terms as whole words (the prefix as a word start)."""
+    alternatives = [rf"\b{re.escape(term)}\b" for term in terms]
+    if prefix is not None:
+        alternatives.append(rf"\b{re.escape(prefix)}\w*")
+    return re.compile("|".join(alternatives), re.IGNORECASE) if alternatives else None
+
+
+def make_snippet(text: str, pattern: Optional["re.Pattern"], context: int = SNIPPET_CONTEXT) -> str:
+    """
+    Cut a one-line markdown snippet around the first match.
+
+    Args:
+        text: Message text
+        pattern: Compiled query pattern (None = start of the text)
+        context: Characters shown on each side of the match
+
+    Returns:
+        Snippet with markdown escaped and matches in bold
+    """
+    text = " ".join(text.split())
+    first = pattern.search(text) if pattern is not None else None
+    start = max(0, first.start() - context) if first else 0
+    end = min(len(text), (first.end() if first else 0) + context)
+    window = text[start:end]
+
+    parts = []
+    position = 0
+    for match in (pattern.finditer(window) if pattern is not None else ()):
+        parts.append(_escape(window[position:match.start()]))
+        parts.append(f"**{_escape(match.group())}**")
+        position = match.end()
+    parts.append(_escape(window[position:]))
+    return ("…" if start else "") + "".join(parts) + ("…" if end < len(text) else "")
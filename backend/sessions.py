@@ -0,0 +1,367 @@
+"""
+Process-wide registry of browser sessions with memory accounting and eviction.
+
+Each Streamlit session registers its conversations here. A periodic sweep
+frees memory in increasing order of cost:
+
+1. Sessions idle longer than the TTL are evicted.
+2. Over the global memory cap, cached assets no live session uses are
+   dropped from the asset cache.
+3. Still over the cap, decoded images and thumbnails are dropped (they are
+   rebuilt from the encoded payload on demand), least recently used first.
+4. Still over the cap, idle sessions are evicted, least recently used
+   first, with their assets unless another session shares them. Usage is
+   measured again after each eviction.
+
+Evicting a session spills its conversations to an archive in the spill
+directory (restored lazily, via mmap, when the session comes back) or, with
+spilling disabled, drops them.
+"""
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+from typing import BinaryIO, Callable, Dict, List, Any, Optional, Set
+
+from backend.archive import ConversationArchive, export_conversations, write_archive
+from backend.assets import ImageAsset, asset_cache
+
+# Seconds without a rerun before a session is evicted
+SESSION_TTL = float(os.getenv("VISION_SESSION_TTL", "3600"))
+
+# Global cap on bytes held by sessions and cached assets (0 = no cap)
+MEMORY_CAP = int(float(os.getenv("VISION_MEMORY_CAP_MB", "1024")) * 2**20)
+
+# Minimum seconds between sweeps
+SWEEP_INTERVAL = float(os.getenv("VISION_SESSION_SWEEP_SECONDS", "30"))
+
+# Where evicted sessions are spilled ("" = drop instead)
+SPILL_DIR = os.getenv("VISION_SPILL_DIR", ".cache/sessions")
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SessionHandle:
+    """
+    One browser session's entry in the registry.
+
+    Stored in the session's own state; the registry only keeps a weak
+    reference, so the entry disappears when Streamlit discards the session.
+    """
+
+    def __init__(self, session_id: str, conversations: Dict[str, Dict[str, Any]]):
+        """
+        Initialize the handle.
+
+        Args:
+            session_id: Streamlit session id
+            conversations: The session's conversations dict (shared, mutated in place)
+        """
+        self.session_id = session_id
+        self.conversations = conversations
+        self.last_seen = time.monotonic()
+        self.active = 0
+        self.spilled: Optional[str] = None
+        self.evicted = False
+        self._lock = threading.Lock()
+        self._finalizer = None
+        self._evict_hooks: List[Callable[[], None]] = []
+
+    def on_evict(self, hook: Callable[[], None]):
+        """
+        Register a callback that drops the session's other references to its
+        conversations (chain memory, search index, ...) when they are evicted.
+
+        Hooks run on the sweep thread while the session is idle; they must
+        not touch st.session_state.
+        """
+        self._evict_hooks.append(hook)
+
+    def memory_usage(self, seen: Optional[Set[str]] = None) -> Dict[str, int]:
+        """
+        Approximate heap bytes held by the session's conversations.
+
+        Args:
+            seen: Asset keys already counted (shared assets count once); updated
+
+        Returns:
+            {"derived", "encoded", "history"} byte counts
+        """
+        seen = set() if seen is None else seen
+        usage = {"derived": 0, "encoded": 0, "history": 0}
+        for conversation in list(self.conversations.values()):
+            usage["history"] += conversation["history"].nbytes()
+            asset = conversation["asset"]
+            if asset.key not in seen:
+                seen.add(asset.key)
+                derived, encoded = asset.memory_usage()
+                usage["derived"] += derived
+                usage["encoded"] += encoded
+        return usage
+
+    def assets(self) -> List[ImageAsset]:
+        """Assets referenced by the session's conversations."""
+        return [conversation["asset"] for conversation in list(self.conversations.values())]
+
+
+class SessionManager:
+    """Tracks live sessions and keeps their memory within the configured bounds."""
+
+    def __init__(
+        self,
+        ttl: float = SESSION_TTL,
+        memory_cap: int = MEMORY_CAP,
+        spill_dir: str = SPILL_DIR,
+        sweep_interval: float = SWEEP_INTERVAL
+    ):
+        """
+        Initialize the manager.
+
+        Args:
+            ttl: Idle seconds before a session is evicted
+            memory_cap: Global byte cap (0 = none)
+            spill_dir: Directory for spilled sessions ("" = drop instead)
+            sweep_interval: Minimum seconds between automatic sweeps
+        """
+        self.ttl = ttl
+        self.memory_cap = memory_cap
+        self.spill_dir = spill_dir
+        self.sweep_interval = sweep_interval
+        self._sessions: "weakref.WeakValueDictionary[str, SessionHandle]" = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+        self._sweeping = False
+
+    def register(self, session_id: str, conversations: Dict[str, Dict[str, Any]]) -> SessionHandle:
+        """
+        Register a session's conversations.
+
+        Args:
+            session_id: Streamlit session id
+            conversations: The session's conversations dict
+
+        Returns:
+            Handle to keep in the session's state
+        """
+        handle = SessionHandle(session_id, conversations)
+        with self._lock:
+            self._sessions[session_id] = handle
+        return handle
+
+    def begin(self, handle: SessionHandle) -> bool:
+        """
+        Mark the start of a rerun; restores the session if it was evicted.
+
+        Call before the rerun touches its conversations. May start a
+        background sweep.
+
+        Args:
+            handle: The session's handle
+
+        Returns:
+            True if the conversations were replaced while the session was idle
+            (the caller should rebind anything pointing into them)
+        """
+        with handle._lock:
+            handle.active += 1
+            handle.last_seen = time.monotonic()
+            replaced = handle.evicted
+            if handle.spilled is not None:
+                self._restore(handle)
+            handle.evicted = False
+
+        self._maybe_sweep()
+        return replaced
+
+    def end(self, handle: SessionHandle):
+        """Mark the end of a rerun."""
+        with handle._lock:
+            handle.active = max(0, handle.active - 1)
+            handle.last_seen = time.monotonic()
+
+    def _maybe_sweep(self):
+        """Start a background sweep if the interval has passed and none is running."""
+        with self._lock:
+            if self._sweeping or time.monotonic() - self._last_sweep < self.sweep_interval:
+                return
+            self._sweeping = True
+        threading.Thread(target=self._sweep_in_background, daemon=True).start()
+
+    def _sweep_in_background(self):
+        try:
+            self.sweep()
+        finally:
+            with self._lock:
+                self._sweeping = False
+                self._last_sweep = time.monotonic()
+
+    def handles(self) -> List[SessionHandle]:
+        """Live session handles, least recently seen first."""
+        with self._lock:
+            handles = list(self._sessions.values())
+        return sorted(handles, key=lambda handle: handle.last_seen)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        Bytes held across all sessions and the asset cache (shared assets count once).
+
+        Returns:
+            {"derived", "encoded", "history", "total"} byte counts
+        """
+        seen: Set[str] = set()
+        usage = {"derived": 0, "encoded": 0, "history": 0}
+        for handle in self.handles():
+            for key, value in handle.memory_usage(seen).items():
+                usage[key] += value
+        for asset in asset_cache.assets():
+            if asset.key not in seen:
+                seen.add(asset.key)
+                derived, encoded = asset.memory_usage()
+                usage["derived"] += derived
+                usage["encoded"] += encoded
+        usage["total"] = usage["derived"] + usage["encoded"] + usage["history"]
+        return usage
+
+    def sweep(self) -> Dict[str, int]:
+        """
+        Evict idle sessions and enforce the memory cap.
+
+        Returns:
+            {"expired", "released", "evicted"}: sessions expired, bytes of
+            derived data released, sessions evicted for memory
+        """
+        result = {"expired": 0, "released": 0, "evicted": 0}
+        now = time.monotonic()
+        handles = self.handles()
+
+        for handle in handles:
+            if now - handle.last_seen > self.ttl and self._evict(handle):
+                result["expired"] += 1
+
+        if not self.memory_cap:
+            return result
+        excess = self.memory_usage()["total"] - self.memory_cap
+        if excess <= 0:
+            return result
+
+        # Cached assets no live session uses go first (encoded payload included)
+        excess -= self._prune_assets(handles)
+        if excess <= 0:
+            return result
+
+        # Then derived data, by session recency
+        for asset in [asset for handle in handles for asset in handle.assets()]:
+            if excess <= 0:
+                return result
+            freed = asset.release_derived()
+            result["released"] += freed
+            excess -= freed
+
+        # Then whole sessions; their assets leave the cache unless another session uses them
+        for handle in handles:
+            if excess <= 0:
+                break
+            if self._evict(handle):
+                result["evicted"] += 1
+                self._prune_assets(handles)
+                excess = self.memory_usage()["total"] - self.memory_cap
+        return result
+
+    def _prune_assets(self, handles: List[SessionHandle]) -> int:
+        """
+        Drop cached assets that none of `handles` references.
+
+        Returns:
+            Bytes freed (measured before and after)
+        """
+        before = self.memory_usage()["total"]
+        asset_cache.prune({asset.key for handle in handles for asset in handle.assets()})
+        return before - self.memory_usage()["total"]
+
+    def _evict(self, handle: SessionHandle) -> bool:
+        """
+        Spill or drop an idle session's conversations.
+
+        Skips sessions that are mid-rerun (or being restored).
+
+        Returns:
+            True if the session was evicted
+        """
+        if not handle._lock.acquire(blocking=False):
+            return False
+        try:
+            if handle.active or not handle.conversations:
+                return False
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.vai")
+                export_conversations(handle.conversations, path)
+                handle.spilled = path
+                # Spill files of sessions Streamlit discards are removed with the handle
+                handle._finalizer = weakref.finalize(handle, _remove_file, path)
+            handle.conversations.clear()
+            for hook in handle._evict_hooks:
+                hook()
+            handle.evicted = True
+            return True
+        finally:
+            handle._lock.release()
+
+    def export(self, handle: SessionHandle, f: BinaryIO):
+        """
+        Write a session's conversations as an archive, without restoring an
+        evicted session (its spill file is copied instead).
+
+        Args:
+            handle: The session's handle
+            f: Seekable binary file opened for writing
+        """
+        with handle._lock:
+            if handle.spilled is not None:
+                with open(handle.spilled, "rb") as spill:
+                    shutil.copyfileobj(spill, f)
+            else:
+                write_archive(handle.conversations, f)
+
+    def _restore(self, handle: SessionHandle):
+        """Load a spilled session back (images stay in the mmap until displayed)."""
+        path = handle.spilled
+        handle.spilled = None
+        if handle._finalizer is not None:
+            handle._finalizer.detach()
+            handle._finalizer = None
+        handle.conversations.update(ConversationArchive.open(path, trusted=True).to_conversations())
+        # The mapping stays valid after the file is unlinked (POSIX)
+        if os.name == "posix":
+            _remove_file(path)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Gauges for live sessions and bytes held.
+
+        Returns:
+            Session counts, byte counts and the configured cap
+        """
+        handles = self.handles()
+        usage = self.memory_usage()
+        return {
+            "sessions": len(handles),
+            "active_sessions": sum(1 for handle in handles if handle.active),
+            "spilled_sessions": sum(1 for handle in handles if handle.spilled),
+            "bytes_held": usage["total"],
+            "image_bytes": usage["derived"] + usage["encoded"],
+            "derived_bytes": usage["derived"],
+            "history_bytes": usage["history"],
+            "memory_cap": self.memory_cap,
+        }
+
+
+# Process-wide manager shared by all sessions
+session_manager = SessionManager()
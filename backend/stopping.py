@@ -0,0 +1,184 @@
+"""
+Client-side stop conditions for streamed answers.
+
+A StopMonitor watches the streamed text for stop sequences, runaway
+repetition, a wall-clock deadline and a token budget. The client closes the
+HTTP response as soon as one triggers, so upstream generation stops too.
+"""
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# Finish reasons reported for client-side stops
+STOP_SEQUENCE = "stop_sequence"
+LOOP = "loop"
+DEADLINE = "deadline"
+TOKEN_BUDGET = "token_budget"
+
+# Human-readable descriptions for the UI
+STOP_REASON_LABELS = {
+    STOP_SEQUENCE: "stop sequence reached",
+    LOOP: "repetition detected",
+    DEADLINE: "time limit reached",
+    TOKEN_BUDGET: "token budget reached",
+}
+
+# Loop detection: tail of text searched, longest repeated unit, and how much
+# repeated text (and how many repeats) counts as a loop
+LOOP_WINDOW = 4096
+LOOP_MAX_PERIOD = 512
+LOOP_MIN_SPAN = 240
+LOOP_MIN_REPEATS = 3
+
+# New characters between loop checks
+LOOP_CHECK_EVERY = 32
+
+
+@dataclass(frozen=True)
+class StopConditions:
+    """When to end a stream early (all optional)."""
+    stop_sequences: Tuple[str, ...] = ()
+    deadline: Optional[float] = None       # seconds from request start
+    token_budget: Optional[int] = None     # content deltas (about one token each)
+    detect_loops: bool = True
+
+    @classmethod
+    def from_env(cls) -> "StopConditions":
+        """Defaults from QUBRID_STREAM_DEADLINE and QUBRID_LOOP_DETECTION."""
+        deadline = float(os.getenv("QUBRID_STREAM_DEADLINE", "120"))
+        return cls(
+            deadline=deadline or None,
+            detect_loops=os.getenv("QUBRID_LOOP_DETECTION", "1") == "1"
+        )
+
+    def with_stop_sequences(self, stop_sequences) -> "StopConditions":
+        """Copy with the given stop sequences (empty strings dropped)."""
+        return StopConditions(
+            tuple(s for s in stop_sequences if s),
+            self.deadline,
+            self.token_budget,
+            self.detect_loops
+        )
+
+
+def find_loop(text: str) -> Optional[int]:
+    """
+    Find a run of one unit repeated at the end of the text.
+
+    Args:
+        text: Text generated so far
+
+    Returns:
+        Length of text to keep (up to the end of the first repeat), or None
+    """
+    tail = text[-LOOP_WINDOW:]
+    offset = len(text) - len(tail)
+    for period in range(1, min(LOOP_MAX_PERIOD, len(tail) // LOOP_MIN_REPEATS) + 1):
+        # Cheap reject: a repeated unit ends with the same character as the one before it
+        if tail[-1] != tail[-1 - period]:
+            continue
+        unit = tail[-period:]
+        repeats = max(LOOP_MIN_REPEATS, -(-LOOP_MIN_SPAN // period))
+        span = period * repeats
+        if span > len(tail) or tail[-span:] != unit * repeats:
+            continue
+        # Extend backwards over further repeats, then keep the first one
+        start = len(tail) - span
+        while start >= period and tail[start - period:start] == unit:
+            start -= period
+        return offset + start + period
+    return None
+
+
+class StopMonitor:
+    """
+    Applies StopConditions to one stream.
+
+    Text containing a possible stop-sequence prefix is held back until it
+    is known not to be part of a stop sequence, so stop sequences are
+    never shown.
+    """
+
+    def __init__(self, conditions: StopConditions, started: Optional[float] = None):
+        """
+        Initialize the monitor.
+
+        Args:
+            conditions: Stop conditions
+            started: perf_counter() time the request started (default now)
+        """
+        self.conditions = conditions
+        self.started = started if started is not None else time.perf_counter()
+        self.text = ""
+        self._emitted = 0
+        self._tokens = 0
+        self._checked = 0
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline (None without one)."""
+        if self.conditions.deadline is None:
+            return None
+        return self.conditions.deadline - (time.perf_counter() - self.started)
+
+    def expired(self) -> bool:
+        """Whether the deadline has passed."""
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def feed(self, delta: str) -> Tuple[str, Optional[str]]:
+        """
+        Add a content delta.
+
+        Args:
+            delta: New text from the stream
+
+        Returns:
+            (text safe to emit now, stop reason or None)
+        """
+        self.text += delta
+        self._tokens += 1
+        conditions = self.conditions
+
+        for sequence in conditions.stop_sequences:
+            # Only the new text (plus an overlap) can contain a new match
+            index = self.text.find(sequence, max(0, self._emitted - len(sequence)))
+            if index != -1:
+                self.text = self.text[:index]
+                return self._flush(), STOP_SEQUENCE
+
+        if conditions.detect_loops and len(self.text) - self._checked >= LOOP_CHECK_EVERY:
+            self._checked = len(self.text)
+            keep = find_loop(self.text)
+            if keep is not None:
+                self.text = self.text[:max(keep, self._emitted)]
+                return self._flush(), LOOP
+
+        if conditions.token_budget is not None and self._tokens >= conditions.token_budget:
+            return self._flush(), TOKEN_BUDGET
+        if self.expired():
+            return self._flush(), DEADLINE
+
+        held = self._held_back()
+        out = self.text[self._emitted:len(self.text) - held]
+        self._emitted = len(self.text) - held
+        return out, None
+
+    def flush(self) -> str:
+        """Emit any held-back text (at the end of the stream)."""
+        return self._flush()
+
+    def _flush(self) -> str:
+        out = self.text[self._emitted:]
+        self._emitted = len(self.text)
+        return out
+
+    def _held_back(self) -> int:
+        """Length of the longest text suffix that starts a stop sequence."""
+        held = 0
+        for sequence in self.conditions.stop_sequences:
+            for length in range(min(len(sequence) - 1, len(self.text)), held, -1):
+                if self.text.endswith(sequence[:length]):
+                    held = length
+                    break
+        return held
@@ -0,0 +1,352 @@
+"""
+Lightweight request tracing.
+
+Spans nest through a context variable, so a span opened in app.py becomes
+the parent of the chain, encoder and HTTP spans below it. The default
+tracer is a no-op; enable in-memory collection or OpenTelemetry export
+with set_tracer() or VISION_TRACING ("memory" or "otel").
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Any, Iterator, Optional
+
+# Finished traces kept by the in-memory tracer
+MEMORY_TRACE_LIMIT = 100
+
+
+class Span:
+    """One timed operation within a trace."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "end", "attributes")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = {}
+
+    @property
+    def duration(self) -> float:
+        """Seconds from start to end (or to now while open)."""
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, key: str, value: Any):
+        """Attach an attribute."""
+        self.attributes[key] = value
+
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("vision_current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """Innermost open span in this context, if any."""
+    return _current_span.get()
+
+
+def trace_headers() -> Dict[str, str]:
+    """
+    HTTP headers that carry the current trace upstream.
+
+    Returns:
+        X-Request-ID and W3C traceparent headers, or {} outside a trace
+    """
+    span = current_span()
+    if span is None:
+        return {}
+    return {
+        "X-Request-ID": span.trace_id,
+        "traceparent": f"00-{span.trace_id}-{span.span_id}-01",
+    }
+
+
+class Tracer:
+    """
+    Base tracer: records nothing, but still propagates trace ids.
+
+    Subclasses override on_end() to collect or export finished spans.
+    """
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Time a block as a child of the current span.
+
+        Args:
+            name: Span name (e.g. "image.encode")
+            **attributes: Initial span attributes
+
+        Yields:
+            The open Span
+        """
+        parent = current_span()
+        trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        span = Span(name, trace_id, parent.span_id if parent is not None else None)
+        span.attributes.update(attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+            _current_span.reset(token)
+            self.on_end(span)
+
+    def mark(
+        self,
+        name: str,
+        parent: Optional[Span] = None,
+        start: Optional[float] = None,
+        **attributes
+    ):
+        """
+        Record a span that ends now, as a child of `parent` (or the current span).
+
+        Used for marks such as time-to-first-token, where the timed interval
+        does not map onto a single with-block.
+
+        Args:
+            name: Span name
+            parent: Parent span; the mark starts when the parent started
+            start: perf_counter() start time overriding the parent's
+        """
+        parent = parent or current_span()
+        if parent is None:
+            return
+        span = Span(name, parent.trace_id, parent.span_id)
+        span.start = start if start is not None else parent.start
+        span.end = time.perf_counter()
+        span.attributes.update(attributes)
+        self.on_end(span)
+
+    def on_end(self, span: Span):
+        """Called for every finished span."""
+
+
+class MemoryTracer(Tracer):
+    """Keeps finished spans in memory, grouped by trace (for tests and the debug panel)."""
+
+    def __init__(self, max_traces: int = MEMORY_TRACE_LIMIT):
+        self.max_traces = max_traces
+        self._traces: Dict[str, List[Span]] = {}
+        self._order: deque = deque()
+        self._lock = threading.Lock()
+
+    def on_end(self, span: Span):
+        with self._lock:
+            if span.trace_id not in self._traces:
+                self._traces[span.trace_id] = []
+                self._order.append(span.trace_id)
+                while len(self._order) > self.max_traces:
+                    self._traces.pop(self._order.popleft(), None)
+            self._traces[span.trace_id].append(span)
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Span]:
+        """Finished spans of one trace (default: the latest)."""
+        with self._lock:
+            if trace_id is None:
+                if not self._order:
+                    return []
+                trace_id = self._order[-1]
+            return list(self._traces.get(trace_id, []))
+
+    def trace_ids(self) -> List[str]:
+        """Collected trace ids, oldest first."""
+        with self._lock:
+            return list(self._order)
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+            self._order.clear()
+
+
+class _PresetIdGenerator:
+    """
+    OpenTelemetry SDK id generator that hands out preset ids.
+
+    Lets exported spans keep the ids of the Span they mirror (the ones sent
+    upstream in traceparent); falls back to the SDK's generator otherwise.
+    """
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+        self._local = threading.local()
+
+    def preset(self, trace_id: Optional[int], span_id: Optional[int]):
+        """Ids returned by the next calls in this thread (None = generate)."""
+        self._local.trace_id = trace_id
+        self._local.span_id = span_id
+
+    def generate_trace_id(self) -> int:
+        trace_id = getattr(self._local, "trace_id", None)
+        return trace_id if trace_id is not None else self._fallback.generate_trace_id()
+
+    def generate_span_id(self) -> int:
+        span_id = getattr(self._local, "span_id", None)
+        return span_id if span_id is not None else self._fallback.generate_span_id()
+
+    def is_trace_id_random(self) -> bool:
+        # uuid4 hex fixes its version bits, so preset ids are not fully random
+        if getattr(self._local, "trace_id", None) is not None:
+            return False
+        return getattr(self._fallback, "is_trace_id_random", lambda: False)()
+
+
+class OpenTelemetryTracer(Tracer):
+    """
+    Re-emits finished spans through the OpenTelemetry API (optional dependency).
+
+    Spans are exported after they end, with their original timestamps, so
+    the hot path only pays for the lightweight Span objects. Exported spans
+    keep this module's trace and span ids (W3C-sized: 128 and 64 bit) and
+    their parent links, so they join with the traceparent sent upstream.
+
+    Ids are preserved through a dedicated SDK TracerProvider that shares the
+    global provider's span processors, resource and sampler; the global
+    provider itself is left untouched. Without the SDK (or when the global
+    provider is not an SDK one), spans go through the global provider and
+    get its ids, but are still parented.
+    """
+
+    def __init__(self):
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.context import Context
+        self._trace = otel_trace
+        self._root_context = Context()
+        self._ids: Optional[_PresetIdGenerator] = None
+        self._otel = self._dedicated_tracer(otel_trace.get_tracer_provider())
+        self._offset = time.time_ns() - time.perf_counter_ns()
+
+    def _dedicated_tracer(self, provider):
+        """Tracer on a private SDK provider exporting to `provider`'s processors."""
+        try:
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.id_generator import RandomIdGenerator
+        except ImportError:
+            return provider.get_tracer("vision-ai")
+        # No public accessor for the processor pipeline; sharing the object
+        # also picks up processors added to the global provider later
+        processors = getattr(provider, "_active_span_processor", None)
+        if not isinstance(provider, TracerProvider) or processors is None:
+            return provider.get_tracer("vision-ai")
+        self._ids = _PresetIdGenerator(RandomIdGenerator())
+        dedicated = TracerProvider(
+            sampler=provider.sampler,
+            resource=provider.resource,
+            shutdown_on_exit=False,
+            active_span_processor=processors,
+            id_generator=self._ids
+        )
+        return dedicated.get_tracer("vision-ai")
+
+    def _ns(self, perf_seconds: float) -> int:
+        return int(perf_seconds * 1e9) + self._offset
+
+    def _parent_context(self, span: Span):
+        """OTel context whose current span stands in for `span`'s parent."""
+        if not span.parent_id:
+            # Empty context: not parented to whatever OTel span is current here
+            return self._root_context
+        parent = self._trace.SpanContext(
+            trace_id=int(span.trace_id, 16),
+            span_id=int(span.parent_id, 16),
+            is_remote=False,
+            trace_flags=self._trace.TraceFlags(self._trace.TraceFlags.SAMPLED),
+        )
+        return self._trace.set_span_in_context(self._trace.NonRecordingSpan(parent))
+
+    def on_end(self, span: Span):
+        if self._ids is not None:
+            self._ids.preset(int(span.trace_id, 16), int(span.span_id, 16))
+        try:
+            otel_span = self._otel.start_span(
+                span.name,
+                context=self._parent_context(span),
+                start_time=self._ns(span.start)
+            )
+        finally:
+            if self._ids is not None:
+                self._ids.preset(None, None)
+        for key, value in span.attributes.items():
+            if isinstance(value, (str, bool, int, float)):
+                otel_span.set_attribute(key, value)
+        otel_span.end(end_time=self._ns(span.end))
+
+
+def format_flame(spans: List[Span]) -> str:
+    """
+    Render a trace as an indented flame-style summary.
+
+    Args:
+        spans: Finished spans of one trace
+
+    Returns:
+        One line per span: offset from trace start, duration and a bar
+    """
+    if not spans:
+        return ""
+    children: Dict[Optional[str], List[Span]] = {}
+    ids = {span.span_id for span in spans}
+    for span in spans:
+        parent = span.parent_id if span.parent_id in ids else None
+        children.setdefault(parent, []).append(span)
+    origin = min(span.start for span in spans)
+    total = max(span.end for span in spans) - origin or 1e-9
+
+    lines = []
+
+    def walk(parent: Optional[str], depth: int):
+        for span in sorted(children.get(parent, []), key=lambda s: s.start):
+            offset = span.start - origin
+            bar = " " * int(offset / total * 30) + "█" * max(1, int(span.duration / total * 30))
+            lines.append(
+                f"{'  ' * depth}{span.name:<{32 - 2 * depth}} "
+                f"+{offset * 1000:8.1f}ms {span.duration * 1000:8.1f}ms |{bar:<31}|"
+            )
+            walk(span.span_id, depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def _tracer_from_env() -> Tracer:
+    mode = os.getenv("VISION_TRACING", "").lower()
+    if mode == "memory":
+        return MemoryTracer()
+    if mode == "otel":
+        try:
+            return OpenTelemetryTracer()
+        except ImportError:
+            return Tracer()
+    return Tracer()
+
+
+_tracer: Tracer = _tracer_from_env()
+
+
+def get_tracer() -> Tracer:
+    """Get the process-wide tracer."""
+    return _tracer
+
+
+def set_tracer(tracer: Tracer):
+    """Replace the process-wide tracer (e.g. with a MemoryTracer in tests)."""
+    global _tracer
+    _tracer = tracer
+
+
+def span(name: str, **attributes):
+    """Open a span on the process-wide tracer (context manager)."""
+    return _tracer.span(name, **attributes)
+
+
+def mark(name: str, parent: Optional[Span] = None, start: Optional[float] = None, **attributes):
+    """Record a mark on the process-wide tracer."""
+    _tracer.mark(name, parent, start, **attributes)
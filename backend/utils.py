@@ -2,9 +2,139 @@
 Image utility functions for encoding and processing.
 """
 import base64
+import math
+import os
+import warnings
 from io import BytesIO
+from typing import Optional, Tuple
 from PIL import Image
 
+from backend.image_analysis import MAX_SIDE_TEXT, EncodeParams, analyze_image, choose_encode_params
+from backend.tracing import span
+
+# Modes PNG can store as-is; anything else is converted first
+PNG_MODES = ("1", "L", "LA", "P", "RGB", "RGBA")
+
+# Upload limits: encoded size and decoded pixel count (decompression bombs)
+MAX_UPLOAD_BYTES = int(float(os.getenv("VISION_MAX_UPLOAD_MB", "50")) * 2**20)
+MAX_IMAGE_PIXELS = int(os.getenv("VISION_MAX_IMAGE_PIXELS", "60000000"))
+
+# Longest side kept after decoding (nothing downstream uses more)
+DECODE_MAX_SIDE = MAX_SIDE_TEXT
+
+
+class ImageRejected(ValueError):
+    """Raised for uploads that are too large or not decodable images."""
+
+
+def decode_image(
+    data: bytes,
+    max_side: int = DECODE_MAX_SIDE,
+    max_pixels: int = MAX_IMAGE_PIXELS,
+    max_bytes: int = MAX_UPLOAD_BYTES
+) -> Image.Image:
+    """
+    Decode untrusted image bytes within size limits.
+    
+    Dimensions are checked from the header before any pixel data is
+    decoded. JPEGs are decoded at reduced resolution (DCT scaling via
+    Image.draft) when they exceed max_side, and any image is downscaled to
+    max_side after decoding, so the decoded copy never exceeds what the
+    encoder and thumbnail need.
+    
+    Args:
+        data: Encoded image bytes
+        max_side: Longest side of the returned image
+        max_pixels: Largest accepted width x height
+        max_bytes: Largest accepted encoded size
+        
+    Returns:
+        Loaded PIL Image
+        
+    Raises:
+        ImageRejected: If a limit is exceeded or the data is not an image
+    """
+    if len(data) > max_bytes:
+        raise ImageRejected(f"Image is larger than {max_bytes / 2**20:.0f} MB")
+    
+    with span("image.decode", bytes=len(data)) as decode_span:
+        try:
+            with warnings.catch_warnings():
+                # Our own pixel limit applies; PIL's bomb warning would only add noise
+                warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+                image = Image.open(BytesIO(data))
+                width, height = image.size
+                if width * height > max_pixels:
+                    raise ImageRejected(
+                        f"Image is {width}x{height}; at most {max_pixels / 1e6:.0f} megapixels are accepted"
+                    )
+                decode_span.set("format", image.format)
+                if image.format == "JPEG" and max(width, height) > max_side:
+                    # Smallest DCT scale that still covers the target size
+                    scale = max_side / max(width, height)
+                    image.draft(image.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+                image.load()
+        except ImageRejected:
+            raise
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+            raise ImageRejected(f"Could not decode image: {e}")
+        
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        decode_span.set("size", f"{image.width}x{image.height}")
+    return image
+
+
+def encode_image_bytes(image: Image.Image) -> bytes:
+    """
+    Encode PIL Image as PNG file bytes.
+    
+    Args:
+        image: PIL Image object
+        
+    Returns:
+        PNG encoded bytes
+    """
+    buffered = BytesIO()
+    image.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def encode_image_for_api(
+    image: Image.Image,
+    params: Optional[EncodeParams] = None
+) -> Tuple[bytes, str]:
+    """
+    Encode PIL Image with parameters suited to its content.
+    
+    Args:
+        image: PIL Image object
+        params: Encode parameters; chosen by image analysis when omitted
+        
+    Returns:
+        Tuple of (encoded bytes, MIME type)
+    """
+    with span("image.preprocess", width=image.width, height=image.height):
+        if params is None:
+            params = choose_encode_params(analyze_image(image))
+        
+        if max(image.size) > params.max_side:
+            image = image.copy()
+            image.thumbnail((params.max_side, params.max_side), Image.Resampling.LANCZOS)
+    
+    with span("image.encode", format=params.format) as encode_span:
+        buffered = BytesIO()
+        if params.format == "JPEG":
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            image.save(buffered, format="JPEG", quality=params.quality)
+        else:
+            if image.mode not in PNG_MODES:
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            image.save(buffered, format="PNG")
+        encode_span.set("bytes", buffered.tell())
+    return buffered.getvalue(), params.mime
+
 
 def encode_image_to_base64(image: Image.Image) -> str:
     """
@@ -16,15 +146,13 @@ def encode_image_to_base64(image: Image.Image) -> str:
     Returns:
         Base64 encoded string of the image
     """
-    buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    img_bytes = buffered.getvalue()
-    return base64.b64encode(img_bytes).decode('utf-8')
+    return base64.b64encode(encode_image_bytes(image)).decode('utf-8')
 
 
 def prepare_image_for_api(image: Image.Image) -> str:
     """
     Prepare image for Qubrid API by encoding to base64.
+    Format and resolution are picked per image (see encode_image_for_api).
     
     Args:
         image: PIL Image object
@@ -32,5 +160,6 @@ def prepare_image_for_api(image: Image.Image) -> str:
     Returns:
         Data URI string with base64 encoded image
     """
-    base64_image = encode_image_to_base64(image)
-    return f"data:image/png;base64,{base64_image}"
\ No newline at end of file
+    img_bytes, mime = encode_image_for_api(image)
+    base64_image = base64.b64encode(img_bytes).decode('utf-8')
+    return f"data:{mime};base64,{base64_image}"
\ No newline at end of file
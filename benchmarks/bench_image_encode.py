@@ -0,0 +1,113 @@
+"""
+Benchmark content-aware image encoding against always-PNG.
+
+Generates synthetic photos, screenshots, charts and transparent graphics,
+then reports analysis time, encode time and bytes saved per image kind.
+
+Usage:
+    python -m benchmarks.bench_image_encode [--size 1920x1080]
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+from backend.image_analysis import analyze_image, choose_encode_params
+from backend.utils import encode_image_bytes, encode_image_for_api
+
+
+def make_photo(width: int, height: int, seed: int) -> Image.Image:
+    """Smooth gradients plus sensor-like noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        128 + 100 * np.sin(x / (width / 3) + seed),
+        128 + 100 * np.cos(y / (height / 2)),
+        128 + 60 * np.sin((x + y) / (width / 5)),
+    ], axis=-1)
+    noisy = base + rng.normal(0, 12, base.shape)
+    image = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+    return image.filter(ImageFilter.GaussianBlur(1))
+
+
+def make_screenshot(width: int, height: int, seed: int) -> Image.Image:
+    """White page with lines of text and a toolbar."""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, width, 40], fill=(40, 44, 52))
+    rng = np.random.default_rng(seed)
+    for row in range(60, height - 20, 18):
+        words = " ".join("lorem ipsum dolor sit amet"[: int(rng.integers(5, 27))] for _ in range(8))
+        draw.text((20, row), words, fill=(20, 20, 20))
+    return image
+
+
+def make_chart(width: int, height: int, seed: int) -> Image.Image:
+    """Flat-colored bar chart with axes."""
+    image = Image.new("RGB", (width, height), (250, 250, 250))
+    draw = ImageDraw.Draw(image)
+    rng = np.random.default_rng(seed)
+    colors = [(66, 133, 244), (219, 68, 55), (244, 180, 0), (15, 157, 88)]
+    bar_width = width // 30
+    for i in range(20):
+        bar_height = int(rng.integers(height // 10, height - 80))
+        x0 = 60 + i * (bar_width + 10)
+        draw.rectangle([x0, height - 40 - bar_height, x0 + bar_width, height - 40], fill=colors[i % 4])
+    draw.line([50, 20, 50, height - 40, width - 20, height - 40], fill="black", width=2)
+    return image
+
+
+def make_logo(width: int, height: int, seed: int) -> Image.Image:
+    """Transparent graphic."""
+    image = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse([width // 4, height // 4, 3 * width // 4, 3 * height // 4], fill=(154, 27, 116, 255))
+    return image
+
+
+GENERATORS = {
+    "photo": make_photo,
+    "screenshot": make_screenshot,
+    "chart": make_chart,
+    "logo": make_logo,
+}
+
+
+def timed(fn, repeats: int = 3):
+    """Return (result, mean seconds) of fn()."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", default="1920x1080")
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split("x"))
+
+    print(f"{'image':<12}{'kind':<9}{'format':<7}{'analyze':>9}{'png':>10}{'auto':>10}"
+          f"{'png time':>10}{'auto time':>10}{'saved':>8}")
+    total_png = total_auto = 0
+    for name, make in GENERATORS.items():
+        for seed in range(args.samples):
+            image = make(width, height, seed)
+            features, analyze_time = timed(lambda: analyze_image(image))
+            params = choose_encode_params(features)
+            png, png_time = timed(lambda: encode_image_bytes(image), 1)
+            (auto, _), auto_time = timed(lambda: encode_image_for_api(image), 1)
+            total_png += len(png)
+            total_auto += len(auto)
+            print(f"{name:<12}{params.kind:<9}{params.format:<7}{analyze_time * 1000:7.2f}ms"
+                  f"{len(png) / 1024:8.0f}KB{len(auto) / 1024:8.0f}KB"
+                  f"{png_time * 1000:8.0f}ms{auto_time * 1000:8.0f}ms"
+                  f"{1 - len(auto) / len(png):8.0%}")
+    print(f"total: {total_png / 2**20:.1f} MiB PNG -> {total_auto / 2**20:.1f} MiB auto "
+          f"({1 - total_auto / total_png:.0%} saved)")
+
+
+if __name__ == "__main__":
+    main()
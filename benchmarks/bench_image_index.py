@@ -0,0 +1,46 @@
+"""
+Benchmark near-duplicate lookup in the perceptual-hash image index.
+
+Fills a memory-mapped index with random hashes and times nearest() scans.
+
+Usage:
+    python -m benchmarks.bench_image_index [--images 100000] [--lookups 1000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from backend.image_index import ImageIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 2**63, args.images, dtype=np.uint64)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = ImageIndex(os.path.join(tmp, "index.bin"))
+
+        start = time.perf_counter()
+        for i, image_hash in enumerate(hashes):
+            index.add(int(image_hash), f"{i:016x}")
+        add_time = time.perf_counter() - start
+
+        queries = [int(hashes[i]) ^ 0b1011 for i in rng.integers(0, args.images, args.lookups)]
+        start = time.perf_counter()
+        hits = sum(index.nearest(q) is not None for q in queries)
+        lookup_time = (time.perf_counter() - start) / args.lookups
+
+    print(f"{args.images} images: add {add_time / args.images * 1e6:.1f} us/image, "
+          f"lookup {lookup_time * 1000:.3f} ms, {hits}/{args.lookups} near-duplicates found")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark upload ingestion of large JPEG and PNG images.
+
+Compares the old path (full-resolution Image.open + load, then dHash) with
+decode_image (header limits, JPEG draft decoding, downscale to the size
+the encoder needs). "decode" times ingestion alone; "ready" adds the
+thumbnail and API encoding that follow, which previously also worked on
+the full-resolution image. Also shows the cost of a repeated upload,
+which is served by fingerprint without decoding.
+
+Usage:
+    python -m benchmarks.bench_ingest [--size 6000x4000]
+"""
+import argparse
+import os
+import time
+from io import BytesIO
+
+os.environ.setdefault("VISION_IMAGE_INDEX_PATH", "")
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from backend.assets import fingerprint, load_asset
+from backend.image_index import dhash
+from backend.assets import THUMBNAIL_SIZE
+from backend.utils import ImageRejected, decode_image, encode_image_for_api
+
+
+def make_photo(width: int, height: int) -> Image.Image:
+    """Smooth gradients plus noise, so the encoders do real work."""
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 255, (height // 16, width // 16, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((width, height), Image.Resampling.BICUBIC)
+    return image.filter(ImageFilter.GaussianBlur(2))
+
+
+def encode(image: Image.Image, fmt: str) -> bytes:
+    buffered = BytesIO()
+    image.save(buffered, format=fmt, **({"quality": 90} if fmt == "JPEG" else {}))
+    return buffered.getvalue()
+
+
+def old_ingest(data: bytes) -> Image.Image:
+    """Previous behaviour: decode everything at full resolution."""
+    image = Image.open(BytesIO(data))
+    image.load()
+    dhash(image)
+    return image
+
+
+def new_ingest(data: bytes) -> Image.Image:
+    image = decode_image(data)
+    dhash(image)
+    return image
+
+
+def make_ready(ingest, data: bytes) -> Image.Image:
+    """Ingest, then build the thumbnail and API payload like ImageAsset does."""
+    image = ingest(data)
+    thumbnail = image.copy()
+    thumbnail.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    encode_image_for_api(image)
+    return image
+
+
+def timed(fn, repeats: int):
+    """Return (result, mean seconds) of fn()."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeats
+
+
+def decoded_mb(image: Image.Image) -> float:
+    return image.width * image.height * len(image.getbands()) / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", default="6000x4000")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    width, height = (int(v) for v in args.size.split("x"))
+
+    photo = make_photo(width, height)
+    print(f"{'format':<7}{'upload':>9}{'old decode':>12}{'new decode':>12}{'old ready':>11}{'new ready':>11}"
+          f"{'old MiB':>9}{'new MiB':>9}{'repeat':>9}")
+    for fmt in ("JPEG", "PNG"):
+        data = encode(photo, fmt)
+        old, old_time = timed(lambda: old_ingest(data), args.repeats)
+        new, new_time = timed(lambda: new_ingest(data), args.repeats)
+        _, old_ready = timed(lambda: make_ready(old_ingest, data), args.repeats)
+        _, new_ready = timed(lambda: make_ready(new_ingest, data), args.repeats)
+        load_asset(data)
+        _, repeat_time = timed(lambda: load_asset(data), args.repeats)
+        print(f"{fmt:<7}{len(data) / 2**20:7.1f}MB{old_time * 1000:10.0f}ms{new_time * 1000:10.0f}ms"
+              f"{old_ready * 1000:9.0f}ms{new_ready * 1000:9.0f}ms"
+              f"{decoded_mb(old):9.1f}{decoded_mb(new):9.1f}{repeat_time * 1000:7.1f}ms")
+    print(f"(repeat = load_asset of an already-ingested upload: fingerprint "
+          f"{fingerprint(data)} + cache lookup)")
+
+    bomb = encode(Image.new("L", (12000, 12000)), "PNG")
+    start = time.perf_counter()
+    try:
+        decode_image(bomb)
+    except ImageRejected as e:
+        print(f"decompression bomb ({len(bomb) / 1024:.0f} KB PNG, 144 MP) rejected in "
+              f"{(time.perf_counter() - start) * 1000:.2f}ms: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Benchmark request body construction for a large image with long history.
+
+Compares the previous approach (build payload dicts every turn and let
+requests json-encode them) against RequestBody with cached fragments,
+joined into one buffer or drained as chunks for a chunked upload.
+
+Usage:
+    python -m benchmarks.bench_request_body [--image-mb 10] [--turns 50]
+"""
+import argparse
+import base64
+import json
+import os
+import time
+import tracemalloc
+
+from backend.history import ChatHistory, format_text_message
+from backend.request_body import (
+    ImageBlockStream,
+    RequestBody,
+    encode_json,
+    encode_user_message,
+)
+
+PARAMS = {
+    "model": "Qwen/Qwen3-VL-30B-A3B-Instruct",
+    "temperature": 0.7,
+    "max_tokens": 1024,
+    "top_p": 0.9,
+    "top_k": 40,
+    "presence_penalty": 0.0,
+    "stream": True,
+}
+
+
+def make_history(turns: int) -> ChatHistory:
+    """Build a history with `turns` question/answer pairs."""
+    history = ChatHistory()
+    for i in range(turns):
+        history.add_user_message(f"Question {i}: what is in the top-left corner? " * 3)
+        history.add_ai_message(f"Answer {i}: a detailed description of the region. " * 20)
+    return history
+
+
+def baseline_body(system: str, history: ChatHistory, data_uri: str, query: str) -> bytes:
+    """Previous path: fresh dicts every turn, then json.dumps like requests does."""
+    messages = [format_text_message("system", system)]
+    for record in history.records:
+        role = "user" if record.type == "human" else "assistant"
+        messages.append(format_text_message(role, record.content))
+    messages.append({
+        "role": "user",
+        "content": [
+            {"type": "image_url", "image_url": {"url": data_uri}},
+            {"type": "text", "text": query},
+        ],
+    })
+    payload = dict(PARAMS, messages=messages)
+    return json.dumps(payload, allow_nan=False).encode("utf-8")
+
+
+def cached_body(system_encoded: bytes, history: ChatHistory, image: ImageBlockStream, query: str) -> bytes:
+    """New path: join cached fragments."""
+    messages = [system_encoded] + history.encoded_messages()
+    messages.append(encode_user_message([image, encode_json({"type": "text", "text": query})]))
+    return RequestBody(PARAMS, messages).to_bytes()
+
+
+def streamed_body(system_encoded: bytes, history: ChatHistory, image: ImageBlockStream, query: str) -> int:
+    """Chunked upload path: drain the chunk generator like the socket would."""
+    messages = [system_encoded] + history.encoded_messages()
+    messages.append(encode_user_message([image, encode_json({"type": "text", "text": query})]))
+    return sum(len(chunk) for chunk in RequestBody(PARAMS, messages).iter_chunks())
+
+
+def measure(label: str, fn, repeats: int):
+    """Report mean time and traced peak memory of fn()."""
+    fn()  # warm caches
+    start = time.perf_counter()
+    for _ in range(repeats):
+        body = fn()
+    elapsed = (time.perf_counter() - start) / repeats
+
+    tracemalloc.start()
+    body = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    size = body if isinstance(body, int) else len(body)
+    print(f"{label:<12} {elapsed * 1000:8.1f} ms   peak {peak / 2**20:7.1f} MiB   body {size / 2**20:6.1f} MiB")
+    return body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--image-mb", type=float, default=10.0)
+    parser.add_argument("--turns", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    raw = os.urandom(int(args.image_mb * 2**20))
+    data_uri = "data:image/png;base64," + base64.b64encode(raw).decode("ascii")
+    history = make_history(args.turns)
+    system = "You are a helpful AI assistant with vision capabilities."
+    query = "What changed since the last answer?"
+
+    system_encoded = encode_json(format_text_message("system", system))
+    image_stream = ImageBlockStream(raw, "image/png")
+
+    print(f"image {args.image_mb:.0f} MB raw, {args.turns} turns of history")
+    old = measure("json=payload", lambda: baseline_body(system, history, data_uri, query), args.repeats)
+    new = measure("RequestBody", lambda: cached_body(system_encoded, history, image_stream, query), args.repeats)
+    measure("chunked", lambda: streamed_body(system_encoded, history, image_stream, query), args.repeats)
+
+    assert json.loads(old) == json.loads(new), "bodies differ"
+
+
+if __name__ == "__main__":
+    main()
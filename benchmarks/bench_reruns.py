@@ -0,0 +1,86 @@
+"""
+Benchmark Streamlit reruns of app.py with a populated session.
+
+Seeds M conversations of N messages each, runs the script K times through
+Streamlit's AppTest harness with profiling on, and reports the mean time
+per section (header, sidebar, transcript, ...) from the profiling buffer.
+
+Usage:
+    python -m benchmarks.bench_reruns [--conversations 20] [--messages 50] [--reruns 10]
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from PIL import Image
+
+from backend.assets import ImageAsset
+from backend.history import ChatHistory
+
+REPLY = (
+    "The image shows **a chart** with several bars.\n\n"
+    "- The tallest bar is on the left\n"
+    "- Values decrease towards the right\n\n"
+    "Overall the trend is `downward`."
+)
+
+
+def make_conversations(count: int, messages: int):
+    """Build session conversations in the shape app.py creates them."""
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 255, (720, 1280, 3), dtype=np.uint8))
+    asset = ImageAsset("bench", image)
+    now = datetime.now()
+
+    conversations = {}
+    for i in range(count):
+        history = ChatHistory()
+        for j in range(messages // 2):
+            history.add_user_message(f"Question {j}: what is in the image?")
+            history.add_ai_message(REPLY)
+        conversations[f"conv_{i:04d}"] = {
+            "title": f"🔍 Conversation {i}",
+            "asset": asset,
+            "image_name": f"image_{i}.png",
+            "history": history,
+            "created_at": (now - timedelta(minutes=i)).isoformat(),
+        }
+    return conversations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--reruns", type=int, default=10)
+    args = parser.parse_args()
+
+    os.environ["VISION_PROFILE"] = "1"
+    os.environ.setdefault("QUBRID_API_KEY", "benchmark")
+    os.environ["VISION_IMAGE_INDEX_PATH"] = ""
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file("../app.py", default_timeout=60)
+    conversations = make_conversations(args.conversations, args.messages)
+    app.session_state.conversations = conversations
+    app.session_state.switch_to_conversation = next(iter(conversations))
+
+    for _ in range(args.reruns):
+        app.run()
+        if app.exception:
+            raise SystemExit(app.exception[0].message)
+
+    history = list(app.session_state._profile_history)
+    sections = sorted({name for record in history for name in record["sections"]})
+    print(f"{args.conversations} conversations x {args.messages} messages, {len(history)} reruns")
+    print(f"{'section':<28}{'mean':>10}{'max':>10}")
+    for name in sections:
+        samples = [record["sections"][name] for record in history if name in record["sections"]]
+        print(f"{name:<28}{np.mean(samples) * 1000:8.2f}ms{max(samples) * 1000:8.2f}ms")
+    totals = [record["total"] for record in history]
+    print(f"{'total':<28}{np.mean(totals) * 1000:8.2f}ms{max(totals) * 1000:8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
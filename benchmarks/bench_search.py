@@ -0,0 +1,89 @@
+"""
+Benchmark message search over many conversations.
+
+Builds M conversations of N messages from a synthetic vocabulary, times the
+initial index build, an incremental sync after one new turn, and queries of
+one and two words (with the last word typed as a prefix), and compares them
+with a linear scan over every message.
+
+Usage:
+    python -m benchmarks.bench_search [--conversations 200] [--messages 250]
+"""
+import argparse
+import random
+import time
+
+from backend.history import ChatHistory
+from backend.search import SearchIndex, tokenize
+
+
+def make_conversations(count: int, messages: int, seed: int = 0):
+    """Session conversations with random prose-like messages."""
+    rng = random.Random(seed)
+    vocabulary = [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+        for _ in range(20000)
+    ]
+    # Zipf-like word frequencies, as in real text
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    conversations = {}
+    for i in range(count):
+        history = ChatHistory()
+        for _ in range(messages // 2):
+            history.add_turn(
+                " ".join(rng.choices(vocabulary, weights, k=rng.randint(5, 20))),
+                " ".join(rng.choices(vocabulary, weights, k=rng.randint(40, 120)))
+            )
+        conversations[f"conv_{i:04d}"] = {"title": f"Conversation {i}", "history": history}
+    return conversations, vocabulary
+
+
+def linear_scan(conversations, query: str) -> int:
+    """Count matches by tokenizing every message (no index)."""
+    terms = tokenize(query)
+    prefix = terms.pop()
+    total = 0
+    for conversation in conversations.values():
+        for record in conversation["history"].records:
+            words = set(tokenize(record.content))
+            if all(term in words for term in terms) and any(word.startswith(prefix) for word in words):
+                total += 1
+    return total
+
+
+def timed(fn, repeats: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    return result, (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=250)
+    args = parser.parse_args()
+
+    conversations, vocabulary = make_conversations(args.conversations, args.messages)
+    total_messages = sum(len(c["history"]) for c in conversations.values())
+    print(f"{args.conversations} conversations, {total_messages} messages")
+
+    index = SearchIndex()
+    added, build = timed(lambda: index.sync(conversations))
+    print(f"initial index build: {build:8.1f}ms ({added} messages)")
+
+    next(iter(conversations.values()))["history"].add_turn("a new question", "a new answer")
+    added, sync = timed(lambda: index.sync(conversations))
+    print(f"incremental sync:    {sync:8.2f}ms ({added} messages)")
+
+    queries = [vocabulary[50][:3], f"{vocabulary[10]} {vocabulary[200][:4]}", f"{vocabulary[3]} {vocabulary[7]} {vocabulary[900]}"]
+    print(f"{'query':<32}{'matches':>9}{'index':>10}{'scan':>11}")
+    for query in queries:
+        (hits, total), search = timed(lambda: index.search(conversations, query), repeats=20)
+        scanned, scan = timed(lambda: linear_scan(conversations, query))
+        assert scanned == total, (scanned, total)
+        print(f"{query!r:<32}{total:>9}{search:8.2f}ms{scan:9.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Opt-in per-rerun profiling for the Streamlit app.
+Enable with VISION_PROFILE=1 or the ?profile=1 query parameter.
+"""
+import cProfile
+import os
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, Optional
+
+import streamlit as st
+
+from backend.sessions import session_manager
+from backend.tracing import MemoryTracer, format_flame, get_tracer
+
+# Reruns kept in the per-session ring buffer
+PROFILE_HISTORY = 50
+
+
+class RerunProfiler:
+    """Times named sections of one script rerun."""
+
+    def __init__(self, dump_dir: Optional[str] = None):
+        """
+        Initialize the profiler.
+
+        Args:
+            dump_dir: Directory for per-rerun cProfile .pstats dumps (optional)
+        """
+        self.sections: Dict[str, float] = {}
+        self.started = time.perf_counter()
+        self.dump_dir = dump_dir
+        self._stack = []
+        self._cprofile = None
+        if dump_dir:
+            os.makedirs(dump_dir, exist_ok=True)
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    @contextmanager
+    def section(self, name: str):
+        """Time a block; nested sections are recorded as "outer/inner"."""
+        self._stack.append(name)
+        path = "/".join(self._stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections[path] = self.sections.get(path, 0.0) + time.perf_counter() - start
+            self._stack.pop()
+
+    def finish(self, rerun: int) -> Dict[str, Any]:
+        """
+        Stop timing and return the rerun record.
+
+        Args:
+            rerun: Rerun sequence number (used for the dump file name)
+
+        Returns:
+            {"rerun", "total", "sections"} record
+        """
+        total = time.perf_counter() - self.started
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(os.path.join(self.dump_dir, f"rerun_{rerun:05d}.pstats"))
+        return {"rerun": rerun, "total": total, "sections": dict(self.sections)}
+
+
+def profiling_enabled() -> bool:
+    """Whether profiling is switched on for this session."""
+    if os.getenv("VISION_PROFILE", "0") == "1":
+        return True
+    return st.query_params.get("profile") == "1"
+
+
+def start_rerun():
+    """Begin profiling the current rerun (no-op when profiling is off)."""
+    if profiling_enabled():
+        st.session_state._profiler = RerunProfiler(os.getenv("VISION_PROFILE_DUMP") or None)
+    else:
+        st.session_state.pop("_profiler", None)
+
+
+def profile_section(name: str):
+    """
+    Context manager timing a section of the current rerun.
+
+    Args:
+        name: Section name
+
+    Returns:
+        Timing context, or a null context when profiling is off
+    """
+    profiler = st.session_state.get("_profiler")
+    if profiler is None:
+        return nullcontext()
+    return profiler.section(name)
+
+
+def finish_rerun():
+    """Record the current rerun in the session's ring buffer."""
+    profiler = st.session_state.pop("_profiler", None)
+    if profiler is None:
+        return
+    history = st.session_state.get("_profile_history")
+    if history is None:
+        history = st.session_state._profile_history = deque(maxlen=PROFILE_HISTORY)
+    rerun = history[-1]["rerun"] + 1 if history else 1
+    history.append(profiler.finish(rerun))
+
+
+def render_profile_panel():
+    """Show recent rerun timings, session gauges and the latest trace (if collected)."""
+    history = st.session_state.get("_profile_history")
+    if not profiling_enabled() or not history:
+        return
+
+    with st.sidebar.expander("🛠️ Profiling", expanded=False):
+        last = history[-1]
+        names = sorted({name for record in history for name in record["sections"]})
+        rows = []
+        for name in names:
+            samples = [record["sections"][name] for record in history if name in record["sections"]]
+            rows.append({
+                "section": name,
+                "last ms": round(last["sections"].get(name, 0.0) * 1000, 2),
+                "mean ms": round(sum(samples) / len(samples) * 1000, 2),
+                "max ms": round(max(samples) * 1000, 2),
+            })
+        st.caption(f"Rerun #{last['rerun']}: {last['total'] * 1000:.1f} ms total, "
+                   f"{len(history)} reruns buffered")
+        st.dataframe(rows, hide_index=True)
+
+        stats = session_manager.stats()
+        cap = f" / {stats['memory_cap'] / 2**20:.0f}" if stats["memory_cap"] else ""
+        st.caption(
+            f"Sessions: {stats['sessions']} live, {stats['active_sessions']} active, "
+            f"{stats['spilled_sessions']} spilled · "
+            f"{stats['bytes_held'] / 2**20:.1f}{cap} MiB held "
+            f"(images {stats['image_bytes'] / 2**20:.1f}, history {stats['history_bytes'] / 2**20:.1f})"
+        )
+
+        tracer = get_tracer()
+        if isinstance(tracer, MemoryTracer) and tracer.trace_ids():
+            st.caption("Latest trace")
+            st.code(format_flame(tracer.spans()), language=None)
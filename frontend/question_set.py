@@ -0,0 +1,95 @@
+"""
+Question-set mode: several independent questions about the current image,
+answered concurrently into separate panels.
+"""
+from typing import Dict, List, Any, Optional
+
+import streamlit as st
+
+from frontend.transcript import prepare_markdown
+
+# Upper bound on questions per set
+MAX_QUESTIONS = 20
+
+# Panels per row
+PANEL_COLUMNS = 2
+
+
+def parse_questions(text: str) -> List[str]:
+    """
+    Split a question set into questions, one per non-empty line.
+
+    Args:
+        text: Text area contents
+
+    Returns:
+        Up to MAX_QUESTIONS questions, duplicates removed
+    """
+    questions = []
+    for line in text.splitlines():
+        question = line.strip().lstrip("-*•").strip()
+        if question and question not in questions:
+            questions.append(question)
+    return questions[:MAX_QUESTIONS]
+
+
+def render_question_set_form() -> Optional[List[str]]:
+    """
+    Render the question-set form.
+
+    Returns:
+        Questions when the form was submitted with at least one, else None
+    """
+    with st.form("question_set_form", clear_on_submit=False, border=False):
+        text = st.text_area(
+            "Questions (one per line)",
+            placeholder="What objects are visible?\nWhat text appears in the image?\nWhat is the overall mood?",
+            height=150
+        )
+        submitted = st.form_submit_button("🔀 Ask all", type="primary")
+    if not submitted:
+        return None
+    questions = parse_questions(text)
+    if not questions:
+        st.warning("Enter at least one question.")
+        return None
+    return questions
+
+
+def create_panels(questions: List[str]) -> List[Any]:
+    """
+    Lay out one bordered panel per question.
+
+    Args:
+        questions: Questions in display order
+
+    Returns:
+        st.empty() placeholder for each question's answer
+    """
+    placeholders = []
+    for start in range(0, len(questions), PANEL_COLUMNS):
+        columns = st.columns(PANEL_COLUMNS)
+        for column, question in zip(columns, questions[start:start + PANEL_COLUMNS]):
+            with column, st.container(border=True):
+                st.markdown(f"**{question}**")
+                placeholder = st.empty()
+                placeholder.caption("Waiting...")
+                placeholders.append(placeholder)
+    return placeholders
+
+
+def render_question_set_results(results: List[Dict[str, Any]]):
+    """
+    Show the answers of the conversation's last question set.
+
+    Args:
+        results: {"question", "answer", "error"} per question
+    """
+    with st.expander(f"🔀 Question set ({len(results)} answers)", expanded=True):
+        placeholders = create_panels([result["question"] for result in results])
+        for placeholder, result in zip(placeholders, results):
+            with placeholder.container():
+                if result["answer"]:
+                    st.markdown(prepare_markdown(result["answer"]))
+                if result["error"]:
+                    st.error(result["error"])
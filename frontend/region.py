@@ -0,0 +1,66 @@
+"""
+Region-of-interest controls for the active conversation's image.
+The chosen region is kept on the conversation and applied to every turn.
+"""
+from typing import Dict, Any, Optional
+
+import streamlit as st
+
+from backend.roi import RegionOfInterest, resolve_box
+
+# Region modes offered in the image panel
+REGION_MODES = ("Whole image", "Auto-trim borders", "Custom box")
+
+
+def render_region_controls(conversation_id: str, conversation: Dict[str, Any]) -> Optional[RegionOfInterest]:
+    """
+    Let the user restrict questions to part of the image, with a preview.
+
+    Args:
+        conversation_id: Active conversation id (keys the widgets)
+        conversation: Active conversation; its "roi" entry is updated
+
+    Returns:
+        The conversation's region of interest, or None for the whole image
+    """
+    asset = conversation["asset"]
+    if asset.frames:
+        st.caption(f"🎞️ {asset.frame_count} keyframes are sent with each question.")
+        conversation["roi"] = None
+        return None
+
+    mode = st.radio(
+        "Send",
+        REGION_MODES,
+        horizontal=True,
+        key=f"roi_mode_{conversation_id}",
+        help="Only the selected region is encoded and sent with each question"
+    )
+    if mode == REGION_MODES[0]:
+        conversation["roi"] = None
+        return None
+
+    box = None
+    if mode == REGION_MODES[2]:
+        col1, col2 = st.columns(2)
+        with col1:
+            x = st.slider("Horizontal (%)", 0, 100, (0, 100), key=f"roi_x_{conversation_id}")
+        with col2:
+            y = st.slider("Vertical (%)", 0, 100, (0, 100), key=f"roi_y_{conversation_id}")
+        box = (x[0] / 100, y[0] / 100, x[1] / 100, y[1] / 100)
+    context = st.checkbox(
+        "Include overview thumbnail",
+        key=f"roi_context_{conversation_id}",
+        help="Also send a small copy of the whole image with the region outlined"
+    )
+    roi = RegionOfInterest(box=box, auto=box is None, context=context)
+    conversation["roi"] = roi
+
+    # Preview on the thumbnail (cheap; the full-resolution crop is made when sending)
+    thumbnail = asset.thumbnail
+    preview = resolve_box(thumbnail, roi)
+    if preview is None:
+        st.caption("Nothing to crop - the whole image is sent.")
+    else:
+        st.image(thumbnail.crop(preview), caption="Region sent", width=200)
+    return roi
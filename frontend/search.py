@@ -0,0 +1,77 @@
+"""
+Sidebar message search across all of the session's conversations.
+"""
+import time
+
+import streamlit as st
+
+from backend.search import SearchIndex
+from frontend.transcript import TRANSCRIPT_WINDOW
+
+# Record type -> label shown with each hit
+HIT_ROLES = {
+    "human": "👤 You",
+    "ai": "🤖 Assistant",
+}
+
+
+def get_search_index() -> SearchIndex:
+    """The session's search index (created on first use)."""
+    if "search_index" not in st.session_state:
+        st.session_state.search_index = SearchIndex()
+    return st.session_state.search_index
+
+
+def open_hit(conversation_id: str, position: int):
+    """
+    Remember a clicked hit (button callback).
+
+    Callbacks run before the session is restored from a spill, so the hit is
+    opened by apply_open_hit() once the conversations are back.
+    """
+    st.session_state.open_search_hit = (conversation_id, position)
+
+
+def apply_open_hit():
+    """Switch to a remembered hit's conversation with the transcript window widened to show it."""
+    hit = st.session_state.pop("open_search_hit", None)
+    if hit is None:
+        return
+    conversation_id, position = hit
+    conversation = st.session_state.conversations.get(conversation_id)
+    if conversation is None:
+        return
+    windows = st.session_state.setdefault("transcript_windows", {})
+    windows[conversation_id] = max(windows.get(conversation_id, TRANSCRIPT_WINDOW), len(conversation["history"]) - position)
+    st.session_state.switch_to_conversation = conversation_id
+
+
+def render_search():
+    """Render the search box and, for a non-empty query, the matching messages."""
+    query = st.sidebar.text_input(
+        "Search messages",
+        key="search_query",
+        placeholder="🔎 Search all conversations...",
+        label_visibility="collapsed"
+    )
+    if not query.strip():
+        return
+
+    conversations = st.session_state.get("conversations", {})
+    start = time.perf_counter()
+    hits, total = get_search_index().search(conversations, query)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    st.sidebar.caption(f"{total} matching message{'s' if total != 1 else ''} ({elapsed:.1f} ms)")
+    for i, hit in enumerate(hits):
+        conversation = conversations[hit.conversation_id]
+        with st.sidebar.container(border=True):
+            st.caption(f"{HIT_ROLES.get(hit.role, hit.role)} · {conversation['title']}")
+            st.markdown(hit.snippet)
+            st.button(
+                "Open",
+                key=f"search_hit_{i}",
+                on_click=open_hit,
+                args=(hit.conversation_id, hit.position),
+                type="tertiary"
+            )
@@ -0,0 +1,169 @@
+"""
+Chat transcript rendering.
+Only the newest messages are rendered on each rerun; older turns stay behind
+a "show earlier" control, and each message's prepared markdown is cached by
+record id so replaying history does no per-message text work.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import streamlit as st
+
+from backend.history import ChatHistory, ChatRecord, PendingTurn
+from backend.stopping import STOP_REASON_LABELS
+
+# Messages rendered by default (and added per "show earlier" click)
+TRANSCRIPT_WINDOW = int(os.getenv("VISION_TRANSCRIPT_WINDOW", "20"))
+
+# Prepared messages kept in the process-wide render cache
+RENDER_CACHE_SIZE = 4096
+
+# Record type -> (chat_message name, avatar)
+CHAT_ROLES = {
+    "human": ("user", "👤"),
+    "ai": ("assistant", "🤖"),
+}
+
+
+def prepare_markdown(text: str) -> str:
+    """
+    Make message text safe to render as a standalone markdown block.
+
+    Closes an unterminated code fence (e.g. in a cut-off answer) so it
+    cannot swallow the rest of the block, and drops trailing whitespace.
+
+    Args:
+        text: Raw message text
+
+    Returns:
+        Markdown ready for st.markdown
+    """
+    text = text.rstrip()
+    fences = sum(1 for line in text.splitlines() if line.lstrip().startswith("```"))
+    if fences % 2:
+        text += "\n```"
+    return text
+
+
+class RenderCache:
+    """Thread-safe LRU of prepared markdown by record id."""
+
+    def __init__(self, max_size: int = RENDER_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, record: ChatRecord) -> str:
+        """Get the prepared markdown for a record, preparing it once."""
+        with self._lock:
+            text = self._entries.get(record.id)
+            if text is not None:
+                self._entries.move_to_end(record.id)
+                return text
+        text = prepare_markdown(record.content)
+        with self._lock:
+            self._entries[record.id] = text
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return text
+
+
+# Process-wide cache shared by all sessions (record ids are process-unique)
+render_cache = RenderCache()
+
+
+def render_record(record: ChatRecord):
+    """Render one history record as a chat message."""
+    role = CHAT_ROLES.get(record.type)
+    if role is None:
+        return
+    with st.chat_message(role[0], avatar=role[1]):
+        st.markdown(render_cache.get(record))
+        if record.finish_reason in STOP_REASON_LABELS:
+            st.caption(f"⏹️ Stopped early: {STOP_REASON_LABELS[record.finish_reason]}")
+
+
+def render_pending(
+    conversation_id: str,
+    history: ChatHistory,
+    pending: PendingTurn,
+    resuming: bool,
+    can_resume: bool = True
+):
+    """
+    Render an interrupted turn with Continue (or Retry) / Discard controls.
+
+    Continuing sets st.session_state.continue_turn and reruns; app.py then
+    streams the rest of the answer (this function only draws the question
+    on that run).
+    """
+    with st.chat_message("user", avatar="👤"):
+        st.markdown(pending.user_text)
+    if resuming:
+        return
+
+    with st.chat_message("assistant", avatar="🤖"):
+        if pending.partial:
+            st.markdown(prepare_markdown(pending.partial))
+        st.warning(f"Answer interrupted: {pending.error}")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button(
+                "▶️ Continue" if pending.partial and can_resume else "🔁 Retry",
+                key=f"continue_{conversation_id}",
+                width="stretch"
+            ):
+                st.session_state.continue_turn = conversation_id
+                st.rerun()
+        with col2:
+            if st.button("🗑️ Discard", key=f"discard_{conversation_id}", width="stretch"):
+                history.pending = None
+                st.rerun()
+
+
+def render_transcript(
+    conversation_id: str,
+    history: ChatHistory,
+    window: Optional[int] = None,
+    resuming: bool = False,
+    can_resume: bool = True
+):
+    """
+    Render the newest messages of a conversation.
+
+    Older messages are hidden behind a "show earlier" button that widens the
+    window for this conversation by another TRANSCRIPT_WINDOW messages. An
+    interrupted turn is shown after the history.
+
+    Args:
+        conversation_id: Conversation id (keys the per-conversation window)
+        history: Conversation history
+        window: Initial number of messages to show (default TRANSCRIPT_WINDOW)
+        resuming: The pending turn is being continued on this run
+        can_resume: Partial answers are extended rather than retried
+    """
+    windows = st.session_state.setdefault("transcript_windows", {})
+    shown = windows.get(conversation_id, window or TRANSCRIPT_WINDOW)
+
+    records = history.records
+    hidden = max(0, len(records) - shown)
+    # Start on a user message so a turn is never split
+    if 0 < hidden < len(records) and records[hidden].type == "ai":
+        hidden -= 1
+
+    if hidden:
+        if st.button(
+            f"⬆️ Show earlier messages ({hidden} hidden)",
+            key=f"show_earlier_{conversation_id}",
+            type="tertiary"
+        ):
+            windows[conversation_id] = shown + TRANSCRIPT_WINDOW
+            st.rerun()
+
+    for record in records[hidden:]:
+        render_record(record)
+
+    if history.pending is not None:
+        render_pending(conversation_id, history, history.pending, resuming, can_resume)
@@ -3,7 +3,16 @@ Streamlit UI components - Sidebar only.
 Clean minimal version ready for redesign.
 """
 import streamlit as st
-from typing import Dict, Any
+from io import BytesIO
+from typing import Callable, Dict, Any
+
+from backend.archive import ArchiveError, ConversationArchive, merge_conversations
+from backend.frames import upload_types, video_supported
+from backend.history import ChatHistory
+from backend.sessions import SessionHandle, session_manager
+from backend.stopping import StopConditions
+from frontend.profiling import profile_section
+from frontend.search import render_search
 
 
 def render_welcome_screen():
@@ -41,7 +50,7 @@ def render_welcome_screen():
             <div style="background: linear-gradient(135deg, #9a1b74 0%, #ff6ec7 100%); border: 1px solid #9a1b74; border-radius: 10px; padding: 1.5rem;">
                 <h3 style="font-size: 20px; font-weight: 700; margin: 0 0 1rem 0; text-align: center; color: #FFFFFF; text-transform: uppercase; letter-spacing: 1px;">How it works</h3>
                 <p style="margin-bottom: 0.75rem; color: #F0F0F0; font-size: 15px; line-height: 1.5;"><strong style="color: #FFFFFF;">1.</strong> Click "New Chat" to start a conversation</p>
-                <p style="margin-bottom: 0.75rem; color: #F0F0F0; font-size: 15px; line-height: 1.5;"><strong style="color: #FFFFFF;">2.</strong> Upload an image (PNG, JPG, or JPEG)</p>
+                <p style="margin-bottom: 0.75rem; color: #F0F0F0; font-size: 15px; line-height: 1.5;"><strong style="color: #FFFFFF;">2.</strong> Upload an image (PNG, JPG, WebP or an animated GIF)</p>
                 <p style="margin-bottom: 0.75rem; color: #F0F0F0; font-size: 15px; line-height: 1.5;"><strong style="color: #FFFFFF;">3.</strong> Ask questions about your image in natural language</p>
                 <p style="margin-bottom: 0; color: #F0F0F0; font-size: 15px; line-height: 1.5;"><strong style="color: #FFFFFF;">4.</strong> Adjust model parameters in the sidebar to customize responses</p>
             </div>
@@ -51,6 +60,15 @@ def render_welcome_screen():
 
 
 
+def archive_exporter(handle: SessionHandle) -> Callable[[], bytes]:
+    """Archive of the session's conversations, built when the download is clicked."""
+    def export() -> bytes:
+        buffer = BytesIO()
+        session_manager.export(handle, buffer)
+        return buffer.getvalue()
+    return export
+
+
 def render_sidebar() -> Dict[str, Any]:
     """Render sidebar with conversation history and model controls."""
     
@@ -60,56 +78,65 @@ def render_sidebar() -> Dict[str, Any]:
     conversations = st.session_state.get("conversations", {})
     active_id = st.session_state.get("active_conversation_id")
     
-    if conversations:
-        sorted_convs = sorted(
-            conversations.items(),
-            key=lambda x: x[1]["created_at"],
-            reverse=True
-        )
+    # Message search across all conversations
+    with profile_section("search"):
+        render_search()
+    
+    with profile_section("conversations"):
+        if conversations:
+            sorted_convs = sorted(
+                conversations.items(),
+                key=lambda x: x[1]["created_at"],
+                reverse=True
+            )
         
-        for conv_id, conv_data in sorted_convs:
-            is_active = conv_id == active_id
+            for conv_id, conv_data in sorted_convs:
+                is_active = conv_id == active_id
             
-            col1, col2 = st.sidebar.columns([4, 1])
+                col1, col2 = st.sidebar.columns([4, 1])
             
-            with col1:
-                button_type = "primary" if is_active else "secondary"
-                if st.button(
-                    f"📷 {conv_data['title']}",
-                    key=f"conv_{conv_id}",
-                    width="stretch",
-                    type=button_type,
-                    help=f"Image: {conv_data['image_name']}"
-                ):
-                    st.session_state.switch_to_conversation = conv_id
-                    st.rerun()
+                with col1:
+                    button_type = "primary" if is_active else "secondary"
+                    if st.button(
+                        f"📷 {conv_data['title']}",
+                        key=f"conv_{conv_id}",
+                        width="stretch",
+                        type=button_type,
+                        help=f"Image: {conv_data['image_name']}"
+                    ):
+                        st.session_state.switch_to_conversation = conv_id
+                        st.rerun()
             
-            with col2:
-                if st.button(
-                    "🗑️",
-                    key=f"delete_{conv_id}",
-                    width="stretch",
-                    help="Delete"
-                ):
-                    del st.session_state.conversations[conv_id]
+                with col2:
+                    if st.button(
+                        "🗑️",
+                        key=f"delete_{conv_id}",
+                        width="stretch",
+                        help="Delete"
+                    ):
+                        del st.session_state.conversations[conv_id]
                     
-                    if is_active:
-                        st.session_state.active_conversation_id = None
-                        st.session_state.chat_memory.clear()
+                        if is_active:
+                            st.session_state.active_conversation_id = None
+                            # Detach (not clear) - the history belongs to the conversation
+                            st.session_state.vision_chain.memory = ChatHistory()
                     
-                    st.rerun()
-    else:
-        st.sidebar.info("No conversations")
+                        st.rerun()
+        else:
+            st.sidebar.info("No conversations")
     
     
     # Model Settings - Collapsible
-    with st.sidebar.expander("⚙️ Model Settings", expanded=False):
+    with profile_section("settings"), st.sidebar.expander("⚙️ Model Settings", expanded=False):
+        env_stop = StopConditions.from_env()
         DEFAULTS = {
             "temperature": 0.7,
             "max_tokens": 1024,
             "top_p": 0.9,
             "top_k": 40,
-            "presence_penalty": 0.0
+            "presence_penalty": 0.0,
+            "deadline": int(env_stop.deadline or 0),
+            "detect_loops": env_stop.detect_loops
         }
         
         use_defaults = st.session_state.get("use_default_params", False)
@@ -164,13 +191,76 @@ def render_sidebar() -> Dict[str, Any]:
             key=f"presence_penalty_{reset_counter}"
         )
         st.session_state._presence_penalty = presence_penalty
+        
+        # Client-side stop conditions (see backend.stopping)
+        stop_text = st.text_area(
+            "Stop Sequences",
+            value="" if use_defaults else st.session_state.get("_stop_text", ""),
+            height=68,
+            help="One per line; the answer ends before the first one that appears",
+            key=f"stop_text_{reset_counter}"
+        )
+        st.session_state._stop_text = stop_text
+        
+        deadline = st.number_input(
+            "Time Limit (s)",
+            min_value=0,
+            max_value=600,
+            value=DEFAULTS["deadline"] if use_defaults else st.session_state.get("_deadline", DEFAULTS["deadline"]),
+            step=10,
+            help="Stop the answer after this many seconds (0 = no limit)",
+            key=f"deadline_{reset_counter}"
+        )
+        st.session_state._deadline = deadline
+        
+        detect_loops = st.checkbox(
+            "Stop on Repetition",
+            value=DEFAULTS["detect_loops"] if use_defaults else st.session_state.get("_detect_loops", DEFAULTS["detect_loops"]),
+            help="End the answer when the model starts repeating itself",
+            key=f"detect_loops_{reset_counter}"
+        )
+        st.session_state._detect_loops = detect_loops
+    
+    
+    # Save / Restore - Collapsible
+    with profile_section("archive"), st.sidebar.expander("💾 Save / Restore", expanded=False):
+        if conversations:
+            # Built when clicked, so no archive bytes are kept in the session
+            st.download_button(
+                "⬇️ Download Archive",
+                data=archive_exporter(st.session_state.session_handle),
+                file_name="vision_ai_session.vai",
+                mime="application/octet-stream",
+                width="stretch",
+                key="download_archive_btn"
+            )
+        
+        archive_file = st.file_uploader(
+            "Restore Archive",
+            type=["vai"],
+            help="Restore conversations from an exported archive",
+            key="archive_uploader"
+        )
+        archive_id = (archive_file.name, archive_file.size) if archive_file is not None else None
+        if archive_id is not None and st.session_state.get("last_imported_archive") != archive_id:
+            st.session_state.last_imported_archive = archive_id
+            try:
+                archive = ConversationArchive(archive_file.getvalue())
+                restored = archive.to_conversations()
+                merge_conversations(st.session_state.conversations, restored)
+                if not archive.skipped:
+                    st.rerun()
+                st.warning(f"Restored {len(restored)} conversations; skipped {archive.skipped} damaged ones.")
+            except ArchiveError as e:
+                st.error(f"Could not restore archive: {e}")
     
     
     # Image Upload Section
     uploaded_file = st.sidebar.file_uploader(
         "📤 Upload Image",
-        type=["png", "jpg", "jpeg"],
-        help="Upload an image to start a new conversation"
+        type=upload_types(),
+        help="Upload an image" + (", animation or short video" if video_supported() else " or animation")
+             + " to start a new conversation"
     )
     
     st.sidebar.divider()
@@ -181,13 +271,14 @@ def render_sidebar() -> Dict[str, Any]:
     with col1:
         if st.button("🔄 New Chat", width="stretch", type="primary", key="new_chat_btn"):
             st.session_state.active_conversation_id = None
-            st.session_state.chat_memory.clear()
+            st.session_state.vision_chain.memory = ChatHistory()
             st.rerun()
     
     with col2:
         if st.button("⚡ Reset Params", width="stretch", type="secondary", key="reset_params_btn"):
             st.session_state.param_reset_counter = reset_counter + 1
-            for key in ["_temperature", "_max_tokens", "_top_p", "_top_k", "_presence_penalty"]:
+            for key in ["_temperature", "_max_tokens", "_top_p", "_top_k", "_presence_penalty",
+                        "_stop_text", "_deadline", "_detect_loops"]:
                 if key in st.session_state:
                     del st.session_state[key]
             st.session_state.use_default_params = True
@@ -200,5 +291,10 @@ def render_sidebar() -> Dict[str, Any]:
         "top_p": top_p,
         "top_k": top_k,
         "presence_penalty": presence_penalty,
+        "stop": StopConditions(
+            stop_sequences=tuple(line for line in stop_text.splitlines() if line),
+            deadline=float(deadline) or None,
+            detect_loops=detect_loops
+        ),
         "uploaded_file": uploaded_file
     }
@@ -0,0 +1,104 @@
+"""
+Shared fixtures: a local mock of the Qubrid chat completions endpoint.
+Run the suite from the repository root with `python -m pytest`.
+"""
+import http.server
+import json
+import threading
+import time
+from typing import Any, Dict, List
+
+import pytest
+
+
+class MockUpstream:
+    """
+    Streaming chat completions server on a free local port.
+
+    Records every request (headers and raw body) and answers with SSE
+    content deltas, an error status, or a delayed first token.
+    """
+
+    def __init__(self, name: str, status: int = 200, delay: float = 0.0, tokens=("a", "b")):
+        self.name = name
+        self.status = status
+        self.delay = delay
+        self.tokens = list(tokens)
+        self.requests: List[Dict[str, Any]] = []
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._server.server_port}/chat"
+
+    def _handler(self):
+        upstream = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                chunked = self.headers.get("Transfer-Encoding", "").lower() == "chunked"
+                body = self._read_chunked() if chunked else self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                upstream.requests.append({"headers": dict(self.headers), "body": body, "chunked": chunked})
+                if upstream.status != 200:
+                    self.send_response(upstream.status)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                time.sleep(upstream.delay)
+                try:
+                    for token in upstream.tokens:
+                        delta = {"choices": [{"delta": {"content": f"{upstream.name}:{token} "}}]}
+                        self.wfile.write(b"data: " + json.dumps(delta).encode() + b"\n\n")
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except OSError:
+                    # Client closed the losing hedge attempt
+                    pass
+
+            def _read_chunked(self) -> bytes:
+                parts = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return b"".join(parts)
+                    parts.append(self.rfile.read(size))
+                    self.rfile.readline()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    """Factory for MockUpstream servers, shut down after the test."""
+    servers: List[MockUpstream] = []
+
+    def make(name: str = "up", **behavior) -> MockUpstream:
+        server = MockUpstream(name, **behavior)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def client_env(monkeypatch):
+    """Environment for constructing QubridVisionLLM without a real key."""
+    monkeypatch.setenv("QUBRID_API_KEY", "test-key")
+    monkeypatch.delenv("QUBRID_ROUTES", raising=False)
+    monkeypatch.delenv("QUBRID_STREAM_UPLOAD", raising=False)
+    return monkeypatch
@@ -0,0 +1,71 @@
+"""
+Chunked request upload (QUBRID_STREAM_UPLOAD=1): the body is streamed with
+Transfer-Encoding: chunked and arrives byte-for-byte as the joined body.
+"""
+import base64
+import json
+import os
+
+import pytest
+
+from backend.history import ChatHistory, format_text_message
+from backend.qubrid_client import QubridVisionLLM
+from backend.request_body import ImageBlockStream, RequestBody, encode_json, encode_user_message
+from backend.router import Endpoint, ModelRouter
+
+
+def _messages(raw: bytes):
+    history = ChatHistory()
+    history.add_user_message("What is this?")
+    history.add_ai_message("A test pattern with ünïcode.")
+    image = ImageBlockStream(raw, "image/png", chunk_size=3000)
+    question = encode_json({"type": "text", "text": "And now?"})
+    return [encode_json(format_text_message("system", "sys"))] + history.encoded_messages() + [
+        encode_user_message([image, question])
+    ]
+
+
+def _client(url: str) -> QubridVisionLLM:
+    client = QubridVisionLLM()
+    client.router = ModelRouter([Endpoint(url, "test-model", "test-key")])
+    return client
+
+
+@pytest.mark.parametrize("stream_upload", ["1", "0"])
+def test_body_received_intact(client_env, upstream, stream_upload):
+    client_env.setenv("QUBRID_STREAM_UPLOAD", stream_upload)
+    server = upstream("up")
+    raw = os.urandom(100_000)
+
+    answer = "".join(_client(server.url).stream(_messages(raw)))
+
+    assert answer == "up:a up:b "
+    [request] = server.requests
+    headers = {k.lower(): v for k, v in request["headers"].items()}
+    if stream_upload == "1":
+        assert request["chunked"]
+        assert "content-length" not in headers
+    else:
+        assert not request["chunked"]
+        assert int(headers["content-length"]) == len(request["body"])
+
+    payload = json.loads(request["body"])
+    assert payload["model"] == "test-model"
+    assert [m["role"] for m in payload["messages"]] == ["system", "user", "assistant", "user"]
+    assert payload["messages"][2]["content"][0]["text"] == "A test pattern with ünïcode."
+    image_block, text_block = payload["messages"][-1]["content"]
+    prefix = "data:image/png;base64,"
+    assert image_block["image_url"]["url"].startswith(prefix)
+    assert base64.b64decode(image_block["image_url"]["url"][len(prefix):]) == raw
+    assert text_block == {"type": "text", "text": "And now?"}
+
+
+def test_chunks_join_to_buffered_body():
+    messages = _messages(os.urandom(10_001))
+    body = RequestBody({"model": "m", "stream": True}, messages)
+
+    chunks = list(body.iter_chunks())
+
+    assert len(chunks) > 1
+    assert b"".join(chunks) == body.to_bytes()
+    assert len(body) == len(body.to_bytes())
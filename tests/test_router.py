@@ -0,0 +1,76 @@
+"""
+Endpoint routing: failover, hedging and the latency statistics they record.
+"""
+from backend.qubrid_client import QubridVisionLLM
+from backend.router import DEFAULT_LATENCY, Endpoint, ModelRouter
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def _client(router: ModelRouter) -> QubridVisionLLM:
+    client = QubridVisionLLM()
+    client.router = router
+    return client
+
+
+def test_failover_from_error_status(client_env, upstream):
+    broken, healthy = upstream("broken", status=503), upstream("healthy")
+    bad, good = Endpoint(broken.url, "m", "k"), Endpoint(healthy.url, "m", "k")
+    router = ModelRouter([bad, good], hedge_delay=0)
+
+    answer = "".join(_client(router).stream(MESSAGES))
+
+    assert answer == "healthy:a healthy:b "
+    assert len(broken.requests) == 1 and len(healthy.requests) == 1
+    assert bad.error_rate > 0 and bad.last_failure > 0
+    assert bad.samples == 0 and bad.latency == DEFAULT_LATENCY
+    assert good.samples == 1 and good.latency < DEFAULT_LATENCY
+    assert good.in_flight == 0 and bad.in_flight == 0
+    assert router.plan()[0] is good
+
+
+def test_hedge_wins_and_loser_is_not_recorded_fast(client_env, upstream):
+    slow_server, fast_server = upstream("slow", delay=1.0), upstream("fast")
+    slow, fast = Endpoint(slow_server.url, "m", "k"), Endpoint(fast_server.url, "m", "k")
+    # Looks best on paper, so it is tried first
+    slow.latency = 0.1
+    router = ModelRouter([slow, fast], hedge_delay=0.2)
+
+    answer = "".join(_client(router).stream(MESSAGES))
+
+    assert answer == "fast:a fast:b "
+    assert len(slow_server.requests) == 1 and len(fast_server.requests) == 1
+    # Measured from the hedge's own start, not the original request's
+    assert fast.samples == 1 and fast.latency < 0.2
+    # The abandoned attempt only raises the estimate (lower bound of ~0.2s)
+    assert slow.latency >= 0.2
+    assert slow.error_rate == 0.0
+    assert router.plan()[0] is fast
+
+
+def test_record_slow_never_lowers_latency():
+    endpoint = Endpoint("http://x", "m", "k")
+    router = ModelRouter([endpoint])
+    router.record_success(endpoint, 2.0)
+
+    router.record_slow(endpoint, 0.5)
+    assert endpoint.latency == 2.0
+
+    router.record_slow(endpoint, 4.0)
+    assert endpoint.latency > 2.0
+
+
+def test_plan_keeps_requests_within_their_tier():
+    default = Endpoint("http://default", "big", "k")
+    fast = Endpoint("http://fast", "small", "k", tier="fast")
+    # Broken default endpoint: still no fallback to the fast model
+    ModelRouter([default]).record_failure(default)
+
+    router = ModelRouter([default, fast])
+    assert router.plan() == [default]
+    assert router.plan("fast") == [fast]
+    assert router.plan("unknown") == [default]
+
+    router = ModelRouter([default, fast], cross_tier=True)
+    assert router.plan() == [default, fast]
+    assert router.plan("fast") == [fast, default]
@@ -0,0 +1,124 @@
+"""
+Span tracing: the in-memory span tree and trace propagation upstream.
+"""
+import re
+
+import pytest
+
+from backend import tracing
+from backend.qubrid_client import QubridVisionLLM
+from backend.router import Endpoint, ModelRouter
+from backend.tracing import MemoryTracer, format_flame, mark, span, trace_headers
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-01$")
+
+
+@pytest.fixture
+def tracer():
+    """Install a MemoryTracer for the test, restoring the previous tracer after."""
+    previous = tracing.get_tracer()
+    memory = MemoryTracer()
+    tracing.set_tracer(memory)
+    yield memory
+    tracing.set_tracer(previous)
+
+
+def test_span_tree(tracer):
+    with span("chat.turn", image="x") as root:
+        with span("chain.build_messages") as build:
+            pass
+        with span("llm.request") as request:
+            mark("llm.ttft", request, model="m")
+
+    spans = {s.name: s for s in tracer.spans()}
+    assert set(spans) == {"chat.turn", "chain.build_messages", "llm.request", "llm.ttft"}
+    assert {s.trace_id for s in spans.values()} == {root.trace_id}
+    assert tracer.trace_ids() == [root.trace_id]
+    assert root.parent_id is None
+    assert build.parent_id == root.span_id
+    assert request.parent_id == root.span_id
+    assert spans["llm.ttft"].parent_id == request.span_id
+    assert spans["llm.ttft"].start == request.start
+    assert spans["llm.ttft"].attributes == {"model": "m"}
+    assert root.attributes == {"image": "x"}
+    assert all(s.end is not None and s.duration >= 0 for s in spans.values())
+
+    lines = format_flame(tracer.spans()).splitlines()
+    assert [line.split()[0] for line in lines] == [
+        "chat.turn", "chain.build_messages", "llm.request", "llm.ttft"
+    ]
+    assert lines[1].startswith("  chain.build_messages")
+    assert lines[3].startswith("    llm.ttft")
+
+
+def test_separate_traces_and_limit():
+    tracer = MemoryTracer(max_traces=2)
+    ids = []
+    for name in ("a", "b", "c"):
+        with tracer.span(name) as root:
+            ids.append(root.trace_id)
+
+    assert len(set(ids)) == 3
+    assert tracer.trace_ids() == ids[1:]
+    assert tracer.spans(ids[0]) == []
+    assert [s.name for s in tracer.spans()] == ["c"]
+
+
+def test_trace_headers(tracer):
+    assert trace_headers() == {}
+    with span("chat.turn") as root:
+        with span("llm.request") as request:
+            headers = trace_headers()
+
+    assert headers["X-Request-ID"] == root.trace_id
+    assert TRACEPARENT.match(headers["traceparent"]).groups() == (root.trace_id, request.span_id)
+
+
+def test_traceparent_sent_upstream(tracer, client_env, upstream):
+    server = upstream("up")
+    client = QubridVisionLLM()
+    client.router = ModelRouter([Endpoint(server.url, "m", "k")])
+
+    with span("chat.turn") as root:
+        answer = "".join(client.stream([{"role": "user", "content": "hi"}]))
+
+    assert answer == "up:a up:b "
+    [request] = server.requests
+    headers = {k.lower(): v for k, v in request["headers"].items()}
+    trace_id, parent_id = TRACEPARENT.match(headers["traceparent"]).groups()
+    assert trace_id == root.trace_id == headers["x-request-id"]
+
+    # The attempt thread's spans nest under the request span of this trace
+    spans = {s.name: s for s in tracer.spans(root.trace_id)}
+    assert spans["http.connect"].span_id == parent_id
+    assert spans["http.connect"].parent_id == spans["llm.request"].span_id
+    assert spans["request.serialize"].parent_id == spans["llm.request"].span_id
+    assert spans["llm.request"].parent_id == root.span_id
+    assert spans["llm.ttft"].parent_id == spans["llm.request"].span_id
+
+
+def test_opentelemetry_export_keeps_ids(monkeypatch):
+    otel_trace = pytest.importorskip("opentelemetry.trace")
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    provider = sdk_trace.TracerProvider()
+    exporter = InMemorySpanExporter()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    id_generator = provider.id_generator
+    monkeypatch.setattr(otel_trace, "get_tracer_provider", lambda: provider)
+    tracer = tracing.OpenTelemetryTracer()
+
+    with tracer.span("chat.turn") as root:
+        with tracer.span("llm.request") as request:
+            tracer.mark("llm.ttft", request)
+
+    # The global provider keeps its own id generator
+    assert provider.id_generator is id_generator
+    exported = {s.name: s for s in exporter.get_finished_spans()}
+    assert {format(s.context.trace_id, "032x") for s in exported.values()} == {root.trace_id}
+    assert format(exported["llm.request"].context.span_id, "016x") == request.span_id
+    assert exported["chat.turn"].parent is None
+    assert exported["llm.request"].parent.span_id == exported["chat.turn"].context.span_id
+    assert exported["llm.ttft"].parent.span_id == exported["llm.request"].context.span_id